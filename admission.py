@@ -0,0 +1,232 @@
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from starlette.responses import JSONResponse
+from notifications import TokenBucket
+
+# Requests per second each client may make, and how many it may send back to back
+# (an agent registers once, then heartbeats every HEARTBEAT_INTERVAL); 0 turns the limit off
+CLIENT_RATE = float(os.getenv("ADMISSION_RATE", "2"))
+CLIENT_BURST = int(os.getenv("ADMISSION_BURST", "30"))
+# Requests handled at once per route class before new ones are shed with a 503
+MAX_IN_FLIGHT = {
+    "write": int(os.getenv("ADMISSION_MAX_WRITES", "32")),
+    "read": int(os.getenv("ADMISSION_MAX_READS", "128")),
+}
+# Counted but never capped: heartbeats only touch memory, and shedding them would
+# mark healthy clients offline; an event stream holds its request for hours
+UNCAPPED_PATHS = {"/clients/heartbeat": "buffered", "/dashboard/events": "stream"}
+# Shortest and longest Retry-After, in seconds, sent with a 503; in between it grows
+# with the callers already sent away, so they come back no faster than requests finish
+BUSY_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 30
+# Buckets kept before the least recently used are dropped (a dropped bucket restarts full)
+MAX_CLIENTS = 20000
+# Clients not registered yet are keyed by address. Comma-separated peer addresses of reverse
+# proxies whose X-Forwarded-For names the client (uvicorn only rewrites it for 127.0.0.1);
+# otherwise everyone behind such a proxy shares one bucket
+TRUSTED_PROXIES = frozenset(
+    address.strip() for address in os.getenv("ADMISSION_TRUSTED_PROXIES", "").split(",") if address.strip()
+)
+# "address", or "client_id" to key unregistered clients on the X-Client-ID they send: for
+# fleets behind one NAT without a proxy header, at the cost of a bucket per made-up ID
+UNKNOWN_KEY = os.getenv("ADMISSION_UNKNOWN_KEY", "address")
+# Not limited: static assets and the metrics scrape
+EXEMPT_PREFIXES = ("/static/", "/metrics")
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class AdmissionControl:
+    """
+    Decide whether a request may run before any handler opens a DB session.
+
+    Each client gets a token bucket; an empty bucket is a 429. The key is its
+    X-Client-ID header when known() says that client is registered, otherwise
+    its address (see TRUSTED_PROXIES and UNKNOWN_KEY), so made-up IDs neither
+    dodge the limit nor grow the table.
+    Writes, which contend for the SQLite writer, and reads each have an
+    in-flight cap; a full class is a 503. Both carry the Retry-After the client
+    should wait. Limits are per worker process; each runs on one event loop,
+    so the counters need no lock.
+    """
+
+    def __init__(self, rate=CLIENT_RATE, burst=CLIENT_BURST, limits=None, max_clients=MAX_CLIENTS, known=None,
+                 trusted_proxies=TRUSTED_PROXIES, unknown_key=UNKNOWN_KEY):
+        if unknown_key not in ("address", "client_id"):
+            raise ValueError(f"Unknown ADMISSION_UNKNOWN_KEY: {unknown_key}")
+        self.rate = rate
+        self.burst = burst
+        self.limits = dict(limits or MAX_IN_FLIGHT)
+        self.max_clients = max_clients
+        # Whether a client ID is registered; app.py wires in liveness.known
+        self.known = known or (lambda client_id: False)
+        self.trusted_proxies = frozenset(trusted_proxies)
+        self.unknown_key = unknown_key
+        self._buckets = OrderedDict()
+        self.in_flight = {route_class: 0 for route_class in ("write", "read", *UNCAPPED_PATHS.values())}
+        # Per capped class: requests finished since the last roll, whether it was full
+        # meanwhile, the rate per second it finishes requests at when full (until
+        # measured, its cap per second), and the shed callers still expected back
+        self._finished = dict.fromkeys(self.limits, 0)
+        self._full = dict.fromkeys(self.limits, False)
+        self._throughput = {route_class: float(limit) for route_class, limit in self.limits.items()}
+        self._deferred = dict.fromkeys(self.limits, 0.0)
+        self._rolled = time.monotonic()
+        self.admitted = 0
+        self.rate_limited = 0
+        self.shed = 0
+
+    @staticmethod
+    def route_class(method, path):
+        """"write", "read", an uncapped class, or None for requests that are not limited."""
+        if path.startswith(EXEMPT_PREFIXES):
+            return None
+        uncapped = UNCAPPED_PATHS.get(path)
+        if uncapped is not None:
+            return uncapped
+        return "read" if method in READ_METHODS else "write"
+
+    def client_key(self, scope):
+        """The request's X-Client-ID if that client is registered (or unknown_key says so), otherwise its address."""
+        client_id, forwarded = None, []
+        for name, value in scope["headers"]:
+            if name == b"x-client-id" and value:
+                client_id = value.decode("latin-1")
+            elif name == b"x-forwarded-for":
+                forwarded.append(value.decode("latin-1"))
+        if client_id is not None and (self.unknown_key == "client_id" or self.known(client_id)):
+            return "id:" + client_id
+        return "ip:" + self.address(scope, forwarded)
+
+    def address(self, scope, forwarded=()):
+        """The peer address, or behind a trusted proxy the nearest X-Forwarded-For hop it did not add."""
+        peer = scope.get("client")
+        address = peer[0] if peer else "unknown"
+        if address in self.trusted_proxies:
+            for hop in reversed(",".join(forwarded).split(",")):
+                hop = hop.strip()
+                if hop and hop not in self.trusted_proxies:
+                    return hop
+        return address
+
+    def _bucket(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._expire(now)
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _expire(self, now):
+        """Drop least recently used buckets that have refilled, and any over max_clients."""
+        idle = self.burst / self.rate
+        while self._buckets:
+            bucket = next(iter(self._buckets.values()))
+            if len(self._buckets) < self.max_clients and now - bucket.updated < idle:
+                break
+            self._buckets.popitem(last=False)
+
+    def _roll(self, now):
+        """Update each class's throughput about once a second, and let deferred callers drain at it."""
+        elapsed = now - self._rolled
+        if elapsed < 1:
+            return
+        for route_class, finished in self._finished.items():
+            rate = finished / elapsed
+            previous = self._throughput[route_class]
+            # Below its cap a class finishes only what arrives, which says nothing of what it could
+            if self._full[route_class] or rate > previous:
+                self._throughput[route_class] = (previous + rate) / 2
+            self._deferred[route_class] = max(0.0, self._deferred[route_class] - max(rate, self._throughput[route_class]) * elapsed)
+            self._finished[route_class] = 0
+            self._full[route_class] = False
+        self._rolled = now
+
+    def _busy_retry_after(self, route_class):
+        """Seconds until this shed caller's turn, given those sent away before it."""
+        self._deferred[route_class] += 1
+        wait = math.ceil(self._deferred[route_class] / max(self._throughput[route_class], 1.0))
+        return min(MAX_RETRY_AFTER, max(BUSY_RETRY_AFTER, wait))
+
+    def acquire(self, key, route_class, now=None):
+        """
+        Admit a request, counting it in flight until release(); otherwise
+        return (status, retry_after_seconds) to send back instead.
+        """
+        now = now or time.monotonic()
+        # The client's own limit first, so one runaway client cannot fill the shared slots
+        if self.rate > 0:
+            bucket = self._bucket(key, now)
+            if not bucket.take(now):
+                self.rate_limited += 1
+                logging.debug("Rate limited %s.", key, extra={"event": "admission"})
+                return 429, max(1, math.ceil(bucket.wait_time(now)))
+        self._roll(now)
+        limit = self.limits.get(route_class)
+        if limit is not None and self.in_flight[route_class] >= limit:
+            self.shed += 1
+            self._full[route_class] = True
+            logging.debug("Shed %s request from %s.", route_class, key, extra={"event": "admission"})
+            return 503, self._busy_retry_after(route_class)
+        self.in_flight[route_class] += 1
+        self.admitted += 1
+        return None
+
+    def release(self, route_class):
+        self.in_flight[route_class] -= 1
+        if route_class in self._finished:
+            self._finished[route_class] += 1
+
+    def stats(self):
+        """Return admission counters."""
+        return {
+            "admitted": self.admitted,
+            "rate_limited": self.rate_limited,
+            "shed": self.shed,
+            "in_flight": dict(self.in_flight),
+            "limits": dict(self.limits),
+            "throughput": {route_class: round(rate, 1) for route_class, rate in self._throughput.items()},
+            "deferred": {route_class: round(count) for route_class, count in self._deferred.items()},
+            "clients_tracked": len(self._buckets),
+            "rate": self.rate,
+            "burst": self.burst,
+            "unknown_key": self.unknown_key,
+        }
+
+
+# Shared by AdmissionMiddleware and /stats/admission
+admission = AdmissionControl()
+
+
+class AdmissionMiddleware:
+    """
+    Plain ASGI middleware, so a rejection costs no Request object, no
+    routing and no DB session: just the 429/503 with Retry-After.
+    """
+
+    def __init__(self, app, control=admission):
+        self.app = app
+        self.control = control
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route_class = self.control.route_class(scope["method"], scope["path"])
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+        rejected = self.control.acquire(self.control.client_key(scope), route_class)
+        if rejected is not None:
+            status, retry_after = rejected
+            detail = "Too many requests" if status == 429 else "Server busy"
+            response = JSONResponse({"detail": detail}, status_code=status, headers={"Retry-After": str(retry_after)})
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.control.release(route_class)
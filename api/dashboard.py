@@ -0,0 +1,113 @@
+import asyncio
+import os
+from typing import Optional
+from urllib.parse import urlencode
+from fastapi import APIRouter, Header, Request
+from fastapi.responses import StreamingResponse
+from fastapi.templating import Jinja2Templates
+from client_view import client_view, PAGE_SIZE, _last_seen
+from liveness import liveness
+
+router = APIRouter()
+templates = Jinja2Templates(directory=os.path.join(os.path.dirname(os.path.dirname(__file__)), "templates"))
+
+# Seconds between keep-alive comments on an idle event stream
+KEEPALIVE_INTERVAL = 15
+
+def current_page(after, limit, state, status, ip):
+    """A page of rows with last-seen times fresh from the liveness index."""
+    rows, next_cursor = client_view.page(
+        after=after or None, limit=limit, state=state or None, status=status or None, ip=ip or None
+    )
+    for row in rows:
+        online, last_seen = liveness.status(row["client_id"])
+        if online != "unknown":
+            row["status"], row["last_seen"] = online, _last_seen(last_seen)
+    return rows, next_cursor
+
+def render(template, request, after, limit, state, status, ip):
+    # Read before the rows, so diffs published meanwhile are replayed rather than missed
+    version = client_view.version
+    rows, next_cursor = current_page(after, limit, state, status, ip)
+    filters = {"state": state or "", "status": status or "", "ip": ip or "", "limit": limit}
+    query = {key: value for key, value in filters.items() if value and value != PAGE_SIZE}
+    # The page covers client IDs after the cursor up to its last row (or the end)
+    stream = {key: value for key, value in query.items() if key != "limit"}
+    stream["since"] = version
+    if after:
+        stream["after"] = after
+    if next_cursor:
+        stream["until"] = next_cursor
+    return templates.TemplateResponse(request, template, {
+        "clients": rows,
+        "filters": filters,
+        "after": after,
+        "next_url": f"?{urlencode({**query, 'after': next_cursor})}" if next_cursor else None,
+        "first_url": f"?{urlencode(query)}" if after else None,
+        "events_url": f"/dashboard/events?{urlencode(stream)}",
+        "total": client_view.count(),
+        "version": version,
+    })
+
+@router.get("/")
+@router.get("/dashboard")
+async def dashboard_page(request: Request, after: Optional[str] = None, limit: int = PAGE_SIZE,
+                         state: Optional[str] = None, status: Optional[str] = None, ip: Optional[str] = None):
+    """Schedule and pause controls for one page of clients."""
+    return render("dashboard.html", request, after, limit, state, status, ip)
+
+@router.get("/clients")
+async def clients_page(request: Request, after: Optional[str] = None, limit: int = PAGE_SIZE,
+                       state: Optional[str] = None, status: Optional[str] = None, ip: Optional[str] = None):
+    """Last-seen and online status for one page of clients."""
+    return render("clients.html", request, after, limit, state, status, ip)
+
+@router.get("/manage")
+async def manage_page(request: Request, after: Optional[str] = None, limit: int = PAGE_SIZE,
+                      state: Optional[str] = None, status: Optional[str] = None, ip: Optional[str] = None):
+    """Compact pause/unpause page."""
+    return render("manage.html", request, after, limit, state, status, ip)
+
+@router.get("/dashboard/clients")
+async def dashboard_clients(after: Optional[str] = None, limit: int = PAGE_SIZE,
+                            state: Optional[str] = None, status: Optional[str] = None, ip: Optional[str] = None):
+    """One page of dashboard rows as JSON; pass `next` back as `after` for the following page."""
+    rows, next_cursor = current_page(after, limit, state, status, ip)
+    return {"clients": rows, "next": next_cursor, "total": client_view.count(), "version": client_view.version}
+
+@router.get("/dashboard/events")
+async def dashboard_events(request: Request, after: Optional[str] = None, until: Optional[str] = None,
+                           state: Optional[str] = None, status: Optional[str] = None, ip: Optional[str] = None,
+                           since: Optional[int] = None, last_event_id: Optional[str] = Header(None)):
+    """
+    Server-Sent Events with row diffs for one dashboard page:
+    {"version", "rows": [changed rows], "removed": [client_ids no longer matching]},
+    or {"reload": true} when the browser fell behind.
+    Diffs start after `since`, the version the page was rendered at, or after
+    the Last-Event-ID a reconnecting browser sends.
+    """
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+    subscriber = client_view.subscribe(since=since, state=state, status=status, ip=ip, after=after, until=until)
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield client_view.event(message)
+                if message.get("reload"):
+                    return
+        finally:
+            client_view.unsubscribe(subscriber)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@router.get("/stats/client-view")
+async def get_client_view_stats():
+    """Report dashboard view counters."""
+    return client_view.stats()
@@ -1,14 +1,31 @@
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Response
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from datetime import datetime
-from db import SessionLocal
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timedelta
+from starlette.concurrency import run_in_threadpool
+from db import get_stats
+from async_db import (
+    AsyncReadSessionLocal, write_lock, get_async_db, resolve_clients, bulk_set_schedule, bulk_set_state,
+    load_client_records,
+)
 from models import Client, Schedule
+from heartbeat_buffer import heartbeat_buffer
+from client_cache import client_cache
+from schedule_engine import schedule_engine
+from fleet_status import fleet_status
+from ws_hub import hub, Payload
+from liveness import liveness
+from availability import availability_log, PERIODS, DAILY_RETENTION_DAYS
+from client_view import client_view
+from weekly_schedule import WeeklySchedule, schedule_columns
+from notifications import notifier
+from admission import admission
+from metrics import websocket_messages
 from fastapi import WebSocket, WebSocketDisconnect
 import logging
 
-# Connected WebSocket clients dictionary
-connected_clients = {}
 router = APIRouter()
 
 class ClientRegistration(BaseModel):
@@ -18,119 +35,431 @@ class ClientRegistration(BaseModel):
 class HeartbeatUpdate(BaseModel):
     client_id: str
     ip: str
+    # Agent's current schedule version; when sent, a newer schedule rides back on the response
+    version: Optional[str] = None
 
 class ScheduleUpdate(BaseModel):
     client_id: str
-    disable_time: str
-    enable_time: str
+    # Either a daily window...
+    disable_time: Optional[str] = None
+    enable_time: Optional[str] = None
+    # ...or weekly windows and date exceptions (see weekly_schedule.normalize_rules)
+    windows: Optional[List[Dict[str, Any]]] = None
+    exceptions: Optional[List[Dict[str, Any]]] = None
+
+class StateUpdate(BaseModel):
+    client_id: str
+    state: str
+
+class ClientSelector(BaseModel):
+    all: bool = False
+    ip_prefix: Optional[str] = None
+    state: Optional[str] = None
+
+class BulkUpdate(BaseModel):
+    client_ids: Optional[List[str]] = None
+    selector: Optional[ClientSelector] = None
+    action: str  # "schedule", "pause" or "unpause"
+    disable_time: Optional[str] = None
+    enable_time: Optional[str] = None
+    windows: Optional[List[Dict[str, Any]]] = None
+    exceptions: Optional[List[Dict[str, Any]]] = None
+
+class BroadcastMessage(BaseModel):
+    action: str  # "enforce" or "shutdown"
+
+CLIENT_STATES = ("paused", "unpaused")
+BROADCAST_ACTIONS = ("enforce", "shutdown")
+BULK_ACTIONS = {"schedule": None, "pause": "paused", "unpause": "unpaused"}
+
+def schedule_body(client):
+    """
+    The schedule as sent to agents, or None: the daily pair (None for weekly
+    rules) plus the compiled intervals the agent enforces.
+    """
+    schedule = client.weekly_schedule()
+    if schedule is None:
+        return None
+    return {
+        "disable_time": client.disable_time,
+        "enable_time": client.enable_time,
+        "intervals": schedule.to_compiled(),
+    }
+
+def schedule_message(client):
+    """Build the versioned schedule/state message pushed to an agent."""
+    return {"schedule": schedule_body(client), "state": client.state, "version": client.version}
+
+def validated_columns(data):
+    """Schedule column values from a request body; 400 if neither form is valid."""
+    try:
+        return schedule_columns(data.disable_time, data.enable_time, data.windows, data.exceptions)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid schedule: {e}")
+
+def schedule_payloads(records):
+    """(client_id, Payload) per record; records with the same version share one encoded message."""
+    payloads = {}
+    targets = []
+    for record in records:
+        payload = payloads.get(record.version)
+        if payload is None:
+            payload = payloads[record.version] = Payload(schedule_message(record))
+        targets.append((record.client_id, payload))
+    return targets
+
+async def push_client_update(client_id, client=None):
+    """Queue the client's current schedule/state on its socket, if connected to this worker."""
+    if not hub.is_local(client_id):
+        return False
+    client = client or await client_cache.get_async(client_id)
+    if client is None:
+        return False
+    return hub.send_local(client_id, schedule_message(client))
+
+async def push_transition(client_id, blocked):
+    """Tell a connected agent to re-evaluate its schedule at a transition instant."""
+    # Every worker runs the schedule engine, so each one only pokes its own sockets
+    return hub.send_local(client_id, {"action": "enforce", "blocked": blocked})
+
+async def refresh_clients(client_ids):
+    """
+    Run when another worker wrote these clients: reload them into this
+    worker's caches, schedule engine and dashboard view, and push their new
+    state to the ones connected here.
+    """
+    client_cache.invalidate_many(client_ids)
+    fleet_status.invalidate()
+    # The dashboard view covers every client, not only the ones connected here
+    async with AsyncReadSessionLocal() as db:
+        records = client_cache.put_many(await load_client_records(client_ids, db))
+    # Every worker's engine records transitions in the availability log, so
+    # each keeps every client's schedule current; only the push is local
+    for record in records:
+        client_view.put(record)
+        try:
+            schedule_engine.update(record.client_id, record.weekly_schedule())
+        except ValueError as e:
+            logging.error(f"Skipping schedule for {record.client_id}: {e}")
+    hub.fan_out(schedule_payloads([record for record in records if hub.is_local(record.client_id)]))
+
+hub.set_refresh_handler(refresh_clients)
 
 @router.post("/clients/register")
-async def register_client(data: ClientRegistration, db: Session = Depends(SessionLocal)):
+async def register_client(data: ClientRegistration, db: AsyncSession = Depends(get_async_db)):
     try:
-        existing_client = db.query(Client).filter(Client.client_id == data.client_id).first()
-        if existing_client:
-            existing_client.ip = data.ip
-            existing_client.last_heartbeat = datetime.utcnow()
-        else:
-            new_client = Client(
-                client_id=data.client_id,
-                ip=data.ip,
-                state="unpaused",
-                registered_at=datetime.utcnow(),
-                last_heartbeat=datetime.utcnow()
-            )
-            db.add(new_client)
-        db.commit()
+        async with write_lock:
+            result = await db.execute(select(Client).where(Client.client_id == data.client_id))
+            existing_client = result.scalars().first()
+            if existing_client:
+                existing_client.ip = data.ip
+                existing_client.last_heartbeat = datetime.utcnow()
+            else:
+                new_client = Client(
+                    client_id=data.client_id,
+                    ip=data.ip,
+                    state="unpaused",
+                    registered_at=datetime.utcnow(),
+                    last_heartbeat=datetime.utcnow()
+                )
+                db.add(new_client)
+            await db.commit()
+        client_cache.invalidate(data.client_id)
+        fleet_status.invalidate()
+        client = await client_cache.get_async(data.client_id)
+        if client is not None:
+            client_view.put(client)
+        # After the view has the row, so it picks up the online event
+        liveness.seen(data.client_id)
+        hub.publish_refresh([data.client_id])
         return {"status": "success", "client_id": data.client_id}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to register client: {str(e)}")
 
 @router.post("/clients/heartbeat")
-async def update_heartbeat(data: HeartbeatUpdate, db: Session = Depends(SessionLocal)):
+async def update_heartbeat(data: HeartbeatUpdate):
     try:
-        client = db.query(Client).filter(Client.client_id == data.client_id).first()
+        client = await client_cache.get_async(data.client_id)
         if not client:
             raise HTTPException(status_code=404, detail="Client not registered.")
-        client.ip = data.ip
-        client.last_heartbeat = datetime.utcnow()
-        db.commit()
+        # Written to the database by the heartbeat buffer's next flush
+        if not heartbeat_buffer.record(data.client_id, data.ip):
+            raise HTTPException(status_code=503, detail="Heartbeat buffer full.")
+        liveness.seen(data.client_id)
+        client_cache.update_ip(data.client_id, data.ip)
+        client_view.update(data.client_id, ip=data.ip)
+        if data.version is not None and data.version != client.version:
+            return {"status": "success", "update": schedule_message(client)}
         return {"status": "success"}
+    except HTTPException:
+        raise
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to update heartbeat: {str(e)}")
 
+@router.get("/stats/heartbeats")
+async def get_heartbeat_stats():
+    """Report heartbeat buffer counters."""
+    return heartbeat_buffer.stats()
+
+@router.get("/stats/admission")
+async def get_admission_stats():
+    """Report admission control counters."""
+    return admission.stats()
+
+@router.get("/reports/availability/{client_id}")
+async def get_availability_report(
+    client_id: str, period: str = "hour", days: int = Query(1, ge=1, le=DAILY_RETENTION_DAYS)
+):
+    """Online/paused/blocked seconds and uptime per hour or day over the last N days."""
+    if period not in PERIODS:
+        raise HTTPException(status_code=400, detail="Invalid period.")
+    end = datetime.utcnow()
+    start = end - timedelta(days=days)
+    buckets = await run_in_threadpool(availability_log.report, client_id, start, end, period, end)
+    return {"client_id": client_id, "period": period, "start": start.isoformat(), "end": end.isoformat(), "buckets": buckets}
+
+@router.get("/reports/availability")
+async def get_fleet_availability_report(days: int = Query(7, ge=1, le=DAILY_RETENTION_DAYS)):
+    """Online/paused/blocked seconds and uptime per client over the last N whole days."""
+    end = datetime.utcnow()
+    start = end - timedelta(days=days)
+    clients = await run_in_threadpool(availability_log.fleet_report, start, end)
+    return {"start": start.isoformat(), "end": end.isoformat(), "clients": clients}
+
+@router.get("/stats/availability")
+async def get_availability_stats():
+    """Report availability log counters."""
+    return availability_log.stats()
+
+@router.get("/stats/notifications")
+async def get_notification_stats():
+    """Report notification queue depth, suppression counts and delivery latency."""
+    return notifier.stats()
+
+@router.get("/stats/liveness")
+async def get_liveness_stats():
+    """Report online/offline counts from the liveness index."""
+    return liveness.stats()
+
+@router.get("/stats/schedule-engine")
+async def get_schedule_engine_stats():
+    """Report queued schedule transitions."""
+    return schedule_engine.stats()
+
+@router.get("/stats/db")
+async def get_db_stats():
+    """Report SQL counts/time, session lifecycle and pool saturation."""
+    return get_stats()
+
+@router.get("/stats/client-cache")
+async def get_client_cache_stats():
+    """Report client cache hit/miss/eviction counters."""
+    return client_cache.stats()
+
 @router.post("/schedule")
-async def set_schedule(data: ScheduleUpdate, db: Session = Depends(SessionLocal)):
-    try:
-        datetime.strptime(data.disable_time, "%H:%M")
-        datetime.strptime(data.enable_time, "%H:%M")
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid time format.")
+async def set_schedule(data: ScheduleUpdate, db: AsyncSession = Depends(get_async_db)):
+    """Set a client's daily window, or its weekly windows and date exceptions."""
+    columns = validated_columns(data)
 
-    client = db.query(Client).filter(Client.client_id == data.client_id).first()
+    client = await client_cache.get_async(data.client_id)
     if not client:
         raise HTTPException(status_code=404, detail="Client not found.")
 
-    schedule = db.query(Schedule).filter(Schedule.client_id == client.id).first()
-    if schedule:
-        schedule.disable_time = data.disable_time
-        schedule.enable_time = data.enable_time
+    async with write_lock:
+        result = await db.execute(select(Schedule).where(Schedule.client_id == client.id))
+        schedule = result.scalars().first()
+        if schedule:
+            for name, value in columns.items():
+                setattr(schedule, name, value)
+        else:
+            schedule = Schedule(client_id=client.id, **columns)
+            db.add(schedule)
+
+        await db.commit()
+    client_cache.invalidate(data.client_id)
+    fleet_status.invalidate()
+    schedule_engine.update(data.client_id, WeeklySchedule.from_compiled(columns["intervals"]))
+    client_view.update(data.client_id, disable_time=data.disable_time, enable_time=data.enable_time)
+    # pushed: queued on the agent's socket here; forwarded: other workers told to push it from theirs
+    pushed = await push_client_update(data.client_id)
+    forwarded = hub.publish_refresh([data.client_id])
+    return {"status": "success", "pushed": pushed, "forwarded": forwarded}
+
+@router.post("/clients/state")
+async def set_client_state(data: StateUpdate, db: AsyncSession = Depends(get_async_db)):
+    """Pause or unpause a client's internet access."""
+    if data.state not in CLIENT_STATES:
+        raise HTTPException(status_code=400, detail="Invalid state.")
+
+    client = await client_cache.get_async(data.client_id)
+    if not client:
+        raise HTTPException(status_code=404, detail="Client not found.")
+
+    async with write_lock:
+        await db.execute(update(Client).where(Client.id == client.id).values(state=data.state))
+        await db.commit()
+    client_cache.invalidate(data.client_id)
+    fleet_status.invalidate()
+    availability_log.record(data.client_id, data.state)
+    notifier.notify(data.client_id, data.state)
+    client_view.update(data.client_id, state=data.state)
+    pushed = await push_client_update(data.client_id)
+    forwarded = hub.publish_refresh([data.client_id])
+    return {
+        "status": "success",
+        "client_id": data.client_id,
+        "state": data.state,
+        "pushed": pushed,
+        "forwarded": forwarded,
+    }
+
+@router.post("/clients/bulk")
+async def bulk_update(data: BulkUpdate, db: AsyncSession = Depends(get_async_db)):
+    """Apply a schedule or pause/unpause to many clients in one transaction."""
+    if data.action not in BULK_ACTIONS:
+        raise HTTPException(status_code=400, detail="Invalid action.")
+    if (data.client_ids is None) == (data.selector is None):
+        raise HTTPException(status_code=400, detail="Provide either client_ids or a selector.")
+    if data.selector and not (data.selector.all or data.selector.ip_prefix or data.selector.state):
+        raise HTTPException(status_code=400, detail="Empty selector; set all=true to target every client.")
+    if data.action == "schedule":
+        columns = validated_columns(data)
+
+    try:
+        async with write_lock:
+            if data.client_ids is not None:
+                targets = await resolve_clients(db, client_ids=data.client_ids)
+            else:
+                targets = await resolve_clients(db, ip_prefix=data.selector.ip_prefix, state=data.selector.state)
+            ids = [row.id for row in targets]
+            if data.action == "schedule":
+                await bulk_set_schedule(ids, columns, db)
+            else:
+                await bulk_set_state(ids, BULK_ACTIONS[data.action], db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Bulk update failed: {str(e)}")
+
+    updated = [row.client_id for row in targets]
+    client_cache.invalidate_many(updated)
+    fleet_status.invalidate()
+    if data.action == "schedule":
+        # Read-only once compiled, so every target shares one WeeklySchedule
+        schedule = WeeklySchedule.from_compiled(columns["intervals"])
+        for client_id in updated:
+            schedule_engine.update(client_id, schedule)
+            client_view.update(client_id, disable_time=data.disable_time, enable_time=data.enable_time)
     else:
-        schedule = Schedule(
-            client_id=client.id,
-            disable_time=data.disable_time,
-            enable_time=data.enable_time
-        )
-        db.add(schedule)
+        for client_id in updated:
+            availability_log.record(client_id, BULK_ACTIONS[data.action])
+            notifier.notify(client_id, BULK_ACTIONS[data.action])
+            client_view.update(client_id, state=BULK_ACTIONS[data.action])
+
+    # One query for the targets connected here; other workers refresh their own
+    connected = [client_id for client_id in updated if hub.is_local(client_id)]
+    records = client_cache.put_many(await load_client_records(connected, db)) if connected else []
+    pushed_ids = hub.fan_out(schedule_payloads(records))
+    forwarded = hub.publish_refresh(updated)
 
-    db.commit()
-    return {"status": "success"}
+    results = {client_id: {"status": "updated", "pushed": client_id in pushed_ids} for client_id in updated}
+    for client_id in data.client_ids or []:
+        results.setdefault(client_id, {"status": "not_found", "pushed": False})
+    return {
+        "status": "success",
+        "action": data.action,
+        "updated": len(updated),
+        "forwarded": forwarded,
+        "results": results,
+    }
 
 @router.websocket("/ws/{client_id}")
-async def websocket_endpoint(client_id: str, websocket: WebSocket, db: Session = Depends(SessionLocal)):
-    """Handle WebSocket connections for real-time updates."""
+async def websocket_endpoint(client_id: str, websocket: WebSocket, encoding: str = "json"):
+    """
+    Handle WebSocket connections for real-time updates.
+    Agents may ask for ?encoding=msgpack; the hello message says what they got.
+    """
     await websocket.accept()
+    connection = None
     try:
         # Validate the client_id exists
-        client = db.query(Client).filter(Client.client_id == client_id).first()
+        client = await client_cache.get_async(client_id)
         if not client:
             await websocket.close(code=1008)
             logging.error(f"WebSocket connection denied: Client {client_id} not found.")
             return
         
-        connected_clients[client_id] = websocket
-        logging.info(f"WebSocket connected: {client_id}")
+        connection = hub.register(client_id, websocket, encoding)
+        logging.info("WebSocket connected: %s", client_id, extra={"event": "ws_connection"})
+        # Bring the agent up to date so it does not need to poll
+        hub.send_local(client_id, schedule_message(client))
+        # Tell the agent it can send heartbeats on this socket instead of over HTTP
+        hub.send_local(client_id, {"action": "hello", "heartbeats": True, "encoding": connection.encoding})
         
         while True:
-            # Listen for incoming messages if required
             message = await websocket.receive_json()
-            logging.info(f"Received message from {client_id}: {message}")
+            if message.get("type") == "heartbeat":
+                websocket_messages.inc("heartbeat")
+                ip = message.get("ip") or client.ip
+                if heartbeat_buffer.record(client_id, ip, source="websocket"):
+                    liveness.seen(client_id)
+                    client_cache.update_ip(client_id, ip)
+                    client_view.update(client_id, ip=ip)
+                else:
+                    hub.send_local(client_id, {"action": "heartbeat_rejected"})
+            else:
+                websocket_messages.inc("other")
+                logging.debug("Received message from %s: %s", client_id, message, extra={"event": "ws_message"})
 
     except WebSocketDisconnect:
-        logging.warning(f"WebSocket disconnected: {client_id}")
+        logging.warning("WebSocket disconnected: %s", client_id, extra={"event": "ws_connection"})
     except Exception as e:
         logging.error(f"WebSocket error for {client_id}: {e}")
     finally:
         # Clean up WebSocket connection
-        connected_clients.pop(client_id, None)
-        logging.info(f"WebSocket connection closed for client {client_id}.")
+        if connection is not None:
+            hub.unregister(client_id, connection)
+        logging.info("WebSocket connection closed for client %s.", client_id, extra={"event": "ws_connection"})
+
+@router.post("/ws/broadcast")
+async def broadcast(data: BroadcastMessage):
+    """Send an action to every connected agent on every worker."""
+    if data.action not in BROADCAST_ACTIONS:
+        raise HTTPException(status_code=400, detail="Invalid action.")
+    local = hub.broadcast({"action": data.action})
+    return {"status": "success", "action": data.action, "local_recipients": local}
+
+@router.get("/stats/ws-hub")
+async def get_ws_hub_stats():
+    """Report WebSocket hub counters for the worker that answers."""
+    return hub.stats()
+
+@router.get("/clients/status")
+async def get_fleet_status():
+    """
+    Blocked/unblocked status of every client, evaluated in one vectorized pass.
+    Columnar: the i-th entry of blocked/in_schedule/paused belongs to client_ids[i].
+    """
+    return await fleet_status.evaluate_async()
 
 @router.get("/clients/state/{client_id}")
-async def get_client_state(client_id: str, db: Session = Depends(SessionLocal)):
+async def get_client_state(client_id: str):
     """Fetch the current state of a client."""
-    client = db.query(Client).filter(Client.client_id == client_id).first()
+    client = await client_cache.get_async(client_id)
     if not client:
         raise HTTPException(status_code=404, detail="Client not found.")
     return {"client_id": client.client_id, "state": client.state}
 
 @router.get("/clients/schedule/{client_id}")
-async def get_client_schedule(client_id: str, db: Session = Depends(SessionLocal)):
-    """Fetch the schedule for a client."""
-    client = db.query(Client).filter(Client.client_id == client_id).first()
+async def get_client_schedule(client_id: str, response: Response, if_none_match: str = Header(None)):
+    """Fetch the schedule for a client; honours If-None-Match against its version."""
+    client = await client_cache.get_async(client_id)
     if not client:
         raise HTTPException(status_code=404, detail="Client not found.")
-    schedule = db.query(Schedule).filter(Schedule.client_id == client.id).first()
-    if not schedule:
+    schedule = schedule_body(client)
+    if schedule is None:
         raise HTTPException(status_code=404, detail="Schedule not found.")
-    return {"disable_time": schedule.disable_time, "enable_time": schedule.enable_time}
+    etag = f'"{client.version}"'
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return {**schedule, "state": client.state, "version": client.version}
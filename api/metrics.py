@@ -0,0 +1,95 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from db import get_stats
+from heartbeat_buffer import heartbeat_buffer
+from client_cache import client_cache
+from ws_hub import hub
+from liveness import liveness
+from availability import availability_log
+from notifications import notifier
+from client_view import client_view
+from log_config import log_settings
+from metrics import registry
+
+router = APIRouter()
+
+def collect_db():
+    stats = get_stats()
+    pools = stats["pools"]
+    return [
+        ("db_queries_total", "counter", "SQL statements executed.", [({}, stats["queries"])]),
+        ("db_query_seconds_total", "counter", "Time spent executing SQL.", [({}, stats["query_time"])]),
+        ("db_pool_wait_seconds_total", "counter", "Time sessions waited for a pooled connection.",
+         [({}, stats["pool_wait_time"])]),
+        ("db_sessions_open", "gauge", "Sessions opened and not yet closed.", [({}, stats["sessions_open"])]),
+        ("db_pool_checked_out", "gauge", "Connections checked out, by engine.",
+         [({"engine": name}, pool["checked_out"]) for name, pool in pools.items()]),
+        ("db_pool_saturation", "gauge", "Checked-out share of pool capacity, by engine.",
+         [({"engine": name}, pool["saturation"]) for name, pool in pools.items()]),
+    ]
+
+def collect_heartbeats():
+    stats = heartbeat_buffer.stats()
+    return [
+        ("heartbeats_received_total", "counter", "Heartbeats accepted, by transport.",
+         [({"source": source}, count) for source, count in sorted(stats["sources"].items())]),
+        ("heartbeats_coalesced_total", "counter", "Heartbeats merged into one already pending.",
+         [({}, stats["coalesced"])]),
+        ("heartbeats_dropped_total", "counter", "Heartbeats refused with the buffer full.", [({}, stats["dropped"])]),
+        ("heartbeats_flushed_total", "counter", "Client rows written by buffer flushes.", [({}, stats["flushed"])]),
+        ("heartbeat_buffer_pending", "gauge", "Heartbeats waiting for the next flush.", [({}, stats["pending"])]),
+        ("heartbeat_flush_failures_total", "counter", "Buffer flushes that failed.",
+         [({}, stats["failed_flushes"])]),
+    ]
+
+def collect_sockets():
+    return [
+        ("websocket_connections", "gauge", "Agent sockets held by this worker.", [({}, len(hub.local_ids()))]),
+        ("websocket_messages_sent_total", "counter", "Messages written to agent sockets.", [({}, hub.sent)]),
+        ("websocket_messages_dropped_total", "counter", "Queued messages dropped for slow sockets.",
+         [({}, hub.dropped)]),
+        ("websocket_send_failures_total", "counter", "Sockets closed after a failed send.", [({}, hub.send_failures)]),
+        ("dashboard_streams", "gauge", "Browsers following dashboard diffs.",
+         [({}, client_view.stats()["subscribers"])]),
+    ]
+
+def collect_clients():
+    liveness_stats = liveness.stats()
+    cache = client_cache.stats()
+    availability = availability_log.stats()
+    notifications = notifier.stats()
+    return [
+        ("clients", "gauge", "Clients known to the liveness index, by status.",
+         [({"status": "online"}, liveness_stats["online"]), ({"status": "offline"}, liveness_stats["offline"])]),
+        ("client_cache_lookups_total", "counter", "Client cache lookups, by result.",
+         [({"result": "hit"}, cache["hits"]), ({"result": "miss"}, cache["misses"])]),
+        ("client_cache_size", "gauge", "Clients held in the cache.", [({}, cache["size"])]),
+        ("availability_events_pending", "gauge", "Availability events waiting for the next flush.",
+         [({}, availability["pending"])]),
+        ("availability_events_written_total", "counter", "Availability events appended.",
+         [({}, availability["written"])]),
+        ("notifications_queue_depth", "gauge", "Events waiting for the notification dispatcher.",
+         [({}, notifications["queue_depth"])]),
+        ("notifications_pending", "gauge", "Events batched for recipients and not yet sent.",
+         [({}, notifications["pending"])]),
+        ("notifications_sent_total", "counter", "Notification messages delivered.", [({}, notifications["sent"])]),
+        ("notification_failures_total", "counter", "Notification messages given up on.",
+         [({}, notifications["failures"])]),
+    ]
+
+def collect_logging():
+    stats = log_settings.stats()
+    return [
+        ("log_records_queued", "gauge", "Log records waiting for the writer thread.", [({}, stats["queued"])]),
+        ("log_records_skipped_total", "counter", "Log records not written, by reason.",
+         [({"reason": "queue_full"}, stats["dropped"]), ({"reason": "sampled"}, stats["sampled_out"]),
+          ({"reason": "rate_limited"}, stats["rate_limited"])]),
+    ]
+
+for collect in (collect_db, collect_heartbeats, collect_sockets, collect_clients, collect_logging):
+    registry.add_collector(collect)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Metrics for the worker that answers, in the Prometheus text format."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
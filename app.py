@@ -1,13 +1,116 @@
-from fastapi import FastAPI
-from api.endpoints import router
-from scheduler import start_scheduler  # Import the modified scheduler logic
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from fastapi import FastAPI, Request
+from fastapi.staticfiles import StaticFiles
+from api.endpoints import router, push_transition
+from api.dashboard import router as dashboard_router
+from api.metrics import router as metrics_router
+from scheduler import scheduler, start_scheduler  # Import the modified scheduler logic
+from heartbeat_buffer import heartbeat_buffer
+from schedule_engine import schedule_engine
+from db import start_request_stats, finish_request_stats, upgrade_schema
+from async_db import dispose_engines
+from ws_hub import hub
+from liveness import liveness
+from availability import availability_log
+from client_view import client_view
+from notifications import notifier
+from admission import AdmissionMiddleware, admission
+from log_config import configure_from
+import metrics
+
+# LOG_LEVEL, LOG_FORMAT=json, LOG_LEVELS, LOG_SAMPLE and LOG_RATE, see log_config.configure()
+configure_from(os.environ)
 
 app = FastAPI()
 
 # Include all API endpoints
 app.include_router(router)
+app.include_router(dashboard_router)
+app.include_router(metrics_router)
+app.mount("/static", StaticFiles(directory=os.path.join(os.path.dirname(__file__), "static")), name="static")
+
+# Added before request_timing, so it runs inside it and shed requests are still counted
+app.add_middleware(AdmissionMiddleware)
+# X-Client-ID picks the rate limit bucket only for registered clients
+admission.known = liveness.known
+
+@app.middleware("http")
+async def request_timing(request: Request, call_next):
+    """Account SQL count, DB time, pool wait and latency for every request on every router."""
+    started = time.perf_counter()
+    stats, token = start_request_stats()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        finish_request_stats(token)
+        if metrics.ENABLED:
+            route = metrics.route_label(request.scope)
+            metrics.request_latency.observe(time.perf_counter() - started, request.method, route)
+            metrics.responses.inc(route, status)
+            metrics.request_db_time.observe(stats["query_time"], route)
+    response.headers["Server-Timing"] = (
+        f'db;dur={stats["query_time"] * 1000:.2f};desc="{stats["queries"]} queries", '
+        f'pool;dur={stats["pool_wait"] * 1000:.2f}'
+    )
+    return response
 
 @app.on_event("startup")
 async def startup_event():
+    # Before anything reads the database; the app's tables come from migrations/versions
+    upgrade_schema()
     start_scheduler()  # Ensures the scheduler starts only if it is not already running
+    if metrics.ENABLED:
+        metrics.instrument_scheduler(scheduler)
+    heartbeat_buffer.start(scheduler)
+    availability_log.start(scheduler)
+    await hub.start()
+    notifier.start()
+
+    # Transitions fire on scheduler threads; hand them to the event loop for the socket push
+    loop = asyncio.get_running_loop()
+    schedule_engine.add_listener(
+        lambda client_id, blocked, instant: asyncio.run_coroutine_threadsafe(push_transition(client_id, blocked), loop)
+    )
+    # Engine instants are local wall-clock times; the availability log is UTC
+    schedule_engine.add_listener(
+        lambda client_id, blocked, instant: availability_log.record(
+            client_id, "blocked" if blocked else "unblocked", instant.astimezone(timezone.utc).replace(tzinfo=None)
+        )
+    )
+    schedule_engine.start(scheduler)
+
+    liveness.add_listener(
+        lambda client_id, online, last_seen: logging.info(
+            "Client %s is %s.", client_id, "online" if online else "offline", extra={"event": "liveness"}
+        )
+    )
+    # Offline is logged at the last heartbeat, when the client was last known to be up
+    liveness.add_listener(
+        lambda client_id, online, last_seen: availability_log.record(
+            client_id, "online" if online else "offline", datetime.utcfromtimestamp(last_seen)
+        )
+    )
+    liveness.add_listener(client_view.set_status)
+    liveness.add_listener(
+        lambda client_id, online, last_seen: notifier.notify(client_id, "online" if online else "offline", last_seen)
+    )
+    liveness.start(scheduler)
+    # After liveness has loaded, so rows start with their online status
+    client_view.start(liveness.status)
     print("Scheduler started and application is running.")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Flush buffered heartbeats before the process exits
+    heartbeat_buffer.stop()
+    availability_log.stop()
+    client_view.stop()
+    await notifier.stop()
+    hub.stop()
+    await dispose_engines()
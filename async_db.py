@@ -0,0 +1,224 @@
+import asyncio
+import time
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+from db import (
+    DATABASE_URL,
+    STORAGE_PROFILE,
+    STORAGE_PROFILES,
+    create_profile_engine,
+    bulk_schedule_statements,
+    bulk_state_statements,
+    client_record_select,
+    client_records_selects,
+    count_stat,
+    instrument_engine,
+    instrument_sessions,
+    resolve_clients_selects,
+)
+from metrics import async_write_lock_wait
+from weekly_schedule import schedule_columns
+
+# Same database as db.DATABASE_URL, through the aiosqlite driver
+ASYNC_DATABASE_URL = DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+# Async engines with the same storage profile as the sync ones
+async_engine = create_profile_engine(STORAGE_PROFILE, url=ASYNC_DATABASE_URL, factory=create_async_engine)
+if STORAGE_PROFILES[STORAGE_PROFILE]["read_pool_size"]:
+    async_read_engine = create_profile_engine(
+        STORAGE_PROFILE, read_only=True, url=ASYNC_DATABASE_URL, factory=create_async_engine
+    )
+else:
+    async_read_engine = async_engine
+
+
+class AsyncBackedSession(Session):
+    """Sync session class behind AsyncSession, so its events are counted separately."""
+
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, class_=AsyncSession, sync_session_class=AsyncBackedSession,
+    autoflush=False, expire_on_commit=False,
+)
+AsyncReadSessionLocal = async_sessionmaker(
+    bind=async_read_engine, class_=AsyncSession, sync_session_class=AsyncBackedSession,
+    autoflush=False, expire_on_commit=False,
+)
+
+# SQLite has a single writer. Concurrent async write transactions would spin in
+# busy_timeout (or fail upgrading a read snapshot), so endpoints hold this lock
+# around their read-modify-write section instead.
+class TimedLock(asyncio.Lock):
+    """asyncio.Lock that records how long each acquire waited (in this process only)."""
+
+    async def acquire(self):
+        if not self.locked():
+            async_write_lock_wait.observe(0.0)
+            return await super().acquire()
+        started = time.perf_counter()
+        try:
+            return await super().acquire()
+        finally:
+            async_write_lock_wait.observe(time.perf_counter() - started)
+
+write_lock = TimedLock()
+
+instrument_engine("async_write", async_engine)
+instrument_engine("async_read", async_read_engine)
+instrument_sessions(AsyncBackedSession)
+
+
+async def get_async_db():
+    """
+    Dependency to get an async database session.
+    Ensures proper cleanup after the session is used.
+    """
+    db = AsyncSessionLocal()
+    count_stat("sessions_opened")
+    try:
+        yield db
+    finally:
+        await db.close()
+        count_stat("sessions_closed")
+
+
+async def dispose_engines():
+    """Close pooled aiosqlite connections; called on shutdown."""
+    await async_engine.dispose()
+    if async_read_engine is not async_engine:
+        await async_read_engine.dispose()
+
+
+# Async versions of the db.py helpers
+async def add_client(client_id, ip, state="unpaused", db_session=None):
+    """
+    Add a new client to the database.
+    """
+    from models import Client
+    from client_cache import client_cache
+    from fleet_status import fleet_status
+    try:
+        new_client = Client(client_id=client_id, ip=ip, state=state)
+        db_session.add(new_client)
+        await db_session.commit()
+        client_cache.invalidate(client_id)
+        fleet_status.invalidate()
+        return new_client
+    except SQLAlchemyError as e:
+        await db_session.rollback()
+        raise e
+
+
+async def get_client_by_id(client_id, db_session):
+    """
+    Retrieve a client by its unique client_id.
+    The primary key comes from the client cache, so this is a PK lookup.
+    """
+    from models import Client
+    from client_cache import client_cache
+    record = await client_cache.get_async(client_id, db_session)
+    if record is None:
+        return None
+    return await db_session.get(Client, record.id)
+
+
+async def load_client_record(client_id, db_session):
+    """
+    Load the compact client row for a client in a single query.
+    """
+    from models import Client
+    result = await db_session.execute(client_record_select().where(Client.client_id == client_id))
+    return result.first()
+
+
+async def get_all_clients(db_session):
+    """
+    Retrieve all clients from the database.
+    """
+    from models import Client
+    result = await db_session.execute(select(Client))
+    return result.scalars().all()
+
+
+async def add_schedule(client_id, disable_time=None, enable_time=None, db_session=None, windows=None, exceptions=None):
+    """
+    Add or update a schedule for a client (by primary key): a daily pair, or
+    weekly windows and date exceptions.
+    """
+    from models import Client, Schedule
+    from client_cache import client_cache
+    from fleet_status import fleet_status
+    columns = schedule_columns(disable_time, enable_time, windows, exceptions)
+    try:
+        result = await db_session.execute(select(Schedule).where(Schedule.client_id == client_id))
+        schedule = result.scalars().first()
+        if schedule:
+            for name, value in columns.items():
+                setattr(schedule, name, value)
+        else:
+            schedule = Schedule(client_id=client_id, **columns)
+            db_session.add(schedule)
+        await db_session.commit()
+        client = await db_session.get(Client, client_id)
+        if client is not None:
+            client_cache.invalidate(client.client_id)
+        fleet_status.invalidate()
+        return schedule
+    except SQLAlchemyError as e:
+        await db_session.rollback()
+        raise e
+
+
+async def get_schedule_by_client_id(client_id, db_session):
+    """
+    Retrieve the schedule for a specific client (by primary key).
+    """
+    from models import Schedule
+    result = await db_session.execute(select(Schedule).where(Schedule.client_id == client_id))
+    return result.scalars().first()
+
+
+async def resolve_clients(db_session, client_ids=None, ip_prefix=None, state=None):
+    """
+    Resolve a list of client_ids or a selector to (id, client_id) rows.
+    """
+    rows = []
+    for query in resolve_clients_selects(client_ids, ip_prefix, state):
+        rows.extend((await db_session.execute(query)).all())
+    return rows
+
+
+async def _execute_all(statements, db_session):
+    try:
+        for statement in statements:
+            await db_session.execute(statement)
+        await db_session.commit()
+    except SQLAlchemyError as e:
+        await db_session.rollback()
+        raise e
+
+
+async def bulk_set_schedule(ids, columns, db_session):
+    """
+    Set the same schedule for many clients in one transaction.
+    """
+    await _execute_all(bulk_schedule_statements(ids, columns), db_session)
+
+
+async def bulk_set_state(ids, state, db_session):
+    """
+    Set the state of many clients in one transaction.
+    """
+    await _execute_all(bulk_state_statements(ids, state), db_session)
+
+
+async def load_client_records(client_ids, db_session):
+    """
+    Load compact client records for many clients.
+    """
+    rows = []
+    for query in client_records_selects(client_ids):
+        rows.extend((await db_session.execute(query)).all())
+    return rows
@@ -0,0 +1,353 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from db import engine, ReadSessionLocal, _chunks
+from models import AvailabilityEvent, AvailabilityRollup, AvailabilityState
+
+# Write pending events at least this often (seconds)
+FLUSH_INTERVAL = 5
+# Hard cap on pending events; events beyond it are dropped
+MAX_PENDING = 100000
+# How long raw events and rollups are kept
+EVENT_RETENTION_DAYS = 30
+HOURLY_RETENTION_DAYS = 90
+DAILY_RETENTION_DAYS = 730
+
+FLUSH_JOB_ID = "availability_flush"
+CHECKPOINT_JOB_ID = "availability_checkpoint"
+RETENTION_JOB_ID = "availability_retention"
+
+# Event name -> (kind, active)
+EVENTS = {
+    "online": ("online", True),
+    "offline": ("online", False),
+    "paused": ("paused", True),
+    "unpaused": ("paused", False),
+    "blocked": ("blocked", True),
+    "unblocked": ("blocked", False),
+}
+PERIODS = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+
+
+def bucket_start(value, period):
+    """Start of the hour or day bucket containing value."""
+    if period == "hour":
+        return value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def split(start, end, period):
+    """Yield (bucket_start, seconds) for the parts of [start, end) in each bucket."""
+    bucket = bucket_start(start, period)
+    while bucket < end:
+        following = bucket + PERIODS[period]
+        seconds = (min(end, following) - max(start, bucket)).total_seconds()
+        if seconds > 0:
+            yield bucket, seconds
+        bucket = following
+
+
+class AvailabilityLog:
+    """
+    Buffer availability transitions and append them in batches.
+
+    Each flush also closes finished periods into per-client hourly and daily
+    rollups, so reports read a handful of rollup rows instead of raw events.
+    availability_state holds every client's open periods. Flushes and
+    checkpoints read and write it in one BEGIN IMMEDIATE transaction, so
+    workers doing the same at once wait for each other instead of folding
+    a period twice. An event already in the log (every worker's schedule
+    engine fires the same transition) or one that repeats the recorded
+    state (the same offline seen by several workers) is skipped.
+    """
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, max_pending=MAX_PENDING):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._scheduler = None
+        self.recorded = 0
+        self.written = 0
+        self.ignored = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+
+    def record(self, client_id, event, at=None):
+        """Queue a transition; at is a naive UTC datetime."""
+        if event not in EVENTS:
+            raise ValueError(f"Unknown availability event: {event}")
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending.append((at or datetime.utcnow(), client_id, event))
+            self.recorded += 1
+        return True
+
+    @staticmethod
+    def _begin_write(connection):
+        # pysqlite sends BEGIN only before the first write, so the reads that
+        # decide what to write would otherwise run outside the write lock
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+    def _recorded(self, connection, batch):
+        """(client_id, event, at) of logged events that the sorted batch may repeat."""
+        table = AvailabilityEvent.__table__
+        found = set()
+        for chunk in _chunks(list({client_id for _, client_id, _ in batch})):
+            rows = connection.execute(
+                select(table.c.client_id, table.c.event, table.c.at)
+                .where(table.c.client_id.in_(chunk), table.c.at >= batch[0][0])
+            )
+            found.update(tuple(row) for row in rows)
+        return found
+
+    def _load_state(self, connection, client_ids):
+        table = AvailabilityState.__table__
+        state = {}
+        for chunk in _chunks(list(client_ids)):
+            rows = connection.execute(
+                select(table.c.client_id, table.c.kind, table.c.active, table.c.since).where(table.c.client_id.in_(chunk))
+            )
+            for client_id, kind, active, since in rows:
+                state[(client_id, kind)] = (active, since)
+        return state
+
+    @staticmethod
+    def _accumulate(rollups, client_id, kind, start, end):
+        for period in PERIODS:
+            for bucket, seconds in split(start, end, period):
+                row = rollups.setdefault(
+                    (client_id, period, bucket),
+                    {"online_seconds": 0.0, "paused_seconds": 0.0, "blocked_seconds": 0.0},
+                )
+                row[f"{kind}_seconds"] += seconds
+
+    def _write(self, connection, events, state_rows, rollups):
+        if events:
+            connection.execute(AvailabilityEvent.__table__.insert(), events)
+        if state_rows:
+            table = AvailabilityState.__table__
+            statement = sqlite_insert(table)
+            statement = statement.on_conflict_do_update(
+                index_elements=[table.c.client_id, table.c.kind],
+                set_={"active": statement.excluded.active, "since": statement.excluded.since},
+            )
+            connection.execute(statement, state_rows)
+        if rollups:
+            table = AvailabilityRollup.__table__
+            statement = sqlite_insert(table)
+            statement = statement.on_conflict_do_update(
+                index_elements=[table.c.client_id, table.c.period, table.c.bucket_start],
+                set_={
+                    column: table.c[column] + statement.excluded[column]
+                    for column in ("online_seconds", "paused_seconds", "blocked_seconds")
+                },
+            )
+            connection.execute(statement, [
+                {"client_id": client_id, "period": period, "bucket_start": bucket, **seconds}
+                for (client_id, period, bucket), seconds in rollups.items()
+            ])
+
+    def flush(self):
+        """Append pending transitions and fold closed periods into the rollups."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            batch.sort()
+
+            try:
+                with engine.begin() as connection:
+                    self._begin_write(connection)
+                    recorded = self._recorded(connection, batch)
+                    state = self._load_state(connection, {client_id for _, client_id, _ in batch})
+                    events, changed, rollups = [], {}, {}
+                    for at, client_id, event in batch:
+                        kind, active = EVENTS[event]
+                        previous = state.get((client_id, kind))
+                        if (client_id, event, at) in recorded or previous is not None and previous[0] == active:
+                            # Not a change
+                            self.ignored += 1
+                            continue
+                        events.append({"client_id": client_id, "event": event, "at": at})
+                        # A change dated before the open period started (offline is dated at the
+                        # last heartbeat, possibly before the last checkpoint) takes effect then
+                        since = max(at, previous[1]) if previous is not None else at
+                        if previous is not None and previous[0]:
+                            self._accumulate(rollups, client_id, kind, previous[1], since)
+                        state[(client_id, kind)] = (active, since)
+                        changed[(client_id, kind)] = {
+                            "client_id": client_id, "kind": kind, "active": active, "since": since,
+                        }
+                    self._write(connection, events, list(changed.values()), rollups)
+            except Exception as e:
+                self.failed_flushes += 1
+                logging.error(f"Availability flush failed for {len(batch)} events: {e}")
+                with self._lock:
+                    self._pending = batch + self._pending
+                return 0
+
+            self.written += len(events)
+            return len(events)
+
+    def checkpoint(self, now=None):
+        """
+        Close open periods at the start of the current hour and reopen them,
+        so rollups cover clients that stay online, paused or blocked for long.
+        """
+        boundary = bucket_start(now or datetime.utcnow(), "hour")
+        self.flush()
+        table = AvailabilityState.__table__
+        with self._flush_lock, engine.begin() as connection:
+            # Another worker's checkpoint moves since to the boundary first; this one then finds nothing
+            self._begin_write(connection)
+            rows = connection.execute(
+                select(table.c.client_id, table.c.kind, table.c.since)
+                .where(table.c.active.is_(True), table.c.since < boundary)
+            ).all()
+            rollups = {}
+            for client_id, kind, since in rows:
+                self._accumulate(rollups, client_id, kind, since, boundary)
+            state_rows = [{"client_id": client_id, "kind": kind, "active": True, "since": boundary}
+                          for client_id, kind, _ in rows]
+            self._write(connection, [], state_rows, rollups)
+        return len(rows)
+
+    def compact(self, now=None):
+        """Delete raw events and rollups past their retention."""
+        now = now or datetime.utcnow()
+        events = AvailabilityEvent.__table__
+        rollups = AvailabilityRollup.__table__
+        with engine.begin() as connection:
+            removed = connection.execute(
+                delete(events).where(events.c.at < now - timedelta(days=EVENT_RETENTION_DAYS))
+            ).rowcount
+            for period, days in (("hour", HOURLY_RETENTION_DAYS), ("day", DAILY_RETENTION_DAYS)):
+                removed += connection.execute(
+                    delete(rollups).where(
+                        rollups.c.period == period, rollups.c.bucket_start < now - timedelta(days=days)
+                    )
+                ).rowcount
+        logging.info(f"Availability retention removed {removed} rows.")
+        return removed
+
+    def report(self, client_id, start, end, period="hour", now=None, db_session=None):
+        """
+        Per-bucket online/paused/blocked seconds for one client between start
+        and end, from the rollups plus the client's still-open periods.
+        """
+        now = now or datetime.utcnow()
+        db = db_session or ReadSessionLocal()
+        try:
+            rollups = AvailabilityRollup.__table__
+            rows = db.execute(
+                select(rollups.c.bucket_start, rollups.c.online_seconds, rollups.c.paused_seconds, rollups.c.blocked_seconds)
+                .where(
+                    rollups.c.client_id == client_id,
+                    rollups.c.period == period,
+                    rollups.c.bucket_start >= bucket_start(start, period),
+                    rollups.c.bucket_start < end,
+                )
+            ).all()
+            states = AvailabilityState.__table__
+            open_periods = db.execute(
+                select(states.c.kind, states.c.since).where(states.c.client_id == client_id, states.c.active.is_(True))
+            ).all()
+        finally:
+            if db_session is None:
+                db.close()
+
+        buckets = {
+            bucket: {"online_seconds": online, "paused_seconds": paused, "blocked_seconds": blocked}
+            for bucket, online, paused, blocked in rows
+        }
+        for kind, since in open_periods:
+            for bucket, seconds in split(max(since, bucket_start(start, period)), min(now, end), period):
+                row = buckets.setdefault(bucket, {"online_seconds": 0.0, "paused_seconds": 0.0, "blocked_seconds": 0.0})
+                row[f"{kind}_seconds"] += seconds
+
+        length = PERIODS[period].total_seconds()
+        return [
+            {"bucket": bucket.isoformat(), **seconds, "uptime": seconds["online_seconds"] / length}
+            for bucket, seconds in sorted(buckets.items())
+        ]
+
+    def fleet_report(self, start, end, db_session=None):
+        """
+        Online/paused/blocked seconds per client over the whole days from start
+        to end, from the daily rollups. Periods still open are counted up to
+        the last hourly checkpoint.
+        """
+        db = db_session or ReadSessionLocal()
+        try:
+            rollups = AvailabilityRollup.__table__
+            rows = db.execute(
+                select(
+                    rollups.c.client_id,
+                    func.sum(rollups.c.online_seconds),
+                    func.sum(rollups.c.paused_seconds),
+                    func.sum(rollups.c.blocked_seconds),
+                )
+                .where(
+                    rollups.c.period == "day",
+                    rollups.c.bucket_start >= bucket_start(start, "day"),
+                    rollups.c.bucket_start < end,
+                )
+                .group_by(rollups.c.client_id)
+            ).all()
+        finally:
+            if db_session is None:
+                db.close()
+        length = (end - bucket_start(start, "day")).total_seconds()
+        return {
+            client_id: {
+                "online_seconds": online,
+                "paused_seconds": paused,
+                "blocked_seconds": blocked,
+                "uptime": online / length,
+            }
+            for client_id, online, paused, blocked in rows
+        }
+
+    def start(self, scheduler):
+        """Register the flush, checkpoint and retention jobs."""
+        self._scheduler = scheduler
+        scheduler.add_job(self.flush, "interval", seconds=self.flush_interval, id=FLUSH_JOB_ID,
+                          replace_existing=True, max_instances=1, coalesce=True)
+        scheduler.add_job(self.checkpoint, "cron", minute=0, second=5, id=CHECKPOINT_JOB_ID,
+                          replace_existing=True, max_instances=1, coalesce=True)
+        scheduler.add_job(self.compact, "cron", hour=3, minute=30, id=RETENTION_JOB_ID,
+                          replace_existing=True, max_instances=1, coalesce=True)
+        logging.info(f"Availability log flushing every {self.flush_interval}s.")
+
+    def stop(self):
+        """Remove the jobs and write out anything still pending."""
+        if self._scheduler is not None:
+            for job_id in (FLUSH_JOB_ID, CHECKPOINT_JOB_ID, RETENTION_JOB_ID):
+                if self._scheduler.get_job(job_id) is not None:
+                    self._scheduler.remove_job(job_id)
+        self._scheduler = None
+        self.flush()
+
+    def stats(self):
+        """Return log counters."""
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "recorded": self.recorded,
+            "written": self.written,
+            "ignored": self.ignored,
+            "dropped": self.dropped,
+            "failed_flushes": self.failed_flushes,
+        }
+
+
+# Shared log, fed by liveness, schedule transitions and state changes
+availability_log = AvailabilityLog()
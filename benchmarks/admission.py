@@ -0,0 +1,122 @@
+"""
+Latency of well-behaved agents next to a runaway one, with and without admission control.
+
+Usage: python benchmarks/admission.py [--agents 200] [--runaway 32] [--duration 10]
+
+Starts app.py twice under uvicorn against throwaway SQLite files: once with
+admission control effectively off (ADMISSION_RATE=0 and huge in-flight caps),
+once with the defaults. Each run, --agents already registered agents register
+again at once (a mass reconnect), retrying after Retry-After plus jitter as
+client.py does, then heartbeat every second and fetch their schedule, while
+one runaway agent keeps --runaway registrations in flight without pause. Reports latency and
+statuses per phase, how long the storm took to admit everyone, and how fast
+a 429/503 is answered.
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+import aiohttp
+
+from mixed_load import ADMISSION_OFF, percentile, start_server, wait_ready
+
+# client.py's HTTP_BACKOFF_BASE: jitter added on top of Retry-After
+JITTER = 0.5
+
+
+async def send(session, method, url, client_id, results, **kwargs):
+    started = time.perf_counter()
+    try:
+        async with session.request(method, url, headers={"X-Client-ID": client_id}, **kwargs) as response:
+            await response.read()
+            status = response.status
+            retry_after = response.headers.get("Retry-After")
+            if status in (429, 503) and retry_after is None:
+                status = "no Retry-After"
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        status, retry_after = "error", None
+    results.setdefault(status, []).append(time.perf_counter() - started)
+    return status, retry_after
+
+
+async def register(session, url, client_id, results):
+    """Register, waiting out 429/503 as the agent does; returns when admitted."""
+    while True:
+        status, retry_after = await send(session, "POST", url + "/clients/register", client_id, results,
+                                         json={"client_id": client_id, "ip": "10.0.0.1"})
+        if status not in (429, 503):
+            return
+        await asyncio.sleep(float(retry_after) + random.uniform(0, JITTER))
+
+
+def agent_ids(args):
+    return [f"agent-{i}" for i in range(args.agents)]
+
+
+async def run(args, url):
+    agents, runaway = {}, {}
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        await wait_ready(session, url)
+        client_ids = agent_ids(args)
+        storm = {}
+        started = time.perf_counter()
+        await asyncio.gather(*(register(session, url, client_id, storm) for client_id in client_ids))
+        storm_seconds = time.perf_counter() - started
+        deadline = time.perf_counter() + args.duration
+
+        async def agent(client_id):
+            await asyncio.sleep(random.uniform(0, 1))
+            while time.perf_counter() < deadline:
+                await send(session, "POST", url + "/clients/heartbeat", client_id, agents,
+                           json={"client_id": client_id, "ip": "10.0.0.1"})
+                await send(session, "GET", url + f"/clients/schedule/{client_id}", client_id, agents)
+                await asyncio.sleep(1)
+
+        async def runaway_worker():
+            while time.perf_counter() < deadline:
+                await send(session, "POST", url + "/clients/register", "runaway", runaway,
+                           json={"client_id": "runaway", "ip": "10.0.0.99"})
+
+        await asyncio.gather(
+            *(agent(client_id) for client_id in client_ids),
+            *(runaway_worker() for _ in range(args.runaway)),
+        )
+    return storm, storm_seconds, agents, runaway
+
+
+def summary(results, ok=(200, 304, 404)):
+    served = [latency for status, samples in results.items() if status in ok for latency in samples]
+    rejected = [latency for status in (429, 503) for latency in results.get(status, [])]
+    counts = ", ".join(f"{status}: {len(samples)}" for status, samples in sorted(results.items(), key=str))
+    line = f"p50 {percentile(served, 0.5) * 1000:7.2f} ms  p99 {percentile(served, 0.99) * 1000:7.2f} ms  [{counts}]"
+    if rejected:
+        line += f"  rejections answered in p50 {percentile(rejected, 0.5) * 1000:.2f} ms"
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--agents", type=int, default=200)
+    parser.add_argument("--runaway", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    print(f"{args.agents} agents, one runaway with {args.runaway} registrations in flight, {args.duration}s")
+    for label, overrides in (("admission off", ADMISSION_OFF), ("admission on", {})):
+        # Registered beforehand, so admission keys them by X-Client-ID rather than the shared peer address
+        server, url = start_server(overrides, clients=[*agent_ids(args), "runaway"])
+        try:
+            storm, storm_seconds, agents, runaway = asyncio.run(run(args, url))
+        finally:
+            server.terminate()
+            server.wait()
+        print(label)
+        print(f"  reconnect storm  {summary(storm)}  all registered in {storm_seconds:.2f}s")
+        print(f"  agents           {summary(agents)}")
+        print(f"  runaway          {summary(runaway)}")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Time uptime reports from the availability rollups against integrating raw events.
+
+Usage: python benchmarks/availability.py [num_clients] [days] [flaps_per_day]   (default: 500 30 20)
+Runs against a throwaway SQLite file, never server.db.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_FILE}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select  # noqa: E402
+from db import Base, engine, ReadSessionLocal  # noqa: E402
+from models import AvailabilityEvent  # noqa: E402
+from availability import AvailabilityLog, EVENTS, split  # noqa: E402
+
+
+def seed(log, num_clients, days, flaps, now):
+    """
+    Each client comes online in the morning, pauses once, drops offline for a
+    few minutes `flaps` times (flaky Wi-Fi) and goes offline at night.
+    """
+    rng = random.Random(num_clients)
+    start = now - timedelta(days=days)
+    written = 0
+    for day in range(days):
+        midnight = start.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=day)
+        for i in range(num_clients):
+            client_id = f"pc-{i}"
+            up = midnight + timedelta(minutes=rng.randrange(6 * 60, 10 * 60))
+            pause = up + timedelta(minutes=rng.randrange(60, 300))
+            down = up + timedelta(minutes=rng.randrange(8 * 60, 14 * 60))
+            log.record(client_id, "online", up)
+            log.record(client_id, "paused", pause)
+            log.record(client_id, "unpaused", pause + timedelta(minutes=rng.randrange(10, 90)))
+            step = (down - up) / (flaps + 1)
+            for flap in range(1, flaps + 1):
+                lost = up + step * flap
+                log.record(client_id, "offline", lost)
+                log.record(client_id, "online", lost + timedelta(seconds=rng.randrange(30, 300)))
+            log.record(client_id, "offline", down)
+        written += log.flush()
+    return written
+
+
+def from_events(client_id, start, end):
+    """Integrate online seconds per day straight from the raw events."""
+    db = ReadSessionLocal()
+    try:
+        events = AvailabilityEvent.__table__
+        rows = db.execute(
+            select(events.c.event, events.c.at)
+            .where(events.c.client_id == client_id, events.c.at < end)
+            .order_by(events.c.at)
+        ).all()
+    finally:
+        db.close()
+    totals = {}
+    online_since = None
+    for event, at in rows:
+        kind, active = EVENTS[event]
+        if kind != "online":
+            continue
+        if active:
+            online_since = at
+        elif online_since is not None:
+            for bucket, seconds in split(max(online_since, start), at, "day"):
+                totals[bucket] = totals.get(bucket, 0) + seconds
+            online_since = None
+    return totals
+
+
+def timed(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - started) / repeat, result
+
+
+def main():
+    num_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    flaps = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    Base.metadata.create_all(bind=engine)
+    log = AvailabilityLog(max_pending=num_clients * (4 + 2 * flaps))
+    # Midnight, so every seeded day is complete
+    now = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    started = time.perf_counter()
+    written = seed(log, num_clients, days, flaps, now)
+    seeding = time.perf_counter() - started
+
+    start = now - timedelta(days=days)
+    clients = [f"pc-{i}" for i in random.Random(0).sample(range(num_clients), 20)]
+    rollup, report = timed(lambda: [log.report(c, start, now, "day", now=now) for c in clients], 1)
+    raw, totals = timed(lambda: [from_events(c, start, now) for c in clients], 1)
+    hourly, _ = timed(lambda: [log.report(c, now - timedelta(days=1), now, "hour", now=now) for c in clients], 1)
+    for rows, expected in zip(report, totals):
+        got = sum(row["online_seconds"] for row in rows)
+        assert abs(got - sum(expected.values())) < 1, (got, sum(expected.values()))
+    fleet, fleet_rows = timed(lambda: log.fleet_report(start, now), 1)
+    fleet_raw, _ = timed(lambda: [from_events(f"pc-{i}", start, now) for i in range(num_clients)], 1)
+    assert len(fleet_rows) == num_clients
+
+    print(f"{num_clients} clients, {days} days, {flaps} flaps/day: {written} events ({written / seeding:.0f} events/s flushed)")
+    print(f"  {days}-day report from daily rollups   {rollup / len(clients) * 1000:8.2f} ms per client")
+    print(f"  {days}-day report from raw events      {raw / len(clients) * 1000:8.2f} ms per client")
+    print(f"  24-hour report from hourly rollups  {hourly / len(clients) * 1000:8.2f} ms per client")
+    print(f"  fleet {days}-day totals from rollups   {fleet * 1000:8.1f} ms")
+    print(f"  fleet {days}-day totals from raw events {fleet_raw * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
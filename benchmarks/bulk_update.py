@@ -0,0 +1,67 @@
+"""
+Compare per-row POST /schedule against one POST /clients/bulk.
+
+Usage: python benchmarks/bulk_update.py [num_clients]
+Runs against a throwaway SQLite file, never server.db.
+"""
+import os
+import sys
+import tempfile
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_FILE}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mixed_load import ADMISSION_OFF  # noqa: E402
+# Every request comes from one TestClient peer
+os.environ.update(ADMISSION_OFF)
+
+from fastapi.testclient import TestClient  # noqa: E402
+from db import Base, engine  # noqa: E402
+from models import Client  # noqa: E402
+from app import app  # noqa: E402
+
+
+def seed(num_clients):
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(
+            Client.__table__.insert(),
+            [{"client_id": f"pc-{i}", "ip": f"10.0.{i // 250}.{i % 250}", "state": "unpaused"} for i in range(num_clients)],
+        )
+
+
+def main():
+    num_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    seed(num_clients)
+    client_ids = [f"pc-{i}" for i in range(num_clients)]
+
+    with TestClient(app) as http:
+        start = time.perf_counter()
+        for client_id in client_ids:
+            response = http.post("/schedule", json={"client_id": client_id, "disable_time": "22:00", "enable_time": "06:00"})
+            assert response.status_code == 200, response.text
+        per_row = time.perf_counter() - start
+
+        start = time.perf_counter()
+        response = http.post(
+            "/clients/bulk",
+            json={"client_ids": client_ids, "action": "schedule", "disable_time": "23:00", "enable_time": "07:00"},
+        )
+        assert response.status_code == 200, response.text
+        bulk = time.perf_counter() - start
+
+        start = time.perf_counter()
+        response = http.post("/clients/bulk", json={"selector": {"all": True}, "action": "pause"})
+        assert response.status_code == 200, response.text
+        bulk_state = time.perf_counter() - start
+
+    print(f"clients:              {num_clients}")
+    print(f"per-row /schedule:    {per_row:.3f}s ({num_clients / per_row:.0f} clients/s)")
+    print(f"bulk schedule:        {bulk:.3f}s ({num_clients / bulk:.0f} clients/s, {per_row / bulk:.1f}x)")
+    print(f"bulk pause (all):     {bulk_state:.3f}s ({num_clients / bulk_state:.0f} clients/s)")
+
+
+if __name__ == "__main__":
+    main()
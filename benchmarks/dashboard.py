@@ -0,0 +1,118 @@
+"""
+Time a paginated dashboard page from the client view against rendering every client.
+
+Usage: python benchmarks/dashboard.py [num_clients ...]   (default: 10000 100000)
+Runs against a throwaway SQLite file, never server.db.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_FILE}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jinja2 import Environment, FileSystemLoader  # noqa: E402
+from sqlalchemy.orm import selectinload  # noqa: E402
+from db import Base, engine, ReadSessionLocal  # noqa: E402
+from models import Client, Schedule  # noqa: E402
+from client_view import ClientView, Subscriber  # noqa: E402
+
+TEMPLATES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates")
+
+
+def seed(num_clients):
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(num_clients)
+    clients = [
+        {
+            "id": i + 1,
+            "client_id": f"pc-{i:06d}",
+            "ip": f"10.{i % 4}.{i // 256 % 256}.{i % 256}",
+            "state": "paused" if i % 50 == 0 else "unpaused",
+        }
+        for i in range(num_clients)
+    ]
+    schedules = [
+        {"client_id": i + 1, "disable_time": f"{rng.randrange(24):02d}:00", "enable_time": f"{rng.randrange(24):02d}:30"}
+        for i in range(num_clients)
+    ]
+    with engine.begin() as connection:
+        connection.execute(Client.__table__.insert(), clients)
+        connection.execute(Schedule.__table__.insert(), schedules)
+
+
+def timed(fn, repeat=1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - started) / repeat, result
+
+
+def run(num_clients):
+    seed(num_clients)
+    template = Environment(loader=FileSystemLoader(TEMPLATES)).get_template("dashboard.html")
+    context = {"filters": {"state": "", "status": "", "ip": "", "limit": 50}, "events_url": "", "total": num_clients}
+
+    def full_render():
+        """Every client loaded and rendered on each page view."""
+        db = ReadSessionLocal()
+        try:
+            clients = db.query(Client).options(selectinload(Client.schedules)).all()
+            rows = [
+                {
+                    "client_id": c.client_id,
+                    "ip": c.ip,
+                    "state": c.state,
+                    "status": "unknown",
+                    "disable_time": c.schedules[0].disable_time if c.schedules else None,
+                    "enable_time": c.schedules[0].enable_time if c.schedules else None,
+                }
+                for c in clients
+            ]
+        finally:
+            db.close()
+        return template.render(clients=rows, **context)
+
+    view = ClientView()
+    load, _ = timed(view.load)
+    cursor = f"pc-{num_clients // 2:06d}"
+
+    def page_render(**filters):
+        rows, _ = view.page(after=cursor, **filters)
+        return template.render(clients=rows, **context)
+
+    full, _ = timed(full_render)
+    page, _ = timed(page_render, repeat=200)
+    filtered, _ = timed(lambda: page_render(state="paused"), repeat=50)
+    by_ip, _ = timed(lambda: page_render(ip="10.3."), repeat=200)
+
+    # A heartbeat wave changes 10% of the rows; 100 browsers each watch one page
+    ids = sorted(view._rows)
+    for i in range(100):
+        subscriber = Subscriber(after=ids[i * 50], until=ids[i * 50 + 50])
+        view._subscribers.add(subscriber)
+    for client_id in random.Random(1).sample(ids, num_clients // 10):
+        view.update(client_id, ip="192.168.0.1")
+    publish, changed = timed(view.publish)
+
+    print(f"{num_clients} clients")
+    print(f"  load view once             {load * 1000:9.1f} ms")
+    print(f"  render every client        {full * 1000:9.1f} ms per page view")
+    print(f"  render one page of 50      {page * 1000:9.2f} ms")
+    print(f"  ... filtered state=paused  {filtered * 1000:9.2f} ms")
+    print(f"  ... filtered ip=10.3.      {by_ip * 1000:9.2f} ms")
+    print(f"  publish {changed} changed rows to 100 pages  {publish * 1000:7.1f} ms")
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+    for num_clients in sizes:
+        run(num_clients)
+
+
+if __name__ == "__main__":
+    main()
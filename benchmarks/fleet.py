@@ -0,0 +1,498 @@
+"""
+Simulate a fleet of agents against the server and report the run as JSON.
+
+Usage: python benchmarks/fleet.py SCENARIO.json [--agents N] [--duration S]
+                                  [--workers W] [--url URL] [--output FILE]
+
+Every simulated agent behaves like client.py: it registers, fetches its
+schedule with If-None-Match, holds a WebSocket (heartbeating on it once the
+server says hello, over HTTP otherwise), optionally polls its schedule, and
+reconnects after reconnect_delay when the socket drops. All agents run in
+this one asyncio process.
+
+Scenario files (benchmarks/scenarios/) fix the fleet size, timings and
+timed events, so runs are comparable across commits:
+
+    {"name": "...", "agents": 2000, "ramp_seconds": 10, "duration": 60,
+     "heartbeat_interval": 30, "schedule_poll_interval": 0, "websocket": true,
+     "reconnect_delay": 5, "events": [{"at": 20, "type": "reconnect_storm", "fraction": 1.0}]}
+
+Event types: reconnect_storm (drop that fraction of sockets at once) and
+schedule_push (one bulk schedule change for every client; reports the time
+until each socket receives it).
+
+Without --url a uvicorn server for app.py is started against a throwaway
+SQLite file, and its CPU and RSS (all workers) are sampled from /proc. It
+runs with ADMISSION_UNKNOWN_KEY=client_id unless set: every agent here
+shares one address, so agents not registered yet are rate-limited by the
+X-Client-ID they send rather than together.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import aiohttp
+
+from mixed_load import percentile, wait_ready
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# client.py's HTTP_BACKOFF_BASE: jitter on top of a Retry-After
+RETRY_JITTER = 0.5
+SCENARIO_DEFAULTS = {
+    "agents": 1000,
+    "ramp_seconds": 10,
+    "duration": 30,
+    "heartbeat_interval": 30,
+    "schedule_poll_interval": 0,
+    "websocket": True,
+    "reconnect_delay": 5,
+    "events": [],
+}
+
+
+class Recorder:
+    """Latency samples and error counts per endpoint."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.sent = {}
+
+    def ok(self, endpoint, seconds):
+        self.latencies.setdefault(endpoint, []).append(seconds)
+
+    def count(self, endpoint):
+        """A fire-and-forget send (socket heartbeats) with no response to time."""
+        self.sent[endpoint] = self.sent.get(endpoint, 0) + 1
+
+    def error(self, endpoint):
+        self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self, elapsed):
+        report = {}
+        for endpoint in sorted(set(self.latencies) | set(self.errors) | set(self.sent)):
+            samples = self.latencies.get(endpoint, [])
+            errors = self.errors.get(endpoint, 0)
+            total = len(samples) + errors + self.sent.get(endpoint, 0)
+            report[endpoint] = {
+                "count": total,
+                "errors": errors,
+                "error_rate": round(errors / total, 4) if total else 0.0,
+                "per_second": round(total / elapsed, 1),
+                "p50_ms": round(percentile(samples, 0.5) * 1000, 2) if samples else None,
+                "p99_ms": round(percentile(samples, 0.99) * 1000, 2) if samples else None,
+                "max_ms": round(max(samples) * 1000, 2) if samples else None,
+            }
+        return report
+
+
+class Agent:
+    """One simulated client.py."""
+
+    def __init__(self, fleet, index):
+        self.fleet = fleet
+        self.client_id = f"sim-{index:06d}"
+        self.ip = f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}"
+        self.version = None
+        self.ws = None
+        self.socket_heartbeats = False
+        self.connected = asyncio.Event()
+        self.kicked = False
+        self.ready = asyncio.Event()
+
+    async def request(self, endpoint, method, path, expected=(), **kwargs):
+        """
+        Time one request; statuses of 400 and up count as errors unless expected.
+        A 429/503 with Retry-After is waited out and retried, as client.py does,
+        and counted under "<endpoint>_throttled".
+        """
+        fleet = self.fleet
+        # Identify as the real agent does, so each agent is rate-limited separately
+        kwargs["headers"] = {"X-Client-ID": self.client_id, **kwargs.get("headers", {})}
+        started = time.perf_counter()
+        try:
+            while True:
+                async with fleet.session.request(method, fleet.url + path, **kwargs) as response:
+                    body = await response.json() if response.content_type == "application/json" else await response.read()
+                    status, retry_after = response.status, response.headers.get("Retry-After")
+                if status not in (429, 503) or retry_after is None or fleet.stopping:
+                    break
+                fleet.recorder.count(f"{endpoint}_throttled")
+                await asyncio.sleep(float(retry_after) + random.uniform(0, RETRY_JITTER))
+            if status >= 400 and status not in expected:
+                fleet.recorder.error(endpoint)
+                return status, None
+            fleet.recorder.ok(endpoint, time.perf_counter() - started)
+            return status, body
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            fleet.recorder.error(endpoint)
+            return None, None
+
+    async def fetch_schedule(self):
+        headers = {"If-None-Match": f'"{self.version}"'} if self.version else {}
+        # 404 is a client without a schedule yet, as for the real agent
+        status, body = await self.request(
+            "schedule", "GET", f"/clients/schedule/{self.client_id}", expected=(404,), headers=headers
+        )
+        if status == 200 and body:
+            self.version = body.get("version")
+
+    async def start(self):
+        await self.request("register", "POST", "/clients/register", json={"client_id": self.client_id, "ip": self.ip})
+        await self.fetch_schedule()
+        self.ready.set()
+        tasks = [self.heartbeats()]
+        if self.fleet.scenario["websocket"]:
+            tasks.append(self.hold_socket())
+        if self.fleet.scenario["schedule_poll_interval"]:
+            tasks.append(self.poll())
+        await asyncio.gather(*tasks)
+
+    async def hold_socket(self):
+        fleet = self.fleet
+        url = fleet.url.replace("http", "ws", 1) + f"/ws/{self.client_id}"
+        while not fleet.stopping:
+            started = time.perf_counter()
+            try:
+                self.ws = await fleet.ws_session.ws_connect(url, heartbeat=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                fleet.recorder.error("ws_connect")
+                await asyncio.sleep(fleet.scenario["reconnect_delay"] * random.uniform(0.5, 1.5))
+                continue
+            fleet.recorder.ok("ws_connect", time.perf_counter() - started)
+            self.connected.set()
+            fleet.sockets_up += 1
+            try:
+                async for message in self.ws:
+                    if message.type not in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                        break
+                    fleet.ws_received += 1
+                    data = json.loads(message.data)
+                    if "version" in data:
+                        self.version = data["version"]
+                        fleet.delivered(self.client_id)
+                    elif data.get("action") == "hello":
+                        self.socket_heartbeats = bool(data.get("heartbeats"))
+            finally:
+                fleet.sockets_up -= 1
+                self.connected.clear()
+                self.socket_heartbeats = False
+                self.ws = None
+            if not fleet.stopping:
+                if not self.kicked:
+                    fleet.recorder.error("ws_dropped")
+                self.kicked = False
+                await asyncio.sleep(fleet.scenario["reconnect_delay"] * random.uniform(0.5, 1.5))
+
+    async def heartbeats(self):
+        fleet = self.fleet
+        interval = fleet.scenario["heartbeat_interval"]
+        await asyncio.sleep(random.uniform(0, interval))
+        while not fleet.stopping:
+            ws = self.ws
+            if ws is not None and self.socket_heartbeats:
+                try:
+                    await ws.send_str(json.dumps({"type": "heartbeat", "ip": self.ip}))
+                    fleet.recorder.count("ws_heartbeat")
+                except (aiohttp.ClientError, ConnectionError, RuntimeError):
+                    fleet.recorder.error("ws_heartbeat")
+            else:
+                payload = {"client_id": self.client_id, "ip": self.ip}
+                if ws is None:
+                    payload["version"] = self.version or ""
+                status, body = await self.request("heartbeat", "POST", "/clients/heartbeat", json=payload)
+                if body and "update" in body:
+                    self.version = body["update"].get("version")
+            await asyncio.sleep(interval)
+
+    async def poll(self):
+        interval = self.fleet.scenario["schedule_poll_interval"]
+        await asyncio.sleep(random.uniform(0, interval))
+        while not self.fleet.stopping:
+            await self.fetch_schedule()
+            await asyncio.sleep(interval)
+
+
+class ServerProcess:
+    """A uvicorn server for app.py on a free port, with /proc CPU and RSS sampling."""
+
+    def __init__(self, workers):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        env = dict(os.environ)
+        env["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+        env["WS_HUB_DIR"] = tempfile.mkdtemp()
+        env.setdefault("LOG_LEVEL", "WARNING")
+        env.setdefault("ADMISSION_UNKNOWN_KEY", "client_id")
+        subprocess.run(
+            [sys.executable, "-c", "from db import Base, engine; import models; Base.metadata.create_all(bind=engine)"],
+            cwd=ROOT, env=env, check=True,
+        )
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--workers", str(workers),
+             "--log-level", "warning", "--no-access-log"],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        self.url = f"http://127.0.0.1:{port}"
+        self.rss_peak = 0
+        self.ticks = os.sysconf("SC_CLK_TCK")
+
+    def pids(self):
+        pids = [self.process.pid]
+        try:
+            with open(f"/proc/{self.process.pid}/task/{self.process.pid}/children") as f:
+                pids += [int(pid) for pid in f.read().split()]
+        except OSError:
+            pass
+        return pids
+
+    def cpu_seconds(self):
+        total = 0.0
+        for pid in self.pids():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                total += (int(fields[11]) + int(fields[12])) / self.ticks
+            except OSError:
+                pass
+        return total
+
+    def sample_rss(self):
+        rss = 0
+        for pid in self.pids():
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            rss += int(line.split()[1]) * 1024
+            except OSError:
+                pass
+        self.rss_peak = max(self.rss_peak, rss)
+        return rss
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+class Fleet:
+    def __init__(self, scenario, url, server=None):
+        self.scenario = scenario
+        self.url = url
+        self.server = server
+        self.recorder = Recorder()
+        self.agents = [Agent(self, i) for i in range(scenario["agents"])]
+        self.stopping = False
+        self.sockets_up = 0
+        self.ws_received = 0
+        self.push_sent = None
+        self.push_pending = set()
+        self.push_latency = []
+        self.event_results = []
+
+    def delivered(self, client_id):
+        if client_id in self.push_pending:
+            self.push_pending.discard(client_id)
+            self.push_latency.append(time.perf_counter() - self.push_sent)
+
+    async def ramp(self):
+        """Start agents evenly over ramp_seconds; returns their tasks."""
+        tasks = []
+        spacing = self.scenario["ramp_seconds"] / max(1, len(self.agents))
+        for agent in self.agents:
+            tasks.append(asyncio.create_task(agent.start()))
+            await asyncio.sleep(spacing)
+        return tasks
+
+    async def reconnect_storm(self, fraction):
+        victims = [agent for agent in self.agents if agent.ws is not None]
+        victims = victims[: int(len(victims) * fraction)]
+        started = time.perf_counter()
+        for agent in victims:
+            agent.kicked = True
+        await asyncio.gather(*(agent.ws.close() for agent in victims if agent.ws is not None), return_exceptions=True)
+        waits = await asyncio.gather(*(self.reconnected(agent, started) for agent in victims))
+        recovered = [seconds for seconds in waits if seconds is not None]
+        return {
+            "type": "reconnect_storm",
+            "dropped": len(victims),
+            "reconnected": len(recovered),
+            "p50_s": round(percentile(recovered, 0.5), 2) if recovered else None,
+            "all_back_s": round(max(recovered), 2) if recovered else None,
+        }
+
+    async def reconnected(self, agent, started, timeout=120):
+        await asyncio.sleep(0)
+        try:
+            await asyncio.wait_for(agent.connected.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return time.perf_counter() - started
+
+    async def schedule_push(self):
+        self.push_pending = {agent.client_id for agent in self.agents if agent.ws is not None}
+        expected = len(self.push_pending)
+        self.push_latency = []
+        self.push_sent = time.perf_counter()
+        disable = f"{random.randrange(24):02d}:00"
+        status, body = await self.agents[0].request(
+            "bulk_schedule", "POST", "/clients/bulk",
+            json={"action": "schedule", "selector": {"all": True}, "disable_time": disable, "enable_time": "23:59"},
+        )
+        deadline = time.perf_counter() + 60
+        while self.push_pending and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+        samples = self.push_latency
+        return {
+            "type": "schedule_push",
+            "status": status,
+            "updated": body.get("updated") if body else None,
+            "sockets": expected,
+            "delivered": len(samples),
+            "p50_ms": round(percentile(samples, 0.5) * 1000, 1) if samples else None,
+            "p99_ms": round(percentile(samples, 0.99) * 1000, 1) if samples else None,
+            "all_delivered_ms": round(max(samples) * 1000, 1) if samples and not self.push_pending else None,
+        }
+
+    async def events(self, started):
+        for event in sorted(self.scenario["events"], key=lambda e: e["at"]):
+            await asyncio.sleep(max(0, started + event["at"] - time.perf_counter()))
+            if event["type"] == "reconnect_storm":
+                result = await self.reconnect_storm(event.get("fraction", 1.0))
+            elif event["type"] == "schedule_push":
+                result = await self.schedule_push()
+            else:
+                raise ValueError(f"Unknown event type: {event['type']}")
+            self.event_results.append(dict(result, at=event["at"]))
+
+    async def sample_server(self, stop):
+        while not stop.is_set():
+            self.server.sample_rss()
+            try:
+                await asyncio.wait_for(stop.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self):
+        connector = aiohttp.TCPConnector(limit=500)
+        async with aiohttp.ClientSession(connector=connector) as self.session, \
+                aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as self.ws_session:
+            await wait_ready(self.session, self.url)
+            stop = asyncio.Event()
+            sampler = asyncio.create_task(self.sample_server(stop)) if self.server else None
+
+            ramp_started = time.perf_counter()
+            tasks = await self.ramp()
+            # Wait (up to a minute past the ramp) for every agent to register and connect
+            deadline = time.perf_counter() + 60
+            for agent in self.agents:
+                try:
+                    await asyncio.wait_for(agent.ready.wait(), max(0.1, deadline - time.perf_counter()))
+                    if self.scenario["websocket"]:
+                        await asyncio.wait_for(agent.connected.wait(), max(0.1, deadline - time.perf_counter()))
+                except asyncio.TimeoutError:
+                    break
+            ramp_seconds = time.perf_counter() - ramp_started
+
+            # Measurement starts with the whole fleet up
+            self.recorder = Recorder()
+            server_cpu = self.server.cpu_seconds() if self.server else None
+            generator_cpu = time.process_time()
+            started = time.perf_counter()
+            events = asyncio.create_task(self.events(started))
+            await asyncio.sleep(self.scenario["duration"])
+            await events
+            elapsed = time.perf_counter() - started
+            generator_cpu = time.process_time() - generator_cpu
+            if self.server:
+                server_cpu = self.server.cpu_seconds() - server_cpu
+                stop.set()
+                await sampler
+
+            connected = self.sockets_up
+            self.stopping = True
+            for agent in self.agents:
+                if agent.ws is not None:
+                    await agent.ws.close()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        return {
+            "scenario": self.scenario["name"],
+            "commit": git_commit(),
+            "url": self.url,
+            "agents": len(self.agents),
+            "ramp_seconds": round(ramp_seconds, 1),
+            "duration_seconds": round(elapsed, 1),
+            "endpoints": self.recorder.summary(elapsed),
+            "websocket": {"connected_at_end": connected, "messages_received": self.ws_received},
+            "events": self.event_results,
+            "server": {
+                "cpu_seconds": round(server_cpu, 2),
+                "cpu_percent": round(100 * server_cpu / elapsed, 1),
+                "rss_peak_mb": round(self.server.rss_peak / 2 ** 20, 1),
+            } if self.server else None,
+            "generator_cpu_percent": round(100 * generator_cpu / elapsed, 1),
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_scenario(path, args):
+    with open(path) as f:
+        scenario = dict(SCENARIO_DEFAULTS, **json.load(f))
+    scenario.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+    if args.agents:
+        scenario["agents"] = args.agents
+    if args.duration:
+        scenario["duration"] = args.duration
+    return scenario
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scenario")
+    parser.add_argument("--agents", type=int)
+    parser.add_argument("--duration", type=float)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--url")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    scenario = load_scenario(args.scenario, args)
+
+    # Every agent holds a socket and a share of the HTTP connections
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    server = None if args.url else ServerProcess(args.workers)
+    try:
+        result = asyncio.run(Fleet(scenario, args.url or server.url, server).run())
+    finally:
+        if server is not None:
+            server.stop()
+    result["workers"] = None if args.url else args.workers
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
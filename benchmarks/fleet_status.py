@@ -0,0 +1,91 @@
+"""
+Time the vectorized fleet status against per-client evaluation.
+
+Usage: python benchmarks/fleet_status.py [num_clients ...]   (default: 10000 100000)
+Runs against a throwaway SQLite file, never server.db.
+"""
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_FILE}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Base, engine  # noqa: E402
+from models import Client, Schedule  # noqa: E402
+from fleet_status import FleetStatus  # noqa: E402
+
+
+def seed(num_clients):
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(num_clients)
+    clients = [
+        {"id": i + 1, "client_id": f"pc-{i}", "ip": "10.0.0.1", "state": "paused" if i % 50 == 0 else "unpaused"}
+        for i in range(num_clients)
+    ]
+    schedules = [
+        {
+            "client_id": i + 1,
+            "disable_time": f"{rng.randrange(24):02d}:{rng.randrange(60):02d}",
+            "enable_time": f"{rng.randrange(24):02d}:{rng.randrange(60):02d}",
+        }
+        for i in range(num_clients)
+        if i % 10
+    ]
+    with engine.begin() as connection:
+        connection.execute(Client.__table__.insert(), clients)
+        connection.execute(Schedule.__table__.insert(), schedules)
+    return schedules
+
+
+def per_client(schedules, now):
+    """The agent's enforce_schedule window logic, one client at a time."""
+    blocked = 0
+    for schedule in schedules:
+        disable_time = datetime.datetime.strptime(schedule["disable_time"], "%H:%M").time()
+        enable_time = datetime.datetime.strptime(schedule["enable_time"], "%H:%M").time()
+        if disable_time <= now <= enable_time or (
+            disable_time > enable_time and (now >= disable_time or now <= enable_time)
+        ):
+            blocked += 1
+    return blocked
+
+
+def run(num_clients):
+    schedules = seed(num_clients)
+    status = FleetStatus()
+    now = datetime.datetime.now()
+
+    start = time.perf_counter()
+    status.evaluate(now)
+    cold = time.perf_counter() - start
+
+    # New minute: arrays are cached, only the vector pass runs
+    later = now + datetime.timedelta(minutes=1)
+    start = time.perf_counter()
+    status.evaluate(later)
+    warm = time.perf_counter() - start
+
+    start = time.perf_counter()
+    status.evaluate(later)
+    cached = time.perf_counter() - start
+
+    start = time.perf_counter()
+    per_client(schedules, later.time())
+    loop = time.perf_counter() - start
+
+    print(f"{num_clients} clients")
+    print(f"  load + evaluate:      {cold * 1000:8.1f} ms")
+    print(f"  evaluate (new minute):{warm * 1000:8.1f} ms")
+    print(f"  cached result:        {cached * 1000:8.3f} ms")
+    print(f"  per-client strptime:  {loop * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    for size in [int(arg) for arg in sys.argv[1:]] or [10000, 100000]:
+        run(size)
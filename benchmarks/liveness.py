@@ -0,0 +1,113 @@
+"""
+Time the liveness index against scanning clients.last_heartbeat.
+
+Usage: python benchmarks/liveness.py [num_clients ...]   (default: 100000)
+Runs against a throwaway SQLite file, never server.db.
+"""
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_FILE}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, select  # noqa: E402
+from db import Base, engine, ReadSessionLocal  # noqa: E402
+from models import Client  # noqa: E402
+from liveness import LivenessIndex  # noqa: E402
+
+
+def seed(num_clients, now, timeout):
+    """Heartbeats spread over the last 1.5 timeouts, so about a third are offline."""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(num_clients)
+    clients = [
+        {
+            "client_id": f"pc-{i}",
+            "ip": "10.0.0.1",
+            "last_heartbeat": now - datetime.timedelta(seconds=rng.uniform(0, timeout * 1.5)),
+        }
+        for i in range(num_clients)
+    ]
+    with engine.begin() as connection:
+        connection.execute(Client.__table__.insert(), clients)
+
+
+def timed(fn, repeat=1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - started) / repeat, result
+
+
+def run(num_clients):
+    index = LivenessIndex()
+    utcnow = datetime.datetime.utcnow()
+    now = utcnow.replace(tzinfo=datetime.timezone.utc).timestamp()
+    seed(num_clients, utcnow, index.timeout)
+
+    def sql_count():
+        db = ReadSessionLocal()
+        try:
+            cutoff = utcnow - datetime.timedelta(seconds=index.timeout)
+            return db.execute(select(func.count()).where(Client.last_heartbeat > cutoff)).scalar()
+        finally:
+            db.close()
+
+    def scan():
+        db = ReadSessionLocal()
+        try:
+            cutoff = utcnow - datetime.timedelta(seconds=index.timeout)
+            rows = db.execute(select(Client.client_id, Client.last_heartbeat)).all()
+            return sum(1 for _, last_heartbeat in rows if last_heartbeat > cutoff)
+        finally:
+            db.close()
+
+    load, _ = timed(lambda: index.load(now=now))
+    online = index.online_count()
+    count, _ = timed(index.online_count, repeat=100000)
+    sql, sql_online = timed(sql_count, repeat=5)
+    scanned, scan_online = timed(scan, repeat=3)
+    assert online == sql_online == scan_online, (online, sql_online, scan_online)
+
+    # Nothing due: the common case for each one-second check
+    idle, _ = timed(lambda: index.expire(now=now), repeat=1000)
+
+    # Every online client heartbeats once
+    ids = [f"pc-{i}" for i in range(num_clients)]
+    rng = random.Random(1)
+    rng.shuffle(ids)
+    heartbeats, _ = timed(lambda: [index.seen(client_id, now) for client_id in ids])
+
+    # Ten percent go silent; the rest heartbeat again, then the timeout passes for the silent ones
+    silent = set(ids[: num_clients // 10])
+    later = now + 1
+    for client_id in ids:
+        if client_id not in silent:
+            index.seen(client_id, later + index.timeout)
+    went_offline, flipped = timed(lambda: index.expire(now=later + index.timeout, verify=True))
+    assert flipped == len(silent), flipped
+
+    print(f"{num_clients} clients, timeout {index.timeout}s ({online} online at start)")
+    print(f"  rebuild from database     {load * 1000:9.1f} ms")
+    print(f"  online_count()            {count * 1e9:9.1f} ns")
+    print(f"  COUNT(*) over the table   {sql * 1000:9.1f} ms")
+    print(f"  scan and compare rows     {scanned * 1000:9.1f} ms")
+    print(f"  check with nothing due    {idle * 1e6:9.1f} us")
+    print(f"  heartbeat (seen)          {heartbeats / num_clients * 1e9:9.1f} ns each")
+    print(f"  expire {flipped} silent     {went_offline * 1000:9.1f} ms (incl. database check)")
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100000]
+    for num_clients in sizes:
+        run(num_clients)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Time per-message log lines the way the WebSocket endpoint and agent emit them.
+
+Compares the old setup (f-string at DEBUG through a synchronous handler) with
+log_config's queue handler, in text and JSON, with and without sampling. The
+"caller" column is what the event loop pays per call; "total" includes
+draining the queue to the file. One record in 50 is a warning, which sampling
+must keep. The "stalling" rows write to a stream that blocks for 1 ms every
+100 lines, like stderr piped to a busy journal.
+
+Usage: python benchmarks/log_overhead.py [num_records]   (default: 100000)
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import log_config  # noqa: E402
+
+MESSAGE = {"type": "status", "ip": "10.0.0.5", "uptime": 86400, "squid": "running"}
+
+
+class StallingStream:
+    def __init__(self, stream):
+        self.stream = stream
+        self.writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        if self.writes % 100 == 0:
+            time.sleep(0.001)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def emit_fstring(num_records):
+    for i in range(num_records):
+        client_id = f"pc-{i % 1000}"
+        if i % 50 == 0:
+            logging.warning(f"Heartbeat failed for {client_id}: 503")
+        else:
+            logging.debug(f"Received message from {client_id}: {MESSAGE}")
+
+
+def emit_lazy(num_records):
+    for i in range(num_records):
+        client_id = f"pc-{i % 1000}"
+        if i % 50 == 0:
+            logging.warning("Heartbeat failed for %s: %s", client_id, 503, extra={"event": "ws_message"})
+        else:
+            logging.debug("Received message from %s: %s", client_id, MESSAGE, extra={"event": "ws_message"})
+
+
+def run(name, num_records, setup, emit):
+    path = os.path.join(tempfile.mkdtemp(), "bench.log")
+    with open(path, "w") as stream:
+        setup(stream)
+        started = time.perf_counter()
+        emit(num_records)
+        caller = time.perf_counter() - started
+        log_config.shutdown()
+        total = time.perf_counter() - started
+        for handler in logging.getLogger().handlers[:]:
+            handler.close()
+            logging.getLogger().removeHandler(handler)
+    with open(path) as f:
+        lines = f.read().count("\n")
+    dropped = log_config.log_settings.stats()["dropped"] if log_config.log_settings.handler else 0
+    print(f"  {name:34} {caller / num_records * 1e6:6.2f} us {total / num_records * 1e6:6.2f} us {lines:8d} {dropped:8d}")
+    log_config.log_settings.handler = None
+    return lines
+
+
+def main():
+    num_records = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    log_config.QUEUE_SIZE = num_records  # measure formatting cost, not drops
+
+    def synchronous(stream):
+        logging.basicConfig(level=logging.DEBUG, format=log_config.TEXT_FORMAT, stream=stream, force=True)
+
+    print(f"{num_records} records, {num_records // 50} of them warnings")
+    print(f"  {'':34} {'caller':>9} {'total':>9} {'lines':>8} {'dropped':>8}")
+    run("DEBUG, f-strings, synchronous", num_records, synchronous, emit_fstring)
+    run("DEBUG, lazy, queue, text", num_records, lambda s: log_config.configure("DEBUG", stream=s), emit_lazy)
+    run("DEBUG, lazy, queue, JSON", num_records,
+        lambda s: log_config.configure("DEBUG", json_format=True, stream=s), emit_lazy)
+    lines = run("DEBUG, JSON, 1 in 100 sampled", num_records,
+                lambda s: log_config.configure("DEBUG", json_format=True, sample={"ws_message": 100}, stream=s),
+                emit_lazy)
+    run("INFO (debug lines off), queue", num_records, lambda s: log_config.configure("INFO", stream=s), emit_lazy)
+    run("stalling, synchronous", num_records, lambda s: synchronous(StallingStream(s)), emit_fstring)
+    run("stalling, queue", num_records, lambda s: log_config.configure("DEBUG", stream=StallingStream(s)), emit_lazy)
+    assert lines >= num_records // 50, "sampling dropped warnings"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Measure what the /metrics instrumentation costs on the heartbeat hot path.
+
+Runs the same in-process heartbeat load with METRICS=1 and METRICS=0 (each in
+its own interpreter, since the switch is read at import), alternating rounds
+to even out noise, then times the raw metric primitives.
+
+Usage: python benchmarks/metrics.py [requests_per_round] [rounds]   (default: 3000 5)
+Runs against a throwaway SQLite file, never server.db.
+"""
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from mixed_load import ADMISSION_OFF
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLIENTS = 50
+
+
+async def heartbeats(num_requests):
+    """Register CLIENTS clients, then time num_requests heartbeats through the full app."""
+    import httpx
+    from db import Base, engine
+    import app as server
+
+    Base.metadata.create_all(bind=engine)
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for i in range(CLIENTS):
+            await client.post("/clients/register", json={"client_id": f"pc-{i}", "ip": "10.0.0.1"})
+        # Warm up caches and code paths before timing
+        for i in range(200):
+            await client.post("/clients/heartbeat", json={"client_id": f"pc-{i % CLIENTS}", "ip": "10.0.0.2"})
+        started = time.perf_counter()
+        for i in range(num_requests):
+            response = await client.post("/clients/heartbeat", json={"client_id": f"pc-{i % CLIENTS}", "ip": "10.0.0.2"})
+            assert response.status_code == 200, response.text
+        return (time.perf_counter() - started) / num_requests
+
+
+def child(num_requests):
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    sys.path.insert(0, ROOT)
+    import logging
+    logging.disable(logging.WARNING)
+    print(json.dumps({"per_request": asyncio.run(heartbeats(num_requests))}))
+
+
+def run_child(num_requests, enabled):
+    # Every request comes from one in-process peer
+    env = dict(os.environ, **ADMISSION_OFF, METRICS="1" if enabled else "0")
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", str(num_requests)],
+        env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])["per_request"]
+
+
+def primitives():
+    sys.path.insert(0, ROOT)
+    from metrics import Counter, Histogram
+
+    histogram = Histogram("bench_seconds", "", ("method", "route"))
+    counter = Counter("bench_total", "", ("route", "status"))
+    n = 200000
+    started = time.perf_counter()
+    for i in range(n):
+        histogram.observe(0.003, "POST", "/clients/heartbeat")
+    observe = (time.perf_counter() - started) / n
+    started = time.perf_counter()
+    for i in range(n):
+        counter.inc("/clients/heartbeat", 200)
+    inc = (time.perf_counter() - started) / n
+    return observe, inc
+
+
+def main():
+    if sys.argv[1:2] == ["--child"]:
+        child(int(sys.argv[2]))
+        return
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    on, off = [], []
+    for round in range(rounds):
+        # Alternate which runs first so drift over the run does not favour either
+        for enabled in (False, True) if round % 2 == 0 else (True, False):
+            (on if enabled else off).append(run_child(num_requests, enabled))
+    on_median, off_median = statistics.median(on), statistics.median(off)
+    print(f"{num_requests} heartbeats x {rounds} rounds, in-process ASGI, median per request")
+    print(f"  METRICS=0   {off_median * 1e6:8.1f} us")
+    print(f"  METRICS=1   {on_median * 1e6:8.1f} us")
+    print(f"  overhead    {(on_median - off_median) * 1e6:8.1f} us ({(on_median / off_median - 1):+.1%})")
+    observe, inc = primitives()
+    print(f"  Histogram.observe {observe * 1e9:.0f} ns, Counter.inc {inc * 1e9:.0f} ns")
+    # The middleware does two observes and one inc per request
+    per_request = 2 * observe + inc
+    print(f"  metric updates per request {per_request * 1e6:.1f} us ({per_request / off_median:.2%} of a heartbeat)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+p50/p99 latency under mixed WebSocket and heartbeat traffic.
+
+Usage: python benchmarks/mixed_load.py [--clients 500] [--rate 1000] [--duration 10] [--url URL]
+
+Without --url a uvicorn server for app.py is started against a throwaway
+SQLite file. N agents register and hold WebSockets while heartbeats are
+POSTed at --rate per second. Every 100 ms a client is paused/unpaused, and
+the time until its socket receives the push is recorded.
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Server env with admission control out of the way, for runs where one process plays many clients
+ADMISSION_OFF = {"ADMISSION_RATE": "0", "ADMISSION_MAX_WRITES": "1000000", "ADMISSION_MAX_READS": "1000000"}
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def report(name, samples, errors=0):
+    print(
+        f"  {name:12s} n={len(samples):6d}  p50={percentile(samples, 0.5) * 1000:7.2f} ms  "
+        f"p99={percentile(samples, 0.99) * 1000:7.2f} ms  max={max(samples, default=0) * 1000:7.2f} ms  errors={errors}"
+    )
+
+
+def start_server(overrides=None, clients=()):
+    """Start app.py with `overrides` in its env, `clients` already registered."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    env = dict(os.environ, **(overrides or {}))
+    env["DATABASE_URL"] = f"sqlite:///{path}"
+    subprocess.run(
+        [sys.executable, "-c", "from db import Base, engine; import models; Base.metadata.create_all(bind=engine)"],
+        cwd=ROOT, env=env, check=True,
+    )
+    with sqlite3.connect(path) as connection:
+        connection.executemany(
+            "INSERT INTO clients (client_id, ip, state) VALUES (?, '10.0.0.1', 'unpaused')",
+            ((client_id,) for client_id in clients),
+        )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return server, f"http://127.0.0.1:{port}"
+
+
+async def wait_ready(session, url):
+    for _ in range(100):
+        try:
+            async with session.get(url + "/stats/db") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("Server did not start")
+
+
+async def run(args, url):
+    # Sockets get their own unlimited connector so they never starve HTTP requests
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=200)) as session, \
+            aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as ws_session:
+        await wait_ready(session, url)
+        client_ids = [f"bench-{i}" for i in range(args.clients)]
+        for start in range(0, len(client_ids), 100):
+            await asyncio.gather(*(
+                session.post(url + "/clients/register", json={"client_id": client_id, "ip": "10.0.0.1"},
+                             headers={"X-Client-ID": client_id})
+                for client_id in client_ids[start:start + 100]
+            ))
+
+        pending_pushes = {}
+        push_latency = []
+        sockets = []
+        for client_id in client_ids:
+            sockets.append((client_id, await ws_session.ws_connect(f"{url.replace('http', 'ws')}/ws/{client_id}")))
+
+        async def read_socket(client_id, ws):
+            async for message in ws:
+                sent = pending_pushes.pop(client_id, None)
+                if sent is not None:
+                    push_latency.append(time.perf_counter() - sent)
+
+        readers = [asyncio.create_task(read_socket(client_id, ws)) for client_id, ws in sockets]
+        await asyncio.sleep(0.5)  # let the initial schedule messages drain
+
+        heartbeat_latency, state_latency = [], []
+        errors = {"heartbeat": 0, "state": 0}
+        deadline = time.perf_counter() + args.duration
+
+        async def heartbeat(client_id):
+            started = time.perf_counter()
+            try:
+                async with session.post(url + "/clients/heartbeat", json={"client_id": client_id, "ip": "10.0.0.2"},
+                                        headers={"X-Client-ID": client_id}) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors["heartbeat"] += 1
+                        return
+                heartbeat_latency.append(time.perf_counter() - started)
+            except aiohttp.ClientError:
+                errors["heartbeat"] += 1
+
+        async def heartbeat_load():
+            tasks = set()
+            interval = 1 / args.rate
+            next_at = time.perf_counter()
+            while time.perf_counter() < deadline:
+                task = asyncio.create_task(heartbeat(random.choice(client_ids)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                next_at += interval
+                await asyncio.sleep(max(0, next_at - time.perf_counter()))
+            await asyncio.gather(*tasks)
+
+        async def state_load():
+            paused = False
+            while time.perf_counter() < deadline:
+                client_id = random.choice(client_ids)
+                paused = not paused
+                started = time.perf_counter()
+                pending_pushes[client_id] = started
+                try:
+                    async with session.post(
+                        url + "/clients/state", json={"client_id": client_id, "state": "paused" if paused else "unpaused"}
+                    ) as response:
+                        await response.read()
+                        if response.status != 200:
+                            errors["state"] += 1
+                        else:
+                            state_latency.append(time.perf_counter() - started)
+                except aiohttp.ClientError:
+                    errors["state"] += 1
+                await asyncio.sleep(0.1)
+
+        await asyncio.gather(heartbeat_load(), state_load())
+        await asyncio.sleep(0.5)
+        for task in readers:
+            task.cancel()
+        for _, ws in sockets:
+            await ws.close()
+
+    print(f"{args.clients} sockets, {args.rate} heartbeats/s for {args.duration}s against {url}")
+    report("heartbeat", heartbeat_latency, errors["heartbeat"])
+    report("state POST", state_latency, errors["state"])
+    report("push", push_latency)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--rate", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--url")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        # One process plays the whole fleet and the operator; measure latency, not admission
+        server, url = start_server(ADMISSION_OFF)
+    try:
+        asyncio.run(run(args, url))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
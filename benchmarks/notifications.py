@@ -0,0 +1,137 @@
+"""
+Replay a building-wide network blip through the notification dispatcher.
+
+N clients drop offline at once, most come back within the batching window
+(flaps), the rest recover later. Counts the messages that reach a local SMTP
+server and a file sink, then times the dispatcher on a large event burst.
+
+Usage: python benchmarks/notifications.py [num_clients] [flapping_percent]   (default: 500 90)
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+
+from notifications import Notifier  # noqa: E402
+
+WINDOW = 1.0
+
+
+class SmtpServer:
+    """Just enough SMTP to accept and count messages."""
+
+    def __init__(self):
+        self.messages = []
+
+    async def handle(self, reader, writer):
+        writer.write(b"220 localhost\r\n")
+        data = None
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if data is not None:
+                if line == b".\r\n":
+                    self.messages.append(b"".join(data).decode())
+                    data = None
+                    writer.write(b"250 queued\r\n")
+                else:
+                    data.append(line)
+                continue
+            command = line[:4].upper()
+            if command == b"DATA":
+                data = []
+                writer.write(b"354 go ahead\r\n")
+            elif command == b"QUIT":
+                writer.write(b"221 bye\r\n")
+                await writer.drain()
+                break
+            else:
+                writer.write(b"250 ok\r\n")
+            await writer.drain()
+        writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+
+async def blip(num_clients, flapping):
+    smtp = SmtpServer()
+    port = await smtp.start()
+    log = os.path.join(tempfile.mkdtemp(), "notifications.log")
+    notifier = Notifier()
+    config = {
+        "smtp": {"host": "127.0.0.1", "port": port},
+        "recipients": [
+            {"name": "admin", "sink": "smtp", "to": "admin@example.com", "window": WINDOW},
+            {"name": "log", "sink": "file", "path": log, "window": WINDOW},
+        ],
+    }
+    path = os.path.join(tempfile.mkdtemp(), "notifications.json")
+    with open(path, "w") as f:
+        json.dump(config, f)
+    notifier.start(path)
+
+    ids = [f"pc-{i}" for i in range(num_clients)]
+    flappers = ids[: num_clients * flapping // 100]
+    now = time.time()
+    for client_id in ids:
+        notifier.notify(client_id, "offline", now)
+    await asyncio.sleep(WINDOW / 4)
+    for client_id in flappers:
+        notifier.notify(client_id, "online")
+    # Offline reported again by a second worker: a duplicate
+    for client_id in ids[len(flappers):]:
+        notifier.notify(client_id, "offline", now)
+    await asyncio.sleep(WINDOW * 2)
+    for client_id in ids[len(flappers):]:
+        notifier.notify(client_id, "online")
+    await asyncio.sleep(WINDOW * 2)
+    stats = notifier.stats()
+    await notifier.stop()
+    smtp.server.close()
+
+    with open(log) as f:
+        lines = [json.loads(line) for line in f]
+    events = 4 * num_clients - 2 * len(flappers)
+    print(f"{num_clients} clients offline at once, {len(flappers)} back within the {WINDOW}s window")
+    print(f"  events in                 {events}")
+    print(f"  emails / file lines out   {len(smtp.messages)} / {len(lines)}")
+    for line in lines:
+        print(f"    {line['subject']}")
+    print(f"  duplicates {stats['duplicates']}, flaps {stats['flaps']}, quiet {stats['quiet']}")
+    print(f"  latency p50 {stats['latency_ms']['p50']:.0f} ms, max {stats['latency_ms']['max']:.0f} ms (window {WINDOW * 1000:.0f} ms)")
+
+
+async def throughput(num_events):
+    notifier = Notifier(queue_size=num_events)
+    path = os.path.join(tempfile.mkdtemp(), "notifications.json")
+    with open(path, "w") as f:
+        json.dump({"recipients": [{"name": "log", "sink": "file", "path": path + ".log", "window": 3600}]}, f)
+    notifier.start(path)
+    started = time.perf_counter()
+    for i in range(num_events):
+        notifier.notify(f"pc-{i % 50000}", "offline" if i // 50000 % 2 == 0 else "online")
+    queued = time.perf_counter() - started
+    while notifier.stats()["queue_depth"]:
+        await asyncio.sleep(0.01)
+    total = time.perf_counter() - started
+    await notifier.stop()
+    print(f"{num_events} events: notify() {queued / num_events * 1e6:.2f} us each, dispatched at {num_events / total:.0f} events/s")
+
+
+def main():
+    num_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    flapping = int(sys.argv[2]) if len(sys.argv) > 2 else 90
+    asyncio.run(blip(num_clients, flapping))
+    asyncio.run(throughput(200000))
+
+
+if __name__ == "__main__":
+    main()
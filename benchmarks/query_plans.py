@@ -0,0 +1,175 @@
+"""
+Check the query plan of every statement the server runs against the migrated schema.
+
+Builds a throwaway SQLite database with the migrations (db.upgrade_schema),
+checks it matches models.py, then drives every endpoint and background job
+through TestClient while recording the SQL they execute. Each distinct
+statement gets an EXPLAIN QUERY PLAN. A statement with a WHERE clause must not
+scan a whole table, and full loads may only scan their first table; any
+other scan must be listed in ALLOWED_SCANS with the reason.
+
+Usage: python benchmarks/query_plans.py [--verbose]
+Exits 1 if the schema differs from models.py or a plan scans where it should not.
+"""
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_PATH = os.path.join(tempfile.mkdtemp(), "plans.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+sys.path.insert(0, ROOT)
+# TestClient's httpx deprecation notice
+warnings.filterwarnings("ignore")
+
+from alembic.autogenerate import compare_metadata  # noqa: E402
+from alembic.migration import MigrationContext  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+import async_db  # noqa: E402
+import db  # noqa: E402
+import models  # noqa: E402,F401
+from mixed_load import ADMISSION_OFF  # noqa: E402
+
+# Every request comes from one TestClient peer; app (and admission) is imported in exercise()
+os.environ.update(ADMISSION_OFF)
+
+# Scans that are expected, as (pattern in the SQL, table scanned): reason
+ALLOWED_SCANS = {
+    ("clients.ip LIKE", "clients"): "ip prefix selector; SQLite's LIKE is case-insensitive, so no index applies",
+    ("availability_state.active", "availability_state"): "hourly checkpoint over one row per client and kind",
+}
+PLAN_LINE = re.compile(r"^(SCAN|SEARCH) (\w+)( .*)?$")
+
+statements = {}
+
+
+def record(conn, cursor, statement, parameters, context, executemany):
+    sql = " ".join(statement.split())
+    if sql.split(" ", 1)[0].upper() not in ("SELECT", "UPDATE", "DELETE", "INSERT"):
+        return
+    if executemany:
+        parameters = parameters[0] if parameters else ()
+    statements.setdefault(sql, parameters)
+
+
+def listen():
+    engines = {db.engine, db.read_engine, async_db.async_engine.sync_engine, async_db.async_read_engine.sync_engine}
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", record)
+
+
+def check_schema():
+    """Differences between the migrated database and models.py."""
+    with db.engine.connect() as connection:
+        context = MigrationContext.configure(connection, opts={"compare_type": True})
+        return compare_metadata(context, db.Base.metadata)
+
+
+def exercise():
+    """Drive every endpoint and background job once, with enough data for each path."""
+    import app as server
+    from availability import availability_log
+    from heartbeat_buffer import heartbeat_buffer
+    from liveness import liveness
+
+    client_ids = [f"plan-{i}" for i in range(20)]
+    with TestClient(server.app) as http:
+        for i, client_id in enumerate(client_ids):
+            http.post("/clients/register", json={"client_id": client_id, "ip": f"10.0.0.{i}"})
+        http.post("/clients/heartbeat", json={"client_id": client_ids[0], "ip": "10.0.0.100"})
+        http.post("/clients/heartbeat", json={"client_id": client_ids[0], "ip": "10.0.0.100", "version": ""})
+        heartbeat_buffer.flush()
+        http.post("/schedule", json={"client_id": client_ids[0], "disable_time": "22:00", "enable_time": "06:00"})
+        http.post("/schedule", json={"client_id": client_ids[1],
+                                     "windows": [{"days": "weekdays", "start": "21:00", "end": "07:00"}]})
+        http.post("/clients/state", json={"client_id": client_ids[2], "state": "paused"})
+        http.post("/clients/bulk", json={"client_ids": client_ids[:5], "action": "schedule",
+                                         "disable_time": "23:00", "enable_time": "07:00"})
+        http.post("/clients/bulk", json={"selector": {"state": "paused"}, "action": "unpause"})
+        http.post("/clients/bulk", json={"selector": {"ip_prefix": "10.0.0.1"}, "action": "pause"})
+        http.post("/clients/bulk", json={"selector": {"all": True}, "action": "unpause"})
+        with http.websocket_connect(f"/ws/{client_ids[3]}") as websocket:
+            websocket.receive_json()
+        for path in (
+            f"/clients/schedule/{client_ids[0]}", f"/clients/state/{client_ids[0]}", "/clients/status",
+            "/", "/dashboard", "/clients", "/manage", "/dashboard/clients?state=paused",
+            f"/reports/availability/{client_ids[0]}", "/reports/availability",
+            "/stats/heartbeats", "/stats/availability", "/stats/liveness", "/stats/schedule-engine", "/stats/db",
+            "/stats/client-cache", "/stats/ws-hub", "/stats/client-view", "/stats/notifications", "/stats/admission",
+            "/metrics",
+        ):
+            http.get(path)
+        availability_log.flush()
+        availability_log.checkpoint(datetime.utcnow() + timedelta(hours=2))
+        availability_log.compact(datetime.utcnow() + timedelta(days=400))
+        liveness.expire(now=time.time() + 3600)
+
+
+def plans():
+    """(sql, [plan lines]) for every recorded statement."""
+    connection = sqlite3.connect(DB_PATH)
+    try:
+        for sql, parameters in sorted(statements.items()):
+            if isinstance(parameters, dict):
+                rows = connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+            else:
+                rows = connection.execute(f"EXPLAIN QUERY PLAN {sql}", tuple(parameters or ())).fetchall()
+            yield sql, [row[3] for row in rows]
+    finally:
+        connection.close()
+
+
+def problems(sql, lines):
+    """Scans this plan should not have."""
+    full_load = " WHERE " not in sql.upper()
+    found = []
+    first = True
+    for line in lines:
+        match = PLAN_LINE.match(line.strip())
+        if match is None:
+            if "AUTOMATIC" in line:
+                found.append(line)
+            continue
+        kind, table, rest = match.group(1), match.group(2), match.group(3) or ""
+        if "AUTOMATIC" in rest:
+            found.append(line)
+        elif kind == "SCAN" and not (full_load and first):
+            if not any(pattern in sql and table == scanned for pattern, scanned in ALLOWED_SCANS):
+                found.append(line)
+        first = False
+    return found
+
+
+def main():
+    verbose = "--verbose" in sys.argv
+    db.upgrade_schema()
+    failed = False
+    diff = check_schema()
+    if diff:
+        failed = True
+        print("Migrated schema differs from models.py:")
+        for change in diff:
+            print(f"  {change}")
+    listen()
+    exercise()
+    checked = 0
+    for sql, lines in plans():
+        checked += 1
+        bad = problems(sql, lines)
+        if bad or verbose:
+            print(("FAIL " if bad else "ok   ") + sql[:160])
+            for line in lines:
+                print(f"       {line}")
+        failed = failed or bool(bad)
+    print(f"{checked} distinct statements checked; schema {'matches' if not diff else 'differs from'} models.py")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Concurrent heartbeat-write plus read throughput under each SQLite storage profile.
+
+Usage: python benchmarks/sqlite_profile.py [seconds] [writers] [readers]
+Each profile runs in its own subprocess against a throwaway SQLite file.
+"""
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NUM_CLIENTS = 5000
+BATCH_SIZE = 200
+
+
+def worker(seconds, writers, readers):
+    """Runs inside the subprocess, with DATABASE_URL/STORAGE_PROFILE already set."""
+    sys.path.insert(0, ROOT)
+    from sqlalchemy import bindparam
+    from db import Base, engine, ReadSessionLocal, load_client_record
+    from models import Client
+
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(
+            Client.__table__.insert(),
+            [{"client_id": f"pc-{i}", "ip": "10.0.0.1", "state": "unpaused"} for i in range(NUM_CLIENTS)],
+        )
+
+    table = Client.__table__
+    statement = (
+        table.update()
+        .where(table.c.client_id == bindparam("b_client_id"))
+        .values(ip=bindparam("b_ip"), last_heartbeat=bindparam("b_last_heartbeat"))
+    )
+    counts = {"writes": 0, "reads": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def write_loop():
+        rng = random.Random()
+        while time.perf_counter() < deadline:
+            rows = [
+                {"b_client_id": f"pc-{rng.randrange(NUM_CLIENTS)}", "b_ip": "10.0.0.2", "b_last_heartbeat": datetime.utcnow()}
+                for _ in range(BATCH_SIZE)
+            ]
+            try:
+                # Same statement the heartbeat buffer flushes; small batches keep the writer busy
+                with engine.begin() as connection:
+                    connection.execute(statement, rows)
+                with lock:
+                    counts["writes"] += len(rows)
+            except Exception:
+                with lock:
+                    counts["errors"] += 1
+
+    def read_loop():
+        rng = random.Random()
+        while time.perf_counter() < deadline:
+            db = ReadSessionLocal()
+            try:
+                load_client_record(f"pc-{rng.randrange(NUM_CLIENTS)}", db)
+                with lock:
+                    counts["reads"] += 1
+            except Exception:
+                with lock:
+                    counts["errors"] += 1
+            finally:
+                db.close()
+
+    threads = [threading.Thread(target=write_loop) for _ in range(writers)]
+    threads += [threading.Thread(target=read_loop) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(json.dumps({key: value / seconds if key != "errors" else value for key, value in counts.items()}))
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    writers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    readers = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    print(f"{seconds}s, {writers} writer threads, {readers} reader threads, {NUM_CLIENTS} clients")
+    for profile in ("legacy", "tuned"):
+        env = dict(os.environ)
+        env["STORAGE_PROFILE"] = profile
+        env["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+        output = subprocess.run(
+            [sys.executable, __file__, "--worker", str(seconds), str(writers), str(readers)],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"  {profile:7s} heartbeats/s: {result['writes']:9.0f}   reads/s: {result['reads']:8.0f}   errors: {result['errors']}"
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        worker(float(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]))
+    else:
+        main()
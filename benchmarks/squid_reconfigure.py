@@ -0,0 +1,103 @@
+"""
+Replay a day of enforce_schedule passes against a fake Squid.
+
+The old configure_squid rewrote squid.conf and ran `squid -k reconfigure` on
+the event loop every pass; the new one does it only when the generated config
+changes, in a worker thread. Counts reconfigures and measures how long the
+event loop stalls (a 10 ms ticker's worst lateness).
+
+Usage: python benchmarks/squid_reconfigure.py [interval_seconds] [reconfigure_ms]   (default: 60 20)
+The fake squid.exe is a shell script that sleeps reconfigure_ms; POSIX only.
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+WORK = tempfile.mkdtemp()
+# client.py reads the agent's site config at import
+config = types.ModuleType("config")
+config.CONFIG = {
+    "SERVER_URL": "http://127.0.0.1:9",
+    "SQUID_INSTALL_PATH": WORK,
+    "SQUID_CONF_PATH": os.path.join(WORK, "squid.conf"),
+    "LOG_LEVEL": "WARNING",
+}
+sys.modules["config"] = config
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import client  # noqa: E402
+
+SQUID = os.path.join(WORK, "bin", "squid.exe")
+CALLS = os.path.join(WORK, "calls")
+
+
+def install_fake_squid(reconfigure_ms):
+    os.makedirs(os.path.dirname(SQUID), exist_ok=True)
+    with open(SQUID, "w") as f:
+        f.write(f"#!/bin/sh\necho reconfigure >> {CALLS}\nsleep {reconfigure_ms / 1000}\n")
+    os.chmod(SQUID, 0o755)
+
+
+def old_configure_squid(block):
+    """configure_squid before diffing: write and reconfigure on the loop, every pass."""
+    config_content = "http_access deny all" if block else "http_access allow all"
+    with open(config.CONFIG["SQUID_CONF_PATH"], "w") as conf_file:
+        conf_file.write(f"http_port 3128\ndns_nameservers 8.8.8.8\n{config_content}\n")
+    subprocess.run([SQUID, "-k", "reconfigure"], capture_output=True, text=True)
+
+
+async def replay(configure, passes):
+    """Blocked 22:00-06:00, one pass per interval; returns (reconfigures, worst loop stall)."""
+    if os.path.exists(CALLS):
+        os.remove(CALLS)
+    client.squid_state.update(block=None, hash=None)
+    worst = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal worst
+        while not done:
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            worst = max(worst, time.perf_counter() - started - 0.01)
+
+    tick = asyncio.create_task(ticker())
+    for i in range(passes):
+        hour = 24 * i / passes
+        await configure(hour >= 22 or hour < 6)
+        await asyncio.sleep(0)
+    done = True
+    await tick
+    with open(CALLS) as f:
+        return sum(1 for _ in f), worst
+
+
+async def main():
+    interval = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    reconfigure_ms = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    install_fake_squid(reconfigure_ms)
+    passes = 86400 // interval
+
+    async def old(block):
+        old_configure_squid(block)
+
+    started = time.perf_counter()
+    old_calls, old_stall = await replay(old, passes)
+    old_time = time.perf_counter() - started
+    started = time.perf_counter()
+    new_calls, new_stall = await replay(client.configure_squid, passes)
+    new_time = time.perf_counter() - started
+
+    print(f"One day of enforce passes every {interval}s ({passes} passes), reconfigure takes {reconfigure_ms} ms")
+    print(f"  {'':22} {'reconfigures':>12} {'wall':>9} {'worst loop stall':>17}")
+    print(f"  {'every pass, on loop':22} {old_calls:12d} {old_time:8.2f}s {old_stall * 1000:14.1f} ms")
+    print(f"  {'on change, in thread':22} {new_calls:12d} {new_time:8.2f}s {new_stall * 1000:14.1f} ms")
+    print(f"  skipped as unchanged: {client.agent_stats['squid_unchanged']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
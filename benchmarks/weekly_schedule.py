@@ -0,0 +1,88 @@
+"""
+Time schedule lookups on the compiled weekly form against re-parsing strings.
+
+The agent used to strptime the disable/enable pair on every enforce pass, and
+the server kept only one daily window. WeeklySchedule answers is_blocked and
+next_transition with a bisect over compiled minute-of-week intervals, however
+many windows and date exceptions a client has.
+
+Usage: python benchmarks/weekly_schedule.py [lookups]   (default: 100000)
+"""
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from weekly_schedule import DAYS, WeeklySchedule, compile_daily, compile_rules, normalize_rules  # noqa: E402
+
+
+def old_in_schedule(schedule, now):
+    """enforce_schedule before compiling: parse both strings every pass."""
+    disable_time = datetime.datetime.strptime(schedule["disable_time"], "%H:%M").time()
+    enable_time = datetime.datetime.strptime(schedule["enable_time"], "%H:%M").time()
+    now = now.time()
+    return disable_time <= now <= enable_time or (
+        disable_time > enable_time and (now >= disable_time or now <= enable_time)
+    )
+
+
+def clock(minutes):
+    return f"{minutes // 60 % 24:02d}:{minutes % 60:02d}"
+
+
+def rich_rules(rng, num_windows, num_exceptions):
+    """Windows of 15 minutes to 2 hours on random days, plus whole-day exceptions."""
+    windows = []
+    for _ in range(num_windows):
+        start = rng.randrange(0, 1440, 15)
+        windows.append({
+            "days": rng.sample(DAYS, rng.randint(1, 3)),
+            "start": clock(start),
+            "end": clock(start + rng.randrange(15, 121, 15)),
+        })
+    start = datetime.date(2026, 1, 1)
+    dates = rng.sample(range(365), num_exceptions)
+    exceptions = [
+        {"date": (start + datetime.timedelta(days=day)).isoformat(), "windows": [{"start": "09:00", "end": "17:00"}]}
+        for day in dates
+    ]
+    return normalize_rules(windows, exceptions)
+
+
+def timed(label, lookups, fn, instants):
+    started = time.perf_counter()
+    for instant in instants:
+        fn(instant)
+    elapsed = time.perf_counter() - started
+    print(f"  {label:44} {elapsed / lookups * 1e6:8.2f} us")
+
+
+def main():
+    lookups = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = random.Random(7)
+    base = datetime.datetime(2026, 1, 1)
+    instants = [base + datetime.timedelta(minutes=rng.randrange(365 * 1440)) for _ in range(lookups)]
+
+    pair = {"disable_time": "22:00", "enable_time": "06:00"}
+    daily = WeeklySchedule.from_compiled(compile_daily(pair["disable_time"], pair["enable_time"]))
+    rules = rich_rules(rng, 20, 30)
+    started = time.perf_counter()
+    for _ in range(100):
+        compiled = compile_rules(rules)
+    compile_us = (time.perf_counter() - started) / 100 * 1e6
+    rich = WeeklySchedule.from_compiled(compiled)
+
+    print(f"{lookups} lookups at random minutes of 2026")
+    timed("daily pair, strptime per pass (old agent)", lookups, lambda now: old_in_schedule(pair, now), instants)
+    timed("daily pair, compiled is_blocked", lookups, daily.is_blocked, instants)
+    timed("daily pair, compiled next_transition", lookups, daily.next_transition, instants)
+    print(f"20 windows, 30 date exceptions ({len(rich.starts)} merged intervals), compiled once in {compile_us:.0f} us")
+    timed("rich, compiled is_blocked", lookups, rich.is_blocked, instants)
+    timed("rich, compiled next_transition", lookups, rich.next_transition, instants)
+
+
+if __name__ == "__main__":
+    main()
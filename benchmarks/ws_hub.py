@@ -0,0 +1,214 @@
+"""
+Hold many simulated agents on a multi-worker server and time cross-worker fan-out.
+
+Usage: python benchmarks/ws_hub.py [--agents 20000] [--workers 2] [--procs 4] [--encoding json|msgpack]
+
+A uvicorn server for app.py is started with --workers against a throwaway
+SQLite file pre-filled with the agents. --procs agent processes each hold
+their share of the WebSockets (one process cannot hold 20k sockets under a
+20k file limit). Once every socket is up, all agents are paused with one
+bulk request, which reaches sockets on other workers through the hub's
+broker. An "enforce" broadcast follows. For both, the time from the request
+until every socket has its message is reported, along with each worker's
+own fan-out time (queueing to the last completed send).
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import aiohttp
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def start_server(agents, workers):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite:///{path}"
+    subprocess.run(
+        [sys.executable, "-c", "from db import Base, engine; import models; Base.metadata.create_all(bind=engine)"],
+        cwd=ROOT, env=env, check=True,
+    )
+    with sqlite3.connect(path) as connection:
+        connection.executemany(
+            "INSERT INTO clients (client_id, ip, state) VALUES (?, '10.0.0.1', 'unpaused')",
+            ((f"hub-{i}",) for i in range(agents)),
+        )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return server, f"http://127.0.0.1:{port}"
+
+
+async def wait_ready(session, url):
+    for _ in range(300):
+        try:
+            async with session.get(url + "/stats/db") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("Server did not start")
+
+
+async def run_agents(url, first, count, encoding):
+    """Agent process: hold sockets, note when each receives the pause and the broadcast."""
+    received = {"paused": [], "enforce": [], "closed": []}
+    attempts = {"done": 0, "failed": 0}
+    all_attempted = asyncio.Event()
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        limit = asyncio.Semaphore(100)
+
+        async def agent(client_id):
+            async with limit:
+                try:
+                    ws = await session.ws_connect(f"{url.replace('http', 'ws', 1)}/ws/{client_id}?encoding={encoding}")
+                    # Ready once the initial schedule message is in, so it is not counted as a push
+                    await ws.receive()
+                except aiohttp.ClientError:
+                    ws = None
+                    attempts["failed"] += 1
+                attempts["done"] += 1
+                if attempts["done"] == count:
+                    all_attempted.set()
+            if ws is None:
+                return
+            async for message in ws:
+                if message.type == aiohttp.WSMsgType.BINARY:
+                    data = msgpack.unpackb(message.data)
+                else:
+                    data = json.loads(message.data)
+                if data.get("state") == "paused":
+                    received["paused"].append(time.time())
+                elif data.get("action") == "enforce":
+                    received["enforce"].append(time.time())
+            received["closed"].append(ws.close_code)
+
+        tasks = [asyncio.create_task(agent(f"hub-{i}")) for i in range(first, first + count)]
+        await all_attempted.wait()
+        print(json.dumps({"ready": count - attempts["failed"]}), flush=True)
+        # The parent closes stdin when it is done measuring
+        await asyncio.get_running_loop().run_in_executor(None, sys.stdin.read)
+        print(json.dumps(received), flush=True)
+        for task in tasks:
+            task.cancel()
+
+
+async def run(args, url):
+    async with aiohttp.ClientSession() as session:
+        await wait_ready(session, url)
+        share = args.agents // args.procs
+        started = time.perf_counter()
+        procs = [
+            subprocess.Popen(
+                [sys.executable, __file__, "--agent-shard", str(i * share), str(share), "--url", url,
+                 "--encoding", args.encoding],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+            )
+            for i in range(args.procs)
+        ]
+        connected = sum(json.loads(p.stdout.readline())["ready"] for p in procs)
+        connect_time = time.perf_counter() - started
+        hubs = {}
+        for _ in range(args.workers * 4):
+            # A fresh connection each time, so the kernel may hand it to another worker
+            async with session.get(url + "/stats/ws-hub", headers={"Connection": "close"}) as response:
+                stats = await response.json()
+                hubs[stats["worker"]] = stats
+
+        pause_at = time.time()
+        async with session.post(url + "/clients/bulk", json={"selector": {"all": True}, "action": "pause"}) as response:
+            await response.read()
+        pause_response = time.time() - pause_at
+        await asyncio.sleep(args.settle)
+
+        broadcast_at = time.time()
+        async with session.post(url + "/ws/broadcast", json={"action": "enforce"}) as response:
+            await response.read()
+        await asyncio.sleep(args.settle)
+
+        for _ in range(args.workers * 4):
+            async with session.get(url + "/stats/ws-hub", headers={"Connection": "close"}) as response:
+                stats = await response.json()
+                hubs[stats["worker"]] = stats
+
+        received = {"paused": [], "enforce": [], "closed": []}
+        for p in procs:
+            p.stdin.close()
+            for key, values in json.loads(p.stdout.readline()).items():
+                received[key].extend(values)
+            p.wait()
+
+    print(f"{connected}/{args.agents} agents connected in {connect_time:.1f}s "
+          f"({args.procs} agent processes, {args.workers} workers)")
+    print(f"  sockets per worker: {sorted(h['connections'] for h in hubs.values())} (sampled {len(hubs)} of {args.workers})")
+    if received["closed"]:
+        codes = {code: received["closed"].count(code) for code in set(received["closed"])}
+        print(f"  closed by the server during the run: {len(received['closed'])} (close codes {codes})")
+    for name, at, extra in (
+        ("bulk pause", pause_at, f"  request {pause_response * 1000:.0f} ms"),
+        ("broadcast", broadcast_at, ""),
+    ):
+        latencies = [t - at for t in received["paused" if name == "bulk pause" else "enforce"]]
+        print(
+            f"  {name:10s} delivered {len(latencies):6d}/{connected}  p50={percentile(latencies, 0.5) * 1000:7.0f} ms  "
+            f"p99={percentile(latencies, 0.99) * 1000:7.0f} ms  last={max(latencies, default=0) * 1000:7.0f} ms{extra}"
+        )
+    for worker, stats in sorted(hubs.items()):
+        print(f"  worker {worker}: {stats['fanout_ms']['count']} fan-outs, slowest {stats['fanout_ms']['max']:.0f} ms, "
+              f"{stats['sent']} frames sent, {stats['dropped']} dropped")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--agents", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--procs", type=int, default=4)
+    parser.add_argument("--settle", type=float, default=10, help="seconds to wait for each fan-out")
+    parser.add_argument("--encoding", choices=("json", "msgpack"), default="json")
+    parser.add_argument("--url")
+    parser.add_argument("--agent-shard", nargs=2, type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.agent_shard:
+        asyncio.run(run_agents(args.url, *args.agent_shard, args.encoding))
+        return
+
+    server = None
+    url = args.url
+    if url is None:
+        server, url = start_server(args.agents, args.workers)
+    try:
+        asyncio.run(run(args, url))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,20 +4,229 @@ import socket
 import datetime
 import uuid
 import json
+import hashlib
+import tempfile
 import asyncio
+import random
+import subprocess
+import time
+import collections
+import email.utils
 import aiohttp
 import websockets
+
+try:
+    import msgpack
+except ImportError:  # Optional; the server then sends JSON
+    msgpack = None
 from config import CONFIG  # Import centralized configurations
+from log_config import configure_from
+from weekly_schedule import WeeklySchedule
 
 # Disable Python's output buffering
 os.environ["PYTHONUNBUFFERED"] = "1"
 
-# Set up logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[logging.StreamHandler()],
-)
+# Set up logging: LOG_LEVEL, LOG_FORMAT ("json"), per-module LOG_LEVELS and
+# per-event LOG_SAMPLE / LOG_RATE in CONFIG, e.g. {"heartbeat": 100} logs 1 in 100
+configure_from(CONFIG)
+
+# Last schedule/state received from the server, pushed over the WebSocket
+# or fetched over HTTP while the socket is down; "compiled" is its WeeklySchedule
+local_state = {"schedule": None, "compiled": None, "state": "unpaused", "version": None}
+socket_connected = asyncio.Event()
+schedule_changed = asyncio.Event()
+# Open WebSocket, and whether the server accepts heartbeat frames on it
+socket_state = {"websocket": None, "heartbeats": False}
+# Block state and config hash Squid last reconfigured with successfully
+squid_state = {"block": None, "hash": None}
+
+# HTTP session settings; any of them can be overridden in CONFIG
+HTTP_DEFAULTS = {
+    "HTTP_CONNECTION_LIMIT": 4,      # Open connections to the server at most
+    "HTTP_KEEPALIVE_TIMEOUT": 60,    # Seconds an idle connection is kept for reuse
+    "HTTP_CONNECT_TIMEOUT": 5,
+    "HTTP_REQUEST_TIMEOUT": 10,
+    "HTTP_MAX_RETRIES": 3,
+    "HTTP_BACKOFF_BASE": 0.5,        # First retry waits up to this many seconds
+    "HTTP_BACKOFF_MAX": 30,
+    "HTTP_STATS_INTERVAL": 300,      # Seconds between stats log lines (and STATS_FILE writes)
+}
+# Recent request and Squid reconfigure durations kept for percentiles
+LATENCY_SAMPLES = 500
+# Seconds `squid -k reconfigure` may take before it is abandoned and retried
+SQUID_RECONFIGURE_TIMEOUT = CONFIG.get("SQUID_RECONFIGURE_TIMEOUT", 30)
+# Responses worth retrying; anything else is returned to the caller
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Statuses whose Retry-After holds off every request, not just the retried one
+THROTTLE_STATUSES = {429, 503}
+
+def http_setting(name):
+    return CONFIG.get(name, HTTP_DEFAULTS[name])
+
+def percentiles(samples):
+    """p50/p95/max of durations in seconds, in milliseconds."""
+    if not samples:
+        return {"p50": None, "p95": None, "max": None}
+    ordered = sorted(samples)
+    return {
+        "p50": round(ordered[len(ordered) // 2] * 1000, 1),
+        "p95": round(ordered[min(len(ordered) - 1, len(ordered) * 95 // 100)] * 1000, 1),
+        "max": round(ordered[-1] * 1000, 1),
+    }
+
+class ServerSession:
+    """One keep-alive aiohttp session for every request the agent makes."""
+
+    def __init__(self):
+        self._session = None
+        # Sent as X-Client-ID, which the server rate-limits by
+        self.client_id = None
+        # time.monotonic() before which the server asked us not to send anything
+        self.resume_at = 0.0
+        self.stats = {
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+            "throttled": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+        }
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    def _trace_config(self):
+        """Count new versus reused connections."""
+        trace = aiohttp.TraceConfig()
+
+        async def on_create(session, context, params):
+            self.stats["connections_created"] += 1
+
+        async def on_reuse(session, context, params):
+            self.stats["connections_reused"] += 1
+
+        trace.on_connection_create_end.append(on_create)
+        trace.on_connection_reuseconn.append(on_reuse)
+        return trace
+
+    def session(self):
+        """Return the shared session, creating it on first use."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=http_setting("HTTP_CONNECTION_LIMIT"),
+                keepalive_timeout=http_setting("HTTP_KEEPALIVE_TIMEOUT"),
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=http_setting("HTTP_REQUEST_TIMEOUT"),
+                connect=http_setting("HTTP_CONNECT_TIMEOUT"),
+            )
+            headers = {"X-Client-ID": self.client_id} if self.client_id else None
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=timeout, headers=headers, trace_configs=[self._trace_config()]
+            )
+        return self._session
+
+    def hold(self, response):
+        """
+        Hold off every request for a 429/503's Retry-After (seconds or an HTTP
+        date), capped at HTTP_BACKOFF_MAX.
+        """
+        value = response.headers.get("Retry-After")
+        if value is None:
+            return
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                when = email.utils.parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                return
+            delay = (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+        delay = min(max(delay, 0.0), http_setting("HTTP_BACKOFF_MAX"))
+        self.stats["throttled"] += 1
+        self.resume_at = max(self.resume_at, time.monotonic() + delay)
+        logging.warning("Server asked to retry after %.0fs.", delay, extra={"event": "http_throttled"})
+
+    def wait_time(self, default):
+        """Seconds to sleep before the next request: default, or longer if the server asked."""
+        return max(default, self.resume_at - time.monotonic())
+
+    def backoff(self, attempt):
+        """Exponential backoff with full jitter."""
+        ceiling = min(http_setting("HTTP_BACKOFF_MAX"), http_setting("HTTP_BACKOFF_BASE") * 2 ** attempt)
+        return random.uniform(0, ceiling)
+
+    async def request(self, method, path, payload=None, headers=None, timeout=None):
+        """
+        Send a request, retrying connection errors and retryable statuses.
+        Returns (status, json_body_or_None), or (None, None) if every attempt failed.
+        """
+        url = CONFIG["SERVER_URL"] + path
+        retries = http_setting("HTTP_MAX_RETRIES")
+        kwargs = {"json": payload, "headers": headers}
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+        for attempt in range(retries + 1):
+            held = self.resume_at - time.monotonic()
+            if held > 0:
+                await asyncio.sleep(held)
+            self.stats["requests"] += 1
+            started = time.perf_counter()
+            try:
+                async with self.session().request(method, url, **kwargs) as response:
+                    if response.status in THROTTLE_STATUSES:
+                        self.hold(response)
+                    if response.status not in RETRY_STATUSES or attempt == retries:
+                        body = None
+                        if response.content_type == "application/json":
+                            body = await response.json()
+                        else:
+                            await response.read()
+                        self.latencies.append(time.perf_counter() - started)
+                        return response.status, body
+                    logging.warning(
+                        "%s %s returned %s; retrying.", method, path, response.status, extra={"event": "http_retry"}
+                    )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning("%s %s failed: %r", method, path, e, extra={"event": "http_retry"})
+                if attempt == retries:
+                    break
+            self.stats["retries"] += 1
+            # Jittered on top of any Retry-After, so a shed fleet does not return in step
+            await asyncio.sleep(self.backoff(attempt) + max(0.0, self.resume_at - time.monotonic()))
+        self.stats["failures"] += 1
+        return None, None
+
+    def snapshot(self):
+        return dict(self.stats, latency_ms=percentiles(self.latencies))
+
+    def log_stats(self):
+        stats = self.snapshot()
+        opened = stats["connections_created"] + stats["connections_reused"]
+        reuse = stats["connections_reused"] / opened if opened else 0.0
+        latency = stats["latency_ms"]
+        logging.info(
+            f"HTTP: {stats['requests']} requests, {stats['retries']} retries, {stats['failures']} failures, "
+            f"{stats['throttled']} throttled, "
+            f"{stats['connections_created']} connections created, {stats['connections_reused']} reused "
+            f"({reuse:.0%} reuse), latency p50 {latency['p50']} ms, p95 {latency['p95']} ms, max {latency['max']} ms"
+        )
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+server = ServerSession()
+
+# Agent counters, logged with the HTTP stats instead of a line per heartbeat
+agent_stats = {
+    "heartbeats_socket": 0,
+    "heartbeats_http": 0,
+    "heartbeat_failures": 0,
+    "squid_reconfigures": 0,
+    "squid_failures": 0,
+    "squid_unchanged": 0,
+    "state_saves": 0,
+}
+squid_durations = collections.deque(maxlen=LATENCY_SAMPLES)
 
 # Utility functions
 def get_local_ip():
@@ -56,122 +265,362 @@ def save_client_id(client_id):
     except Exception as e:
         logging.error(f"Error saving client ID: {e}")
 
+def state_file():
+    """Local store for the last schedule/state/version: STATE_FILE, or agent_state.json next to ID_FILE."""
+    return CONFIG.get("STATE_FILE") or os.path.join(
+        os.path.dirname(os.path.abspath(CONFIG["ID_FILE"])), "agent_state.json"
+    )
+
+def load_local_state():
+    """Restore what save_local_state() last wrote, so enforcement starts without the server."""
+    path = state_file()
+    try:
+        with open(path, "r") as f:
+            saved = json.load(f)
+        compiled = compile_schedule(saved.get("schedule"))
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        logging.warning(f"Ignoring local state in {path}: {e}")
+        return False
+    local_state["schedule"] = saved.get("schedule")
+    local_state["compiled"] = compiled
+    local_state["state"] = saved.get("state", "unpaused")
+    local_state["version"] = saved.get("version")
+    summary = compiled.describe() if compiled is not None else "no schedule"
+    logging.info(
+        f"Loaded version {local_state['version']} saved at {saved.get('saved_at')}: {summary} ({local_state['state']})"
+    )
+    return True
+
+def save_local_state():
+    """Persist the current schedule/state/version atomically."""
+    snapshot = {
+        "schedule": local_state["schedule"],
+        "state": local_state["state"],
+        "version": local_state["version"],
+        "saved_at": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+    try:
+        write_atomically(state_file(), json.dumps(snapshot))
+        agent_stats["state_saves"] += 1
+    except OSError as e:
+        logging.error(f"Could not save local state: {e}")
+
 async def register_client(client_id, local_ip):
-    """Register the client with the server."""
+    """Register the client with the server; returns True on success."""
     try:
-        async with aiohttp.ClientSession() as session:
-            payload = {"client_id": client_id, "ip": local_ip}
-            url = CONFIG["SERVER_URL"] + "/clients/register"  # Corrected path
-            async with session.post(url, json=payload) as response:
-                if response.status == 200:
-                    logging.info("Client registered successfully.")
-                else:
-                    logging.warning(f"Client registration failed: {response.status}")
+        payload = {"client_id": client_id, "ip": local_ip}
+        status, _ = await server.request("POST", "/clients/register", payload)
+        if status == 200:
+            logging.info("Client registered successfully.")
+            return True
+        logging.warning(f"Client registration failed: {status}")
     except Exception as e:
         logging.error(f"Error registering client: {e}")
+    return False
+
+def compile_schedule(schedule):
+    """WeeklySchedule for a received schedule: its compiled intervals, or the daily pair from older servers."""
+    if not schedule:
+        return None
+    if schedule.get("intervals"):
+        return WeeklySchedule.from_compiled(schedule["intervals"])
+    return WeeklySchedule.from_row(schedule.get("disable_time"), schedule.get("enable_time"), None)
+
+def apply_update(data):
+    """Store a versioned schedule/state update; returns True if anything changed."""
+    version = data.get("version")
+    if version is not None and version == local_state["version"]:
+        return False
+    try:
+        compiled = compile_schedule(data.get("schedule"))
+    except (ValueError, KeyError, TypeError) as e:
+        logging.error(f"Ignoring invalid schedule in version {version}: {e}")
+        return False
+    local_state["schedule"] = data.get("schedule")
+    local_state["compiled"] = compiled
+    local_state["state"] = data.get("state", local_state["state"])
+    local_state["version"] = version
+    schedule_changed.set()
+    save_local_state()
+    summary = compiled.describe() if compiled is not None else "no schedule"
+    logging.info(f"Schedule updated to version {version}: {summary} ({local_state['state']})")
+    return True
 
 async def fetch_schedule(client_id):
-    """Fetch the schedule from the server."""
+    """Fetch the schedule from the server, skipping the body if our version is current."""
     try:
-        async with aiohttp.ClientSession() as session:
-            url = CONFIG["SERVER_URL"] + f"/clients/schedule/{client_id}"  # Corrected path
-            async with session.get(url) as response:
-                if response.status == 200:
-                    schedule = await response.json()
-                    logging.info(f"Schedule fetched: {schedule}")
-                    return schedule
-                else:
-                    logging.warning(f"Failed to fetch schedule: {response.status}")
+        headers = {}
+        if local_state["version"]:
+            headers["If-None-Match"] = f'"{local_state["version"]}"'
+        status, data = await server.request("GET", f"/clients/schedule/{client_id}", headers=headers)
+        if status == 304:
+            logging.debug("Schedule unchanged.", extra={"event": "schedule_fetch"})
+            return local_state["schedule"]
+        if status == 200:
+            schedule = {
+                "disable_time": data.get("disable_time"),
+                "enable_time": data.get("enable_time"),
+                "intervals": data.get("intervals"),
+            }
+            apply_update({"schedule": schedule, "state": data.get("state"), "version": data.get("version")})
+            return schedule
+        logging.warning(f"Failed to fetch schedule: {status}")
     except Exception as e:
         logging.error(f"Error fetching schedule: {e}")
     return None
 
 async def send_heartbeat(client_id, local_ip):
-    """Send periodic heartbeat to the server."""
+    """
+    Send periodic heartbeat to the server. While the WebSocket is up and the
+    server accepts it, the heartbeat is a small frame on the socket. Otherwise
+    it is an HTTP POST that also carries our schedule version, and the server
+    answers with the current schedule if it changed, so no separate poll is needed.
+    """
     while True:
+        if await send_socket_heartbeat(local_ip):
+            await asyncio.sleep(CONFIG["HEARTBEAT_INTERVAL"])
+            continue
         try:
-            async with aiohttp.ClientSession() as session:
-                payload = {"client_id": client_id, "ip": local_ip}
-                url = CONFIG["SERVER_URL"] + "/clients/heartbeat"  # Corrected path
-                async with session.post(url, json=payload) as response:
-                    if response.status == 200:
-                        logging.info("Heartbeat sent successfully.")
-                    else:
-                        logging.warning(f"Heartbeat failed: {response.status}")
+            payload = {"client_id": client_id, "ip": local_ip}
+            if not socket_connected.is_set():
+                payload["version"] = local_state["version"] or ""
+            status, data = await server.request("POST", "/clients/heartbeat", payload)
+            if status == 200:
+                agent_stats["heartbeats_http"] += 1
+                logging.debug("Heartbeat sent over HTTP.", extra={"event": "heartbeat"})
+                if data and "update" in data:
+                    apply_update(data["update"])
+            else:
+                agent_stats["heartbeat_failures"] += 1
+                logging.warning("Heartbeat failed: %s", status, extra={"event": "heartbeat"})
         except Exception as e:
             logging.error(f"Error sending heartbeat: {e}")
-        await asyncio.sleep(CONFIG["HEARTBEAT_INTERVAL"])
+        await asyncio.sleep(server.wait_time(CONFIG["HEARTBEAT_INTERVAL"]))
+
+async def send_socket_heartbeat(local_ip):
+    """Send a heartbeat frame on the WebSocket; returns False if HTTP must be used."""
+    websocket = socket_state["websocket"]
+    if websocket is None or not socket_state["heartbeats"]:
+        return False
+    try:
+        await websocket.send(json.dumps({"type": "heartbeat", "ip": local_ip}))
+        agent_stats["heartbeats_socket"] += 1
+        logging.debug("Heartbeat sent over WebSocket.", extra={"event": "heartbeat"})
+        return True
+    except Exception as e:
+        logging.warning(f"WebSocket heartbeat failed, falling back to HTTP: {e}")
+        return False
+
+def log_stats():
+    """Log HTTP and agent counters, and write them to STATS_FILE if one is configured."""
+    server.log_stats()
+    squid = percentiles(squid_durations)
+    logging.info(
+        f"Agent: {agent_stats['heartbeats_socket']} socket / {agent_stats['heartbeats_http']} HTTP heartbeats, "
+        f"{agent_stats['heartbeat_failures']} failed, {agent_stats['squid_reconfigures']} Squid reconfigures "
+        f"({agent_stats['squid_failures']} failed, p50 {squid['p50']} ms, max {squid['max']} ms), "
+        f"{agent_stats['squid_unchanged']} skipped as unchanged"
+    )
+    stats_file = CONFIG.get("STATS_FILE")
+    if stats_file:
+        snapshot = {
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "http": server.snapshot(),
+            "agent": dict(agent_stats, squid_reconfigure_ms=squid),
+        }
+        try:
+            with open(stats_file, "w") as f:
+                json.dump(snapshot, f, indent=2)
+        except OSError as e:
+            logging.warning(f"Could not write stats to {stats_file}: {e}")
+
+async def log_stats_periodically():
+    """Log the agent's stats every HTTP_STATS_INTERVAL seconds."""
+    while True:
+        await asyncio.sleep(http_setting("HTTP_STATS_INTERVAL"))
+        log_stats()
+
+def websocket_url(client_id):
+    """WebSocket URL for the agent, derived from SERVER_URL unless WEBSOCKET_URL is set."""
+    base = CONFIG.get("WEBSOCKET_URL") or CONFIG["SERVER_URL"]
+    if base.startswith("http"):
+        base = "ws" + base[len("http"):]
+    url = f"{base}/ws/{client_id}"
+    if msgpack is not None:
+        url += "?encoding=msgpack"
+    return url
 
 async def websocket_client(client_id):
     """Connect to the server via WebSocket."""
     retry_delay = CONFIG["RETRY_DELAY"]
     while True:
         try:
-            async with websockets.connect(f"{CONFIG['SERVER_URL']}/ws/{client_id}") as websocket:  # Corrected path
+            async with websockets.connect(websocket_url(client_id)) as websocket:  # Corrected path
                 logging.info("WebSocket connected.")
+                socket_state["websocket"] = websocket
+                socket_connected.set()
                 while True:
                     message = await websocket.recv()
-                    data = json.loads(message)
-                    if data.get("schedule"):
-                        logging.info(f"Received new schedule: {data['schedule']}")
+                    # Binary frames are msgpack, text frames JSON
+                    data = msgpack.unpackb(message) if isinstance(message, bytes) else json.loads(message)
+                    if "version" in data:
+                        apply_update(data)
+                    elif data.get("action") == "hello":
+                        socket_state["heartbeats"] = bool(data.get("heartbeats"))
+                    elif data.get("action") == "heartbeat_rejected":
+                        logging.warning("Server rejected a WebSocket heartbeat.")
+                    elif data.get("action") == "enforce":
+                        # The server saw a schedule transition; re-evaluate now
+                        schedule_changed.set()
                     elif data.get("action") == "shutdown":
                         logging.info("Shutdown command received. Exiting...")
                         return
         except Exception as e:
-            logging.error(f"WebSocket error: {e}. Retrying in {retry_delay} seconds.")
-            await asyncio.sleep(retry_delay)
+            delay = server.wait_time(retry_delay)
+            logging.error(f"WebSocket error: {e}. Retrying in {delay:.0f} seconds.")
+            await asyncio.sleep(delay)
+        finally:
+            socket_state["websocket"] = None
+            socket_state["heartbeats"] = False
+            socket_connected.clear()
 
 async def enforce_schedule(client_id):
-    """Periodically enforce the downtime schedule."""
+    """
+    Enforce the downtime schedule: check the compiled schedule, then sleep
+    until its next transition, a pushed update, or HEARTBEAT_INTERVAL.
+    """
     while True:
-        schedule = await fetch_schedule(client_id)
-        if schedule:
-            disable_time = datetime.datetime.strptime(schedule["disable_time"], "%H:%M").time()
-            enable_time = datetime.datetime.strptime(schedule["enable_time"], "%H:%M").time()
-            now = datetime.datetime.now().time()
-
-            in_schedule = disable_time <= now <= enable_time or (
-                disable_time > enable_time and (now >= disable_time or now <= enable_time)
-            )
-            configure_squid(block=in_schedule)
+        # Updates arrive over the WebSocket, or with the heartbeat while it is down
+        schedule_changed.clear()
+
+        compiled = local_state["compiled"]
+        paused = local_state["state"] == "paused"
+        timeout = CONFIG["HEARTBEAT_INTERVAL"]
+        if compiled is not None:
+            now = datetime.datetime.now()
+            await configure_squid(block=paused or compiled.is_blocked(now))
+            transition = compiled.next_transition(now)
+            if transition is not None:
+                until = (transition[0] - datetime.datetime.now()).total_seconds()
+                timeout = max(0.0, min(timeout, until))
+        elif paused or local_state["version"] is not None:
+            # The server has answered, with no schedule: only a pause blocks
+            await configure_squid(block=paused)
         else:
-            logging.warning("No schedule retrieved. Using default configuration.")
-        await asyncio.sleep(CONFIG["HEARTBEAT_INTERVAL"])
+            logging.warning("No schedule known yet. Leaving Squid as it is.", extra={"event": "enforce"})
+
+        # Wake early when a pushed update arrives
+        try:
+            await asyncio.wait_for(schedule_changed.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
 
-def configure_squid(block):
-    """Modify and reload Squid configuration."""
+def squid_config(block):
+    """The generated squid.conf for a block state."""
+    config_content = "http_access deny all" if block else "http_access allow all"
+    return f"http_port 3128\ndns_nameservers 8.8.8.8\n{config_content}\n"
+
+def write_atomically(path, content):
+    """
+    Write through a temp file in the same directory, so readers (Squid) never
+    see a partial file. Written as UTF-8 bytes with no newline translation
+    (no CRLF on Windows), so the file hashes like content.encode().
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content.encode())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+def applied_config_hash(path):
+    """Hash of the config already on disk, which Squid loads when it starts."""
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+async def configure_squid(block):
+    """
+    Write and reload the Squid configuration, only when it differs from what
+    Squid last loaded. A reconfigure drops in-flight proxy connections.
+    """
+    content = squid_config(block)
+    digest = hashlib.sha256(content.encode()).hexdigest()
+    if digest == squid_state["hash"]:
+        agent_stats["squid_unchanged"] += 1
+        return
     try:
         squid_path = os.path.join(CONFIG["SQUID_INSTALL_PATH"], "bin", "squid.exe")
         if not os.path.exists(squid_path):
-            logging.error("Squid executable not found.")
+            logging.error("Squid executable not found.", extra={"event": "squid"})
             return
 
-        config_content = "http_access deny all" if block else "http_access allow all"
-        with open(CONFIG["SQUID_CONF_PATH"], "w") as conf_file:
-            conf_file.write(f"http_port 3128\ndns_nameservers 8.8.8.8\n{config_content}\n")
-        logging.info(f"Squid config updated: {config_content}")
+        write_atomically(CONFIG["SQUID_CONF_PATH"], content)
+        logging.info("Squid config updated: %s", "http_access deny all" if block else "http_access allow all")
 
-        result = subprocess.run([squid_path, "-k", "reconfigure"], capture_output=True, text=True)
+        # Off the event loop, so heartbeats and socket traffic carry on meanwhile
+        started = time.perf_counter()
+        result = await asyncio.to_thread(
+            subprocess.run, [squid_path, "-k", "reconfigure"],
+            capture_output=True, text=True, timeout=SQUID_RECONFIGURE_TIMEOUT,
+        )
+        squid_durations.append(time.perf_counter() - started)
+        agent_stats["squid_reconfigures"] += 1
         if result.returncode == 0:
+            # Only a successful reconfigure is remembered; anything else is retried next pass
+            squid_state["hash"] = digest
+            squid_state["block"] = block
             logging.info("Squid reconfigured successfully.")
         else:
+            agent_stats["squid_failures"] += 1
             logging.error(f"Squid reconfiguration failed: {result.stderr}")
+    except subprocess.TimeoutExpired:
+        agent_stats["squid_failures"] += 1
+        logging.error(f"Squid reconfigure timed out after {SQUID_RECONFIGURE_TIMEOUT}s.")
     except Exception as e:
         logging.error(f"Error configuring Squid: {e}")
 
-async def main():
-    client_id = get_client_id()
-    local_ip = get_local_ip()
-
-    # Register client with server
-    await register_client(client_id, local_ip)
-
-    # Start tasks
+async def connect_to_server(client_id, local_ip):
+    """
+    Register (retrying while the server is down), reconcile the stored
+    schedule with one If-None-Match fetch, then keep the heartbeat and
+    WebSocket going. Enforcement does not wait for any of it.
+    """
+    while not await register_client(client_id, local_ip):
+        await asyncio.sleep(server.wait_time(CONFIG["RETRY_DELAY"]))
+    await fetch_schedule(client_id)
     await asyncio.gather(
-        enforce_schedule(client_id),
         send_heartbeat(client_id, local_ip),
         websocket_client(client_id),
     )
 
+async def main():
+    client_id = get_client_id()
+    server.client_id = client_id
+    local_ip = get_local_ip()
+    # After an agent restart the config on disk is the one Squid is running with
+    squid_state["hash"] = applied_config_hash(CONFIG["SQUID_CONF_PATH"])
+    # Enforce the last known schedule right away, whether or not the server is up
+    load_local_state()
+
+    try:
+        await asyncio.gather(
+            enforce_schedule(client_id),
+            connect_to_server(client_id, local_ip),
+            log_stats_periodically(),
+        )
+    finally:
+        log_stats()
+        await server.close()
+
 if __name__ == "__main__":
     asyncio.run(main())
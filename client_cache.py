@@ -0,0 +1,166 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from db import ReadSessionLocal, load_client_record
+from weekly_schedule import WeeklySchedule
+
+# Maximum number of clients kept in the cache
+CACHE_MAX_SIZE = 10000
+# Seconds before a cached record is reloaded from the database
+CACHE_TTL = 300
+
+
+class ClientRecord(
+    namedtuple("ClientRecord", ["id", "client_id", "ip", "state", "disable_time", "enable_time", "intervals"])
+):
+    """Compact, immutable view of a client and its schedule (intervals: compiled JSON)."""
+
+    __slots__ = ()
+
+    @property
+    def version(self):
+        """Content version of the schedule and state, used as ETag and push version."""
+        key = f"{self.disable_time}|{self.enable_time}|{self.intervals}|{self.state}"
+        return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+    def weekly_schedule(self):
+        """The compiled WeeklySchedule, or None if the client has no schedule."""
+        return WeeklySchedule.from_row(self.disable_time, self.enable_time, self.intervals)
+
+
+class ClientCache:
+    """Bounded LRU/TTL cache from client_id to ClientRecord."""
+
+    def __init__(self, max_size=CACHE_MAX_SIZE, ttl=CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so in-flight loads never store stale rows
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, client_id, db_session=None):
+        """Return the cached record for client_id, loading it on a miss."""
+        record, generation = self._lookup(client_id)
+        if generation is None:
+            return record
+        if db_session is not None:
+            row = load_client_record(client_id, db_session)
+        else:
+            db = ReadSessionLocal()
+            try:
+                row = load_client_record(client_id, db)
+            finally:
+                db.close()
+        return self._fill(row, generation)
+
+    async def get_async(self, client_id, db_session=None):
+        """Like get(), but loads misses through the async engine."""
+        import async_db
+        record, generation = self._lookup(client_id)
+        if generation is None:
+            return record
+        if db_session is not None:
+            row = await async_db.load_client_record(client_id, db_session)
+        else:
+            async with async_db.AsyncReadSessionLocal() as db:
+                row = await async_db.load_client_record(client_id, db)
+        return self._fill(row, generation)
+
+    def _lookup(self, client_id):
+        """Return (record, None) on a hit, or (None, generation) on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(client_id)
+            if entry is not None:
+                record, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(client_id)
+                    self.hits += 1
+                    return record, None
+                del self._entries[client_id]
+                self.expirations += 1
+            self.misses += 1
+            return None, self._generation
+
+    def _fill(self, row, generation):
+        """Store a loaded row unless an invalidation happened while it was read."""
+        if not row:
+            return None
+        record = ClientRecord(*row)
+        with self._lock:
+            if self._generation == generation:
+                self._store(record, time.monotonic())
+        return record
+
+    def _store(self, record, now):
+        self._entries[record.client_id] = (record, now + self.ttl)
+        self._entries.move_to_end(record.client_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def put_many(self, rows):
+        """Store freshly loaded rows, e.g. right after a bulk write."""
+        records = [ClientRecord(*row) for row in rows]
+        now = time.monotonic()
+        with self._lock:
+            for record in records:
+                self._store(record, now)
+        return records
+
+    def update_ip(self, client_id, ip):
+        """Refresh the cached IP after a heartbeat without reloading the row."""
+        with self._lock:
+            entry = self._entries.get(client_id)
+            if entry is not None and entry[0].ip != ip:
+                record, expires_at = entry
+                self._entries[client_id] = (record._replace(ip=ip), expires_at)
+
+    def invalidate(self, client_id):
+        """Drop a client after its row was written."""
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(client_id, None)
+            self.invalidations += 1
+
+    def invalidate_many(self, client_ids):
+        """Drop several clients after a bulk write."""
+        with self._lock:
+            self._generation += 1
+            for client_id in client_ids:
+                self._entries.pop(client_id, None)
+            self.invalidations += len(client_ids)
+
+    def clear(self):
+        """Drop every cached client."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        """Return cache counters."""
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            "size": size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+# Shared cache used by the API endpoints
+client_cache = ClientCache()
@@ -0,0 +1,276 @@
+import asyncio
+import bisect
+import json
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from db import ReadSessionLocal
+
+# Default and largest page the dashboard renders
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Seconds between batches of row diffs sent to browsers
+DIFF_INTERVAL = 0.5
+# Diff batches queued per browser before it is told to reload instead
+SUBSCRIBER_QUEUE_SIZE = 32
+# Diff batches remembered so a page rendered a little earlier can catch up
+HISTORY_SIZE = 120
+
+FIELDS = ("ip", "state", "disable_time", "enable_time", "status", "last_seen")
+
+
+def _last_seen(epoch):
+    return datetime.utcfromtimestamp(epoch).isoformat(timespec="seconds") if epoch else None
+
+
+def matches(row, state=None, status=None, ip=None):
+    """True if the row passes the dashboard filters; None means any."""
+    return (
+        (state is None or row["state"] == state)
+        and (status is None or row["status"] == status)
+        and (ip is None or (row["ip"] or "").startswith(ip))
+    )
+
+
+class Subscriber:
+    """
+    One browser's live stream: a filter plus the page range it shows.
+    Rows after `after` and up to `until` (None means to the end) are on the page.
+    """
+
+    def __init__(self, state=None, status=None, ip=None, after=None, until=None):
+        self.state = state
+        self.status = status
+        self.ip = ip
+        self.after = after
+        self.until = until
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def filtered(self):
+        return self.state is not None or self.status is not None or self.ip is not None
+
+    def matches(self, row):
+        return matches(row, self.state, self.status, self.ip)
+
+    def diff(self, version, ids, rows):
+        """
+        Queue the rows on this page: matching ones to show, others to take off.
+        ids are the rows' client_ids, sorted, so the page is found by bisection.
+        """
+        start = bisect.bisect_right(ids, self.after) if self.after is not None else 0
+        end = bisect.bisect_right(ids, self.until) if self.until is not None else len(ids)
+        upserts, removed = [], []
+        for row in rows[start:end]:
+            if self.matches(row):
+                upserts.append(row)
+            elif self.filtered():
+                removed.append(row["client_id"])
+        if upserts or removed:
+            self.offer({"version": version, "rows": upserts, "removed": removed})
+            return True
+        return False
+
+    def offer(self, message):
+        if self.queue.full():
+            # Too far behind to patch the page; start it over
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            message = {"reload": True}
+        self.queue.put_nowait(message)
+
+
+class ClientView:
+    """
+    Dashboard rows for every client, kept current from the write endpoints,
+    peer refreshes and liveness events instead of being re-read per page view.
+
+    Client IDs are also kept in a sorted list, so a page is a bisect to the
+    cursor followed by a short scan. Changed rows are batched every
+    DIFF_INTERVAL into a new version and sent to each browser whose page
+    covers them; a browser that subscribes with the version its page was
+    rendered at first gets the rows changed since.
+    """
+
+    def __init__(self, diff_interval=DIFF_INTERVAL):
+        self.diff_interval = diff_interval
+        self._rows = {}
+        self._ids = []
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._history = deque(maxlen=HISTORY_SIZE)
+        self._subscribers = set()
+        self._task = None
+        self.version = 0
+        self.diffs_sent = 0
+
+    def _select(self):
+        from sqlalchemy import select
+        from models import Client, Schedule
+        return (
+            select(Client.client_id, Client.ip, Client.state, Schedule.disable_time, Schedule.enable_time)
+            .outerjoin(Schedule, Schedule.client_id == Client.id)
+            .order_by(Client.id)
+        )
+
+    def load(self, status=None):
+        """Build every row from the database; status(client_id) gives liveness."""
+        db = ReadSessionLocal()
+        try:
+            rows = db.execute(self._select()).all()
+        finally:
+            db.close()
+        view = {}
+        for client_id, ip, state, disable_time, enable_time in rows:
+            # Only the first schedule row of a client counts, like the endpoints
+            if client_id in view:
+                continue
+            online, last_seen = status(client_id) if status else ("unknown", None)
+            view[client_id] = {
+                "client_id": client_id,
+                "ip": ip,
+                "state": state,
+                "disable_time": disable_time,
+                "enable_time": enable_time,
+                "status": online,
+                "last_seen": _last_seen(last_seen),
+            }
+        with self._lock:
+            self._rows = view
+            self._ids = sorted(view)
+            self._dirty.clear()
+            self._history.clear()
+            self.version += 1
+        logging.info(f"Client view loaded with {len(view)} clients.")
+
+    def put(self, record):
+        """Add or refresh a client from a ClientRecord."""
+        self.update(
+            record.client_id,
+            create=True,
+            ip=record.ip,
+            state=record.state,
+            disable_time=record.disable_time,
+            enable_time=record.enable_time,
+        )
+
+    def update(self, client_id, create=False, **fields):
+        """Change some fields of a row; unknown clients are ignored unless create is set."""
+        with self._lock:
+            row = self._rows.get(client_id)
+            if row is None:
+                if not create:
+                    return False
+                row = self._rows[client_id] = {"client_id": client_id, **dict.fromkeys(FIELDS), "status": "unknown"}
+                bisect.insort(self._ids, client_id)
+                self._dirty.add(client_id)
+            for name, value in fields.items():
+                if row[name] != value:
+                    row[name] = value
+                    self._dirty.add(client_id)
+            return True
+
+    def set_status(self, client_id, online, last_seen):
+        """Liveness listener: record an online/offline flip."""
+        self.update(client_id, status="online" if online else "offline", last_seen=_last_seen(last_seen))
+
+    def page(self, after=None, limit=PAGE_SIZE, state=None, status=None, ip=None):
+        """
+        Up to limit matching rows after the cursor, in client_id order.
+        Returns (rows, next_cursor); next_cursor is None on the last page.
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        rows = []
+        with self._lock:
+            start = bisect.bisect_right(self._ids, after) if after else 0
+            for client_id in self._ids[start:] if (state or status or ip) else self._ids[start:start + limit + 1]:
+                row = self._rows[client_id]
+                if matches(row, state, status, ip):
+                    if len(rows) == limit:
+                        return rows, rows[-1]["client_id"]
+                    rows.append(dict(row))
+            return rows, None
+
+    def count(self):
+        return len(self._ids)
+
+    def subscribe(self, since=None, **filters):
+        """Start a browser's stream; since is the version its page showed."""
+        subscriber = Subscriber(**filters)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if since is None or since >= self.version:
+                return subscriber
+            if not self._history or self._history[0][0] > since + 1:
+                subscriber.offer({"reload": True})
+                return subscriber
+            changed = set()
+            for version, client_ids in self._history:
+                if version > since:
+                    changed.update(client_ids)
+            changed = sorted(changed)
+            rows = [dict(self._rows[client_id]) for client_id in changed]
+            version = self.version
+        subscriber.diff(version, changed, rows)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.discard(subscriber)
+
+    def publish(self):
+        """Send rows changed since the last call to the browsers showing them."""
+        with self._lock:
+            if not self._dirty:
+                return 0
+            dirty, self._dirty = sorted(self._dirty), set()
+            self.version += 1
+            version = self.version
+            self._history.append((version, dirty))
+            rows = [dict(self._rows[client_id]) for client_id in dirty]
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            if subscriber.diff(version, dirty, rows):
+                self.diffs_sent += 1
+        return len(rows)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.diff_interval)
+            try:
+                self.publish()
+            except Exception as e:
+                logging.error(f"Client view publish failed: {e}")
+
+    def start(self, status=None):
+        """Load the rows and start sending diffs; call from the event loop."""
+        self.load(status)
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for subscriber in list(self._subscribers):
+            subscriber.offer({"reload": True})
+
+    @staticmethod
+    def event(message):
+        """Format a diff message as a Server-Sent Event."""
+        data = json.dumps(message)
+        if "version" in message:
+            return f"id: {message['version']}\ndata: {data}\n\n"
+        return f"data: {data}\n\n"
+
+    def stats(self):
+        """Return view counters."""
+        return {
+            "clients": len(self._ids),
+            "version": self.version,
+            "pending": len(self._dirty),
+            "subscribers": len(self._subscribers),
+            "diffs_sent": self.diffs_sent,
+        }
+
+
+# Shared view behind the dashboard pages, started with the app
+client_view = ClientView()
@@ -1,31 +1,233 @@
-from sqlalchemy import create_engine
+import os
+import threading
+import time
+from contextvars import ContextVar
+from sqlalchemy import create_engine, event, insert, literal, select, update
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
+from weekly_schedule import schedule_columns
 
 # Define the database URL
-DATABASE_URL = "sqlite:///server.db"
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///server.db")
+
+# Keep IN (...) lists well below SQLite's bound-parameter limit
+BULK_CHUNK_SIZE = 500
+
+# SQLite storage profiles. "legacy" keeps SQLite's defaults (rollback journal,
+# one shared pool); "tuned" enables WAL so readers never wait on heartbeat
+# writers, and gives GET endpoints their own read-only connections.
+STORAGE_PROFILES = {
+    "legacy": {
+        "pragmas": {},
+        "pool_size": 5,
+        "max_overflow": 10,
+        "read_pool_size": 0,
+    },
+    "tuned": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "mmap_size": 256 * 1024 * 1024,
+            "cache_size": -64 * 1024,  # negative = KiB, i.e. 64 MiB per connection
+            "busy_timeout": 5000,
+            "temp_store": "MEMORY",
+        },
+        "pool_size": 8,
+        "max_overflow": 4,
+        "read_pool_size": 8,
+    },
+}
+STORAGE_PROFILE = os.environ.get("STORAGE_PROFILE", "tuned")
+# Size pools for the number of threads that can hit the database at once
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", STORAGE_PROFILES[STORAGE_PROFILE]["pool_size"]))
+DB_POOL_TIMEOUT = 10
+
+def _apply_pragmas(dbapi_connection, pragmas, read_only=False):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+    finally:
+        cursor.close()
+
+def create_profile_engine(profile, read_only=False, url=DATABASE_URL, factory=create_engine):
+    """
+    Build an engine whose connections carry the profile's pragmas.
+    Pass factory=create_async_engine (and an async driver URL) for the async path.
+    """
+    settings = STORAGE_PROFILES[profile]
+    kwargs = {"connect_args": {"check_same_thread": False}}
+    if url.startswith("sqlite") and ":memory:" not in url:
+        kwargs.update(
+            pool_size=settings["read_pool_size"] if read_only else DB_POOL_SIZE,
+            max_overflow=settings["max_overflow"],
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+    new_engine = factory(url, **kwargs)
+
+    if url.startswith("sqlite") and (settings["pragmas"] or read_only):
+        @event.listens_for(getattr(new_engine, "sync_engine", new_engine), "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            _apply_pragmas(dbapi_connection, settings["pragmas"], read_only)
+
+    return new_engine
 
 # Create the SQLAlchemy engine
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_profile_engine(STORAGE_PROFILE)
+
+# Read-only engine for the GET endpoints; shares the write engine under "legacy"
+if STORAGE_PROFILES[STORAGE_PROFILE]["read_pool_size"]:
+    read_engine = create_profile_engine(STORAGE_PROFILE, read_only=True)
+else:
+    read_engine = engine
 
 # Define the declarative base
 Base = declarative_base()
 
+def upgrade_schema(url=DATABASE_URL):
+    """
+    Apply any migrations in migrations/versions the database has not had yet.
+    Called by every worker at startup; see migrations/env.py for the locking.
+    """
+    from alembic import command
+    from alembic.config import Config
+    root = os.path.dirname(os.path.abspath(__file__))
+    config = Config(os.path.join(root, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(root, "migrations"))
+    config.set_main_option("sqlalchemy.url", url)
+    config.attributes["url_set"] = True
+    config.attributes["configure_logger"] = False
+    command.upgrade(config, "head")
+
 # Create a session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Session factory for read-only queries
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# Per-request SQL accounting; set by the app's request middleware
+_request_stats = ContextVar("db_request_stats", default=None)
+_stats_lock = threading.Lock()
+db_stats = {
+    "requests": 0,
+    "sessions_opened": 0,
+    "sessions_closed": 0,
+    "queries": 0,
+    "query_time": 0.0,
+    "pool_checkouts": 0,
+    "pool_checkins": 0,
+    "pool_wait_time": 0.0,
+}
+
+def _add_stats(queries=0, query_time=0.0, pool_wait=0.0):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats["queries"] += queries
+        stats["query_time"] += query_time
+        stats["pool_wait"] += pool_wait
+    with _stats_lock:
+        db_stats["queries"] += queries
+        db_stats["query_time"] += query_time
+        db_stats["pool_wait_time"] += pool_wait
+
+def count_stat(name):
+    """Increment one of the global db_stats counters."""
+    with _stats_lock:
+        db_stats[name] += 1
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_start"].pop()
+    _add_stats(queries=1, query_time=time.perf_counter() - started)
+
+def _after_transaction_create(session, transaction):
+    if transaction.parent is None:
+        session.info["transaction_started"] = time.perf_counter()
+
+def _after_begin(session, transaction, connection):
+    # Time from autobegin to having a connection is the pool checkout wait
+    started = session.info.pop("transaction_started", None)
+    if started is not None:
+        _add_stats(pool_wait=time.perf_counter() - started)
+
+# Engines whose pools are reported by pool_status(), by name
+_instrumented_engines = {}
+
+def instrument_engine(name, target):
+    """Count queries, DB time and pool checkouts for an engine (sync or async)."""
+    if target in _instrumented_engines.values():
+        return
+    _instrumented_engines[name] = target
+    sync_engine = getattr(target, "sync_engine", target)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine.pool, "checkout", lambda *args: count_stat("pool_checkouts"))
+    event.listen(sync_engine.pool, "checkin", lambda *args: count_stat("pool_checkins"))
+
+def instrument_sessions(target):
+    """Measure pool checkout wait for sessions made by a sessionmaker or Session class."""
+    event.listen(target, "after_transaction_create", _after_transaction_create)
+    event.listen(target, "after_begin", _after_begin)
+
+instrument_engine("write", engine)
+instrument_engine("read", read_engine)
+instrument_sessions(SessionLocal)
+instrument_sessions(ReadSessionLocal)
+
+def start_request_stats():
+    """Begin SQL accounting for the current request; returns (stats, token)."""
+    stats = {"queries": 0, "query_time": 0.0, "pool_wait": 0.0}
+    count_stat("requests")
+    return stats, _request_stats.set(stats)
+
+def finish_request_stats(token):
+    """Stop SQL accounting for the current request."""
+    _request_stats.reset(token)
+
+def pool_status():
+    """Checked-out connections and saturation for each engine's pool."""
+    status = {}
+    settings = STORAGE_PROFILES[STORAGE_PROFILE]
+    for name, pool_engine in _instrumented_engines.items():
+        pool = pool_engine.pool
+        if not hasattr(pool, "checkedout"):
+            continue
+        capacity = pool.size() + settings["max_overflow"]
+        checked_out = pool.checkedout()
+        status[name] = {
+            "size": pool.size(),
+            "capacity": capacity,
+            "checked_out": checked_out,
+            "saturation": checked_out / capacity if capacity else 0.0,
+        }
+    return status
+
+def get_stats():
+    """Global SQL and session counters plus the pool saturation gauge."""
+    with _stats_lock:
+        stats = dict(db_stats)
+    stats["sessions_open"] = stats["sessions_opened"] - stats["sessions_closed"]
+    stats["pools"] = pool_status()
+    return stats
 
 # Utility functions for database operations
 def get_db():
     """
     Dependency to get the database session.
-    Ensures proper cleanup after the session is used.
+    Ensures proper cleanup after the session is used, so every request
+    returns its connection to the pool.
     """
     db = SessionLocal()
+    count_stat("sessions_opened")
     try:
         yield db
     finally:
         db.close()
+        count_stat("sessions_closed")
 
 # Helper functions for common database operations
 def add_client(client_id, ip, state="unpaused", db_session=None):
@@ -33,10 +235,14 @@ def add_client(client_id, ip, state="unpaused", db_session=None):
     Add a new client to the database.
     """
     from models import Client
+    from client_cache import client_cache
+    from fleet_status import fleet_status
     try:
         new_client = Client(client_id=client_id, ip=ip, state=state)
         db_session.add(new_client)
         db_session.commit()
+        client_cache.invalidate(client_id)
+        fleet_status.invalidate()
         return new_client
     except SQLAlchemyError as e:
         db_session.rollback()
@@ -45,9 +251,33 @@ def add_client(client_id, ip, state="unpaused", db_session=None):
 def get_client_by_id(client_id, db_session):
     """
     Retrieve a client by its unique client_id.
+    The primary key comes from the client cache, so this is a PK lookup.
+    """
+    from models import Client
+    from client_cache import client_cache
+    record = client_cache.get(client_id, db_session)
+    if record is None:
+        return None
+    return db_session.get(Client, record.id)
+
+def client_record_select():
+    """
+    SELECT of the compact (id, client_id, ip, state, disable_time, enable_time,
+    intervals) client row, shared by the sync and async helpers.
+    """
+    from models import Client, Schedule
+    return select(
+        Client.id, Client.client_id, Client.ip, Client.state,
+        Schedule.disable_time, Schedule.enable_time, Schedule.intervals,
+    ).outerjoin(Schedule, Schedule.client_id == Client.id)
+
+def load_client_record(client_id, db_session):
+    """
+    Load the compact client row for a client in a single query.
+    Used to fill the client cache.
     """
     from models import Client
-    return db_session.query(Client).filter(Client.client_id == client_id).first()
+    return db_session.execute(client_record_select().where(Client.client_id == client_id)).first()
 
 def get_all_clients(db_session):
     """
@@ -56,20 +286,26 @@ def get_all_clients(db_session):
     from models import Client
     return db_session.query(Client).all()
 
-def add_schedule(client_id, disable_time, enable_time, db_session=None):
+def add_schedule(client_id, disable_time=None, enable_time=None, db_session=None, windows=None, exceptions=None):
     """
-    Add or update a schedule for a client.
+    Add or update a schedule for a client: a daily disable/enable pair, or
+    weekly windows and date exceptions. Raises ValueError on invalid rules.
     """
     from models import Schedule
+    from client_cache import client_cache
+    from fleet_status import fleet_status
+    columns = schedule_columns(disable_time, enable_time, windows, exceptions)
     try:
         schedule = db_session.query(Schedule).filter(Schedule.client_id == client_id).first()
         if schedule:
-            schedule.disable_time = disable_time
-            schedule.enable_time = enable_time
+            for name, value in columns.items():
+                setattr(schedule, name, value)
         else:
-            schedule = Schedule(client_id=client_id, disable_time=disable_time, enable_time=enable_time)
+            schedule = Schedule(client_id=client_id, **columns)
             db_session.add(schedule)
         db_session.commit()
+        client_cache.invalidate(schedule.client.client_id)
+        fleet_status.invalidate()
         return schedule
     except SQLAlchemyError as e:
         db_session.rollback()
@@ -81,3 +317,94 @@ def get_schedule_by_client_id(client_id, db_session):
     """
     from models import Schedule
     return db_session.query(Schedule).filter(Schedule.client_id == client_id).first()
+
+def _chunks(items, size=BULK_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def resolve_clients_selects(client_ids=None, ip_prefix=None, state=None):
+    """
+    SELECTs of (id, client_id) for a list of client_ids (one per chunk) or a selector.
+    With no arguments every client is selected.
+    """
+    from models import Client
+    query = select(Client.id, Client.client_id)
+    if client_ids is not None:
+        return [query.where(Client.client_id.in_(chunk)) for chunk in _chunks(list(dict.fromkeys(client_ids)))]
+    if ip_prefix:
+        query = query.where(Client.ip.startswith(ip_prefix, autoescape=True))
+    if state:
+        query = query.where(Client.state == state)
+    return [query]
+
+def resolve_clients(db_session, client_ids=None, ip_prefix=None, state=None):
+    """
+    Resolve a list of client_ids or a selector to (id, client_id) rows.
+    """
+    rows = []
+    for query in resolve_clients_selects(client_ids, ip_prefix, state):
+        rows.extend(db_session.execute(query).all())
+    return rows
+
+def bulk_schedule_statements(ids, columns):
+    """
+    Set-based UPDATE of existing schedules plus INSERT ... SELECT for clients
+    without one, per chunk of client primary keys. columns comes from
+    weekly_schedule.schedule_columns.
+    """
+    from models import Client, Schedule
+    names = list(columns)
+    statements = []
+    for chunk in _chunks(ids):
+        statements.append(update(Schedule).where(Schedule.client_id.in_(chunk)).values(**columns))
+        values = [literal(columns[name], Schedule.__table__.c[name].type) for name in names]
+        missing = select(Client.id, *values).where(
+            Client.id.in_(chunk),
+            ~select(Schedule.id).where(Schedule.client_id == Client.id).exists(),
+        )
+        statements.append(insert(Schedule).from_select(["client_id", *names], missing))
+    return statements
+
+def bulk_state_statements(ids, state):
+    """
+    Set-based UPDATE of client state, per chunk of client primary keys.
+    """
+    from models import Client
+    return [update(Client).where(Client.id.in_(chunk)).values(state=state) for chunk in _chunks(ids)]
+
+def _execute_all(statements, db_session):
+    try:
+        for statement in statements:
+            db_session.execute(statement)
+        db_session.commit()
+    except SQLAlchemyError as e:
+        db_session.rollback()
+        raise e
+
+def bulk_set_schedule(ids, columns, db_session):
+    """
+    Set the same schedule for many clients in one transaction.
+    """
+    _execute_all(bulk_schedule_statements(ids, columns), db_session)
+
+def bulk_set_state(ids, state, db_session):
+    """
+    Set the state of many clients in one transaction.
+    """
+    _execute_all(bulk_state_statements(ids, state), db_session)
+
+def client_records_selects(client_ids):
+    """
+    SELECTs of compact client rows for many clients, one per chunk.
+    """
+    from models import Client
+    return [client_record_select().where(Client.client_id.in_(chunk)) for chunk in _chunks(list(client_ids))]
+
+def load_client_records(client_ids, db_session):
+    """
+    Load compact client records (see load_client_record) for many clients.
+    """
+    rows = []
+    for query in client_records_selects(client_ids):
+        rows.extend(db_session.execute(query).all())
+    return rows
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import threading
+from datetime import datetime
+import numpy as np
+from db import ReadSessionLocal
+from weekly_schedule import WeeklySchedule, parse_minutes
+
+# Marks a client without a (valid) schedule in the minute arrays
+NO_SCHEDULE = -1
+
+
+class FleetStatus:
+    """
+    Columnar view of every client's schedule for evaluating the whole fleet at once.
+
+    Daily schedules are loaded into NumPy arrays of disable/enable minutes the
+    first time they are needed and kept until invalidate() is called by a
+    schedule or state write; weekly ones are kept as compiled WeeklySchedules
+    and looked up one by one. Each evaluation is cached for the minute it was
+    computed in.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._arrays = None
+        self._result = None
+        self._generation = 0
+        self.loads = 0
+        self.evaluations = 0
+
+    def invalidate(self):
+        """Drop the arrays; the next status request reloads them."""
+        with self._lock:
+            self._generation += 1
+            self._arrays = None
+            self._result = None
+
+    def _select(self):
+        from sqlalchemy import select
+        from models import Client, Schedule
+        return (
+            select(Client.client_id, Client.state, Schedule.disable_time, Schedule.enable_time, Schedule.intervals)
+            .outerjoin(Schedule, Schedule.client_id == Client.id)
+            .order_by(Client.id)
+        )
+
+    def _build(self, rows):
+        count = len(rows)
+        client_ids = []
+        disable = np.full(count, NO_SCHEDULE, dtype=np.int16)
+        enable = np.full(count, NO_SCHEDULE, dtype=np.int16)
+        paused = np.zeros(count, dtype=bool)
+        seen = set()
+        keep = np.ones(count, dtype=bool)
+        weekly = []  # (index after dropping duplicates, WeeklySchedule)
+        for i, (client_id, state, disable_time, enable_time, intervals) in enumerate(rows):
+            # Only the first schedule row of a client counts, like the endpoints
+            if client_id in seen:
+                keep[i] = False
+                continue
+            seen.add(client_id)
+            client_ids.append(client_id)
+            paused[i] = state == "paused"
+            if disable_time is None and intervals:
+                try:
+                    weekly.append((len(client_ids) - 1, WeeklySchedule.from_compiled(intervals)))
+                except ValueError as e:
+                    logging.error(f"Ignoring invalid schedule for {client_id}: {e}")
+            elif disable_time is not None:
+                try:
+                    disable[i] = parse_minutes(disable_time)
+                    enable[i] = parse_minutes(enable_time)
+                except ValueError as e:
+                    logging.error(f"Ignoring invalid schedule for {client_id}: {e}")
+                    disable[i] = enable[i] = NO_SCHEDULE
+        self.loads += 1
+        return client_ids, disable[keep], enable[keep], paused[keep], weekly
+
+    def _cached(self, evaluated_at):
+        if self._result is not None and self._result["evaluated_at"] == evaluated_at:
+            return self._result
+        return None
+
+    def _compute(self, arrays, now, evaluated_at):
+        client_ids, disable, enable, paused, weekly = arrays
+        minute = now.hour * 60 + now.minute
+
+        scheduled = (disable != NO_SCHEDULE) & (disable != enable)
+        same_day = disable < enable
+        in_schedule = scheduled & np.where(
+            same_day,
+            (disable <= minute) & (minute < enable),
+            (minute >= disable) | (minute < enable),
+        )
+        for i, schedule in weekly:
+            in_schedule[i] = schedule.is_blocked(now)
+        blocked = in_schedule | paused
+
+        self.evaluations += 1
+        return {
+            "minute": minute,
+            "evaluated_at": evaluated_at,
+            "total": len(client_ids),
+            "blocked_count": int(blocked.sum()),
+            "client_ids": client_ids,
+            "blocked": blocked.tolist(),
+            "in_schedule": in_schedule.tolist(),
+            "paused": paused.tolist(),
+        }
+
+    def evaluate(self, now=None):
+        """Return the blocked/in-schedule/paused status of every client at now."""
+        now = now or datetime.now()
+        # Weekly schedules depend on the date, not only the minute of the day
+        evaluated_at = now.replace(second=0, microsecond=0).isoformat()
+        with self._lock:
+            cached = self._cached(evaluated_at)
+            if cached is not None:
+                return cached
+            if self._arrays is None:
+                db = ReadSessionLocal()
+                try:
+                    rows = db.execute(self._select()).all()
+                finally:
+                    db.close()
+                self._arrays = self._build(rows)
+            self._result = self._compute(self._arrays, now, evaluated_at)
+            return self._result
+
+    async def evaluate_async(self, now=None):
+        """Like evaluate(), but loads the arrays through the async engine and builds them off the event loop."""
+        import async_db
+        now = now or datetime.now()
+        # Weekly schedules depend on the date, not only the minute of the day
+        evaluated_at = now.replace(second=0, microsecond=0).isoformat()
+        with self._lock:
+            cached = self._cached(evaluated_at)
+            if cached is not None:
+                return cached
+            arrays, generation = self._arrays, self._generation
+        if arrays is None:
+            async with async_db.AsyncReadSessionLocal() as db:
+                rows = (await db.execute(self._select())).all()
+            arrays = await asyncio.to_thread(self._build, rows)
+        result = await asyncio.to_thread(self._compute, arrays, now, evaluated_at)
+        with self._lock:
+            # A write invalidated the arrays meanwhile: answer, but keep nothing
+            if self._generation == generation:
+                self._arrays = arrays
+                self._result = result
+        return result
+
+
+# Shared fleet view used by the status endpoint
+fleet_status = FleetStatus()
@@ -0,0 +1,149 @@
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import bindparam
+from db import engine
+from models import Client
+
+# Flush pending heartbeats at least this often (seconds)
+FLUSH_INTERVAL = 5
+# Flush early once this many distinct clients are pending
+FLUSH_THRESHOLD = 500
+# Hard cap on distinct pending clients; updates beyond it are dropped
+MAX_PENDING = 20000
+
+FLUSH_JOB_ID = "heartbeat_flush"
+
+
+class HeartbeatBuffer:
+    """Coalesce heartbeats in memory and write them in one transaction per flush."""
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, flush_threshold=FLUSH_THRESHOLD, max_pending=MAX_PENDING):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.max_pending = max_pending
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._scheduler = None
+        self._flush_requested = False
+        self.buffered = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        # Heartbeats accepted per transport ("http" or "websocket")
+        self.sources = {}
+
+    def record(self, client_id, ip, timestamp=None, source="http"):
+        """Buffer a heartbeat, keeping only the latest (ip, timestamp) per client."""
+        timestamp = timestamp or datetime.utcnow()
+        with self._lock:
+            if client_id in self._pending:
+                self.coalesced += 1
+            elif len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending[client_id] = (ip, timestamp)
+            self.buffered += 1
+            self.sources[source] = self.sources.get(source, 0) + 1
+            # Wake the flush job once per batch, not on every heartbeat past the threshold
+            wake = len(self._pending) >= self.flush_threshold and not self._flush_requested
+            if wake:
+                self._flush_requested = True
+        if wake:
+            self._wake_flush()
+        return True
+
+    def flush(self):
+        """Write all pending heartbeats with a single executemany UPDATE."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._flush_requested = False
+            if not batch:
+                return 0
+
+            rows = [
+                {"b_client_id": client_id, "b_ip": ip, "b_last_heartbeat": timestamp}
+                for client_id, (ip, timestamp) in batch.items()
+            ]
+            table = Client.__table__
+            statement = (
+                table.update()
+                .where(table.c.client_id == bindparam("b_client_id"))
+                .values(ip=bindparam("b_ip"), last_heartbeat=bindparam("b_last_heartbeat"))
+            )
+            try:
+                with engine.begin() as connection:
+                    connection.execute(statement, rows)
+            except Exception as e:
+                self.failed_flushes += 1
+                logging.error(f"Heartbeat flush failed for {len(batch)} clients: {e}")
+                self._requeue(batch)
+                return 0
+
+            self.flushes += 1
+            self.flushed += len(batch)
+            return len(batch)
+
+    def _requeue(self, batch):
+        """Put a failed batch back without overwriting newer heartbeats."""
+        with self._lock:
+            for client_id, entry in batch.items():
+                if client_id in self._pending:
+                    continue
+                if len(self._pending) >= self.max_pending:
+                    self.dropped += 1
+                    continue
+                self._pending[client_id] = entry
+
+    def _wake_flush(self):
+        """Ask the scheduler to run the flush job now instead of at the next interval."""
+        if self._scheduler is None:
+            return
+        job = self._scheduler.get_job(FLUSH_JOB_ID)
+        if job is not None:
+            job.modify(next_run_time=datetime.now())
+
+    def start(self, scheduler):
+        """Register the periodic flush job on the given APScheduler instance."""
+        self._scheduler = scheduler
+        scheduler.add_job(
+            self.flush,
+            "interval",
+            seconds=self.flush_interval,
+            id=FLUSH_JOB_ID,
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
+        logging.info(f"Heartbeat buffer flushing every {self.flush_interval}s or {self.flush_threshold} clients.")
+
+    def stop(self):
+        """Remove the flush job and write out anything still pending."""
+        if self._scheduler is not None and self._scheduler.get_job(FLUSH_JOB_ID) is not None:
+            self._scheduler.remove_job(FLUSH_JOB_ID)
+        self._scheduler = None
+        flushed = self.flush()
+        logging.info(f"Heartbeat buffer stopped; flushed {flushed} pending heartbeats.")
+
+    def stats(self):
+        """Return buffer counters."""
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "buffered": self.buffered,
+            "coalesced": self.coalesced,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "sources": dict(self.sources),
+        }
+
+
+# Shared buffer used by the heartbeat endpoint
+heartbeat_buffer = HeartbeatBuffer()
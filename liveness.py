@@ -0,0 +1,214 @@
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timezone
+from db import ReadSessionLocal, _chunks
+
+# Seconds between agent heartbeats the server expects
+HEARTBEAT_INTERVAL = int(os.getenv("HEARTBEAT_INTERVAL", "30"))
+# A client is offline once it has missed this many heartbeats
+MISSED_HEARTBEATS = 3
+# Seconds between expiry checks
+CHECK_INTERVAL = 1
+
+CHECK_JOB_ID = "liveness_check"
+
+
+def _epoch(value):
+    """Seconds since the epoch for a naive UTC datetime from the database."""
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class LivenessIndex:
+    """
+    Online/offline status of every client without scanning the clients table.
+
+    Every client is timed out after the same MISSED_HEARTBEATS * HEARTBEAT_INTERVAL,
+    so deadlines expire in the order heartbeats arrived. Online clients are kept
+    in an OrderedDict, oldest heartbeat first: a heartbeat moves its client to
+    the end in O(1) and each check pops only the clients that are due. Clients
+    kept online by an older heartbeat from the database are out of that order,
+    so their deadlines also go on a small heap.
+    """
+
+    def __init__(self, interval=HEARTBEAT_INTERVAL, missed=MISSED_HEARTBEATS):
+        self.timeout = interval * missed
+        self._online = OrderedDict()
+        self._late = []
+        self._offline = {}
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._scheduler = None
+        self.went_offline = 0
+        self.came_online = 0
+        self.reprieved = 0
+
+    def add_listener(self, callback):
+        """Register callback(client_id, online, last_seen) for every status change."""
+        self._listeners.append(callback)
+
+    def _emit(self, events):
+        for client_id, online, last_seen in events:
+            for callback in self._listeners:
+                try:
+                    callback(client_id, online, last_seen)
+                except Exception as e:
+                    logging.error(f"Liveness listener failed for {client_id}: {e}")
+
+    def seen(self, client_id, at=None):
+        """Record a heartbeat; emits an online event if the client was offline or new."""
+        at = at or time.time()
+        with self._lock:
+            came_back = client_id not in self._online
+            if came_back:
+                self._offline.pop(client_id, None)
+                self.came_online += 1
+            self._online[client_id] = at
+            self._online.move_to_end(client_id)
+        if came_back:
+            self._emit([(client_id, True, at)])
+
+    def remove(self, client_id):
+        with self._lock:
+            self._online.pop(client_id, None)
+            self._offline.pop(client_id, None)
+
+    def _due(self, now):
+        """Pop every online client whose last heartbeat is older than the timeout."""
+        cutoff = now - self.timeout
+        due = {}
+        with self._lock:
+            while self._online:
+                client_id, last_seen = next(iter(self._online.items()))
+                if last_seen > cutoff:
+                    break
+                self._online.popitem(last=False)
+                due[client_id] = last_seen
+            while self._late and self._late[0][0] <= cutoff:
+                last_seen, client_id = heapq.heappop(self._late)
+                # Skip entries superseded by a newer heartbeat
+                if self._online.get(client_id) == last_seen:
+                    del self._online[client_id]
+                    due[client_id] = last_seen
+        return due
+
+    def _flushed_heartbeats(self, client_ids):
+        """Last heartbeat the database has for these clients (written by any worker)."""
+        from sqlalchemy import select
+        from models import Client
+        found = {}
+        db = ReadSessionLocal()
+        try:
+            for chunk in _chunks(list(client_ids)):
+                query = select(Client.client_id, Client.last_heartbeat).where(Client.client_id.in_(chunk))
+                for client_id, last_heartbeat in db.execute(query):
+                    if last_heartbeat is not None:
+                        found[client_id] = _epoch(last_heartbeat)
+        finally:
+            db.close()
+        return found
+
+    def expire(self, now=None, verify=True):
+        """
+        Flip clients that missed MISSED_HEARTBEATS to offline and emit events.
+        Candidates are checked against the database first, so heartbeats taken
+        by another worker keep a client online.
+        """
+        now = now or time.time()
+        due = self._due(now)
+        if not due:
+            return 0
+        flushed = self._flushed_heartbeats(due) if verify else {}
+        cutoff = now - self.timeout
+        events = []
+        with self._lock:
+            for client_id, last_seen in due.items():
+                if client_id in self._online:
+                    # A heartbeat arrived while we were checking
+                    continue
+                last_seen = max(last_seen, flushed.get(client_id, last_seen))
+                if last_seen > cutoff:
+                    self._online[client_id] = last_seen
+                    heapq.heappush(self._late, (last_seen, client_id))
+                    self.reprieved += 1
+                    continue
+                self._offline[client_id] = last_seen
+                events.append((client_id, False, last_seen))
+            self.went_offline += len(events)
+        self._emit(events)
+        return len(events)
+
+    def load(self, db_session=None, now=None):
+        """Rebuild the index from clients.last_heartbeat; called once at startup."""
+        from sqlalchemy import select
+        from models import Client
+        now = now or time.time()
+        db = db_session or ReadSessionLocal()
+        try:
+            rows = db.execute(
+                select(Client.client_id, Client.last_heartbeat).order_by(Client.last_heartbeat)
+            ).all()
+        finally:
+            if db_session is None:
+                db.close()
+        cutoff = now - self.timeout
+        online = OrderedDict()
+        offline = {}
+        for client_id, last_heartbeat in rows:
+            last_seen = _epoch(last_heartbeat) if last_heartbeat is not None else None
+            if last_seen is not None and last_seen > cutoff:
+                online[client_id] = last_seen
+            else:
+                offline[client_id] = last_seen
+        with self._lock:
+            self._online, self._offline, self._late = online, offline, []
+        logging.info(f"Liveness index loaded: {len(online)} online, {len(offline)} offline.")
+
+    def start(self, scheduler):
+        """Load the index and check for expired clients every CHECK_INTERVAL seconds."""
+        self.load()
+        self._scheduler = scheduler
+        scheduler.add_job(
+            self.expire,
+            "interval",
+            seconds=CHECK_INTERVAL,
+            id=CHECK_JOB_ID,
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
+
+    def online_count(self):
+        return len(self._online)
+
+    def known(self, client_id):
+        """Whether client_id is registered, online or not."""
+        with self._lock:
+            return client_id in self._online or client_id in self._offline
+
+    def status(self, client_id):
+        """Return ("online" | "offline" | "unknown", last_seen epoch seconds or None)."""
+        with self._lock:
+            if client_id in self._online:
+                return "online", self._online[client_id]
+            if client_id in self._offline:
+                return "offline", self._offline[client_id]
+        return "unknown", None
+
+    def stats(self):
+        """Return index counters."""
+        return {
+            "online": len(self._online),
+            "offline": len(self._offline),
+            "timeout": self.timeout,
+            "went_offline": self.went_offline,
+            "came_online": self.came_online,
+            "reprieved": self.reprieved,
+        }
+
+
+# Shared index, fed by the heartbeat endpoints and started with the app
+liveness = LivenessIndex()
@@ -0,0 +1,254 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+# Records waiting for the listener thread; past this they are dropped and counted
+QUEUE_SIZE = 10000
+# LogRecord attributes that are not extra= fields (color_message is uvicorn's ANSI copy)
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "color_message"}
+# Loggers uvicorn attaches its own handlers to; JSON mode routes them through the queue
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+# Levels applied unless LOG_LEVELS overrides them: APScheduler logs every job run at
+# INFO and websockets every frame at DEBUG
+DEFAULT_LEVELS = {"apscheduler": "WARNING", "websockets": "INFO"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with any extra= fields as keys."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "module": record.module if record.name == "root" else record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class ModuleLevelFilter(logging.Filter):
+    """
+    Per-module levels. The code logs through the root logger, so the module is
+    the file the call is in (record.module); named loggers match by name or by
+    a parent's name (apscheduler covers apscheduler.executors.default).
+    """
+
+    def __init__(self, default, levels):
+        super().__init__()
+        self.default = default
+        self.levels = levels
+        self._resolved = {}
+
+    def level_for(self, name):
+        level = self._resolved.get(name)
+        if level is None:
+            prefix = name
+            while prefix not in self.levels and "." in prefix:
+                prefix = prefix.rsplit(".", 1)[0]
+            level = self._resolved[name] = self.levels.get(prefix, self.default)
+        return level
+
+    def filter(self, record):
+        if record.name == "root":
+            return record.levelno >= self.levels.get(record.module, self.default)
+        return record.levelno >= self.level_for(record.name)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Thin out high-volume records, keyed by their `event` extra (or logger name).
+
+    sample = {key: N} keeps 1 in N records below WARNING, so failures always get
+    through. rate = {key: per_second} caps every level, for error storms. Kept
+    records carry the count they stand for (sampled) or that were skipped
+    since the last one (suppressed).
+    """
+
+    def __init__(self, sample=None, rate=None):
+        super().__init__()
+        self.sample = sample or {}
+        self.rate = rate or {}
+        self._seen = {}
+        self._buckets = {}  # key -> [tokens, last refill, suppressed]
+        self._lock = threading.Lock()
+        self.sampled_out = 0
+        self.rate_limited = 0
+
+    def filter(self, record):
+        key = getattr(record, "event", None) or (record.name if record.name != "root" else None)
+        if key is None:
+            return True
+        every = self.sample.get(key)
+        per_second = self.rate.get(key)
+        if every is None and per_second is None:
+            return True
+        with self._lock:
+            if every and every > 1 and record.levelno < logging.WARNING:
+                seen = self._seen.get(key, 0)
+                self._seen[key] = seen + 1
+                if seen % every:
+                    self.sampled_out += 1
+                    return False
+                record.sampled = every
+            if per_second:
+                now = time.monotonic()
+                capacity = max(1.0, per_second)
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._buckets[key] = [capacity, now, 0]
+                bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * per_second)
+                bucket[1] = now
+                if bucket[0] < 1:
+                    bucket[2] += 1
+                    self.rate_limited += 1
+                    return False
+                bucket[0] -= 1
+                if bucket[2]:
+                    record.suppressed = bucket[2]
+                    bucket[2] = 0
+        return True
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hand records to the listener thread as they are. The message is formatted
+    there (lazy %-style args included), not on the event loop or request thread.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        # SimpleQueue is much cheaper than Queue but unbounded, so bound it here
+        if self.queue.qsize() >= QUEUE_SIZE:
+            self.dropped += 1
+        else:
+            self.queue.put_nowait(record)
+
+
+class LogSettings:
+    """The active queue, listener and filters; configure() replaces them."""
+
+    def __init__(self):
+        self.listener = None
+        self.handler = None
+        self.sampling = None
+        self.attached = []  # (handler, filter) pairs to undo on reconfigure
+
+    def stats(self):
+        return {
+            "queued": self.handler.queue.qsize() if self.handler else 0,
+            "dropped": self.handler.dropped if self.handler else 0,
+            "sampled_out": self.sampling.sampled_out if self.sampling else 0,
+            "rate_limited": self.sampling.rate_limited if self.sampling else 0,
+        }
+
+
+log_settings = LogSettings()
+
+
+def _level(value):
+    return value if isinstance(value, int) else logging.getLevelName(str(value).upper())
+
+
+def _mapping(value, convert):
+    """{"a": 1} as is, or "a=1,b=2" from an environment variable."""
+    if not value:
+        return {}
+    if isinstance(value, str):
+        value = dict(item.split("=", 1) for item in value.replace(" ", "").split(",") if "=" in item)
+    return {key: convert(item) for key, item in value.items()}
+
+
+def configure(level="INFO", json_format=False, levels=None, sample=None, rate=None, stream=None):
+    """
+    Route the root logger through a bounded queue to one stream handler
+    running on a listener thread.
+
+    levels maps module (or logger) names to levels; sample and rate map event
+    names (or logger names, e.g. uvicorn.access) to 1-in-N and per-second limits.
+    """
+    shutdown()
+    default = _level(level)
+    levels = {name: _level(value) for name, value in {**DEFAULT_LEVELS, **(levels or {})}.items()}
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+    handler = LogQueueHandler(queue.SimpleQueue())
+    sampling = SamplingFilter(sample, rate)
+    handler.addFilter(ModuleLevelFilter(default, levels))
+    handler.addFilter(sampling)
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    # The root level lets through the most verbose module; the filter does the rest
+    root.setLevel(min([default, *levels.values()]))
+    # Named loggers also take their level directly, so their records are not even created
+    for name, value in levels.items():
+        if name in logging.root.manager.loggerDict:
+            logging.getLogger(name).setLevel(value)
+
+    if json_format:
+        for name in UVICORN_LOGGERS:
+            logger = logging.getLogger(name)
+            if logger.handlers:
+                logger.handlers = []
+                logger.propagate = True
+    # Loggers with handlers of their own (uvicorn's in text mode) are sampled there
+    for name in set(sampling.sample) | set(sampling.rate):
+        logger = logging.getLogger(name) if name in logging.root.manager.loggerDict else None
+        while logger is not None:
+            for own in logger.handlers:
+                if own is not handler:
+                    own.addFilter(sampling)
+                    log_settings.attached.append((own, sampling))
+            logger = logger.parent if logger.propagate else None
+
+    log_settings.handler = handler
+    log_settings.sampling = sampling
+    log_settings.listener = logging.handlers.QueueListener(handler.queue, output)
+    log_settings.listener.start()
+
+
+def configure_from(settings, default_level="INFO"):
+    """
+    Configure from LOG_* keys in a mapping: os.environ on the server, CONFIG on
+    the agent. LOG_LEVELS, LOG_SAMPLE and LOG_RATE are dicts or "name=value,..." strings.
+    """
+    configure(
+        level=settings.get("LOG_LEVEL") or default_level,
+        json_format=str(settings.get("LOG_FORMAT", "")).lower() == "json",
+        levels=_mapping(settings.get("LOG_LEVELS"), str),
+        sample=_mapping(settings.get("LOG_SAMPLE"), int),
+        rate=_mapping(settings.get("LOG_RATE"), float),
+    )
+
+
+def shutdown():
+    """Flush the queue and stop the listener thread."""
+    for own, log_filter in log_settings.attached:
+        own.removeFilter(log_filter)
+    log_settings.attached = []
+    if log_settings.listener is not None:
+        log_settings.listener.stop()
+        log_settings.listener = None
+
+
+atexit.register(shutdown)
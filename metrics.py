@@ -0,0 +1,224 @@
+import bisect
+import os
+import threading
+import time
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Set METRICS=0 to skip the per-request and per-job instrumentation
+ENABLED = os.getenv("METRICS", "1") != "0"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing value per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.label_names, label_values)} {_number(value)}"
+
+
+class Histogram:
+    """Bucketed observations per label set, e.g. request latency by route."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket..., +Inf count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                counts = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def time(self, *label_values):
+        """Context manager observing the duration of its block."""
+        return _Timer(self, label_values)
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        for label_values, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                yield f"{self.name}_bucket{_labels(self.label_names, label_values, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.label_names, label_values)} {_number(counts[-1])}"
+            yield f"{self.name}_count{_labels(self.label_names, label_values)} {cumulative}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "label_values", "started")
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
+
+
+class Registry:
+    """
+    Metrics in the Prometheus text format.
+
+    Hot paths update Counters and Histograms. Values other modules already
+    count (cache hits, buffer sizes, socket counts) are read by collectors
+    only when /metrics is scraped, so they cost nothing in between.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect):
+        """
+        Register collect() returning (name, kind, help, samples) tuples, where
+        kind is "counter" or "gauge" and samples is a list of (labels dict, value).
+        """
+        self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        for collect in self._collectors:
+            for name, kind, help, samples in collect():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Hot-path metrics, updated where the work happens
+request_latency = registry.histogram(
+    "http_request_duration_seconds", "Time to the response headers, by route.", ("method", "route")
+)
+responses = registry.counter("http_responses_total", "Responses by route and status code.", ("route", "status"))
+request_db_time = registry.histogram(
+    "http_request_db_seconds", "SQL time spent per request, by route.", ("route",)
+)
+async_write_lock_wait = registry.histogram(
+    "async_write_lock_wait_seconds",
+    "Time async endpoints waited for this worker's asyncio write_lock; waits inside SQLite are not included.",
+)
+websocket_messages = registry.counter(
+    "websocket_messages_received_total", "Messages received from agent sockets, by type.", ("type",)
+)
+job_lag = registry.histogram(
+    "scheduler_job_lag_seconds", "Delay between a job's scheduled time and its start, by job.", ("job",)
+)
+job_duration = registry.histogram(
+    "scheduler_job_duration_seconds", "Job run time, by job.", ("job",)
+)
+job_errors = registry.counter("scheduler_job_errors_total", "Jobs that raised, by job.", ("job",))
+jobs_missed = registry.counter("scheduler_jobs_missed_total", "Runs skipped past their grace time, by job.", ("job",))
+notification_latency = registry.histogram(
+    "notification_delivery_seconds", "Time from an event to the message carrying it being delivered.",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+)
+
+
+def route_label(scope):
+    """Route template of a handled request, so path parameters do not multiply series."""
+    route = scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+
+def job_label(job_id):
+    """Collapse per-instant job IDs (schedule transitions) into one label value."""
+    from schedule_engine import JOB_ID_PREFIX
+    return "schedule_transition" if job_id.startswith(JOB_ID_PREFIX) else job_id
+
+
+_instrumented_schedulers = []
+
+
+def instrument_scheduler(scheduler):
+    """Record lag, run time, errors and misses of every APScheduler job."""
+    from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
+    if scheduler in _instrumented_schedulers:
+        return
+    _instrumented_schedulers.append(scheduler)
+    started = {}
+
+    def on_event(event):
+        job = job_label(event.job_id)
+        if event.code == EVENT_JOB_SUBMITTED:
+            now = time.time()
+            for run_time in event.scheduled_run_times:
+                job_lag.observe(max(0.0, now - run_time.timestamp()), job)
+                started[(event.job_id, run_time)] = now
+        elif event.code == EVENT_JOB_MISSED:
+            jobs_missed.inc(job)
+        else:
+            began = started.pop((event.job_id, event.scheduled_run_time), None)
+            if began is not None:
+                job_duration.observe(time.time() - began, job)
+            if event.code == EVENT_JOB_ERROR:
+                job_errors.inc(job)
+
+    scheduler.add_listener(on_event, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
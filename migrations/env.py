@@ -1,3 +1,4 @@
+import os
 from logging.config import fileConfig
 
 from sqlalchemy import engine_from_config
@@ -10,15 +11,20 @@ from alembic import context
 config = context.config
 
 # Interpret the config file for Python logging.
-# This line sets up loggers basically.
-if config.config_file_name is not None:
+# This line sets up loggers basically. db.upgrade_schema() runs inside the app,
+# whose logging is already configured, and turns it off.
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
     fileConfig(config.config_file_name)
 
-# add your model's MetaData object here
-# for 'autogenerate' support
-# from myapp import mymodel
-# target_metadata = mymodel.Base.metadata
-target_metadata = None
+# models.py is the one definition of the schema
+from db import Base  # noqa: E402
+import models  # noqa: E402,F401
+
+target_metadata = Base.metadata
+
+# Same database as the app: DATABASE_URL, unless the caller set sqlalchemy.url
+if os.environ.get("DATABASE_URL") and not config.attributes.get("url_set"):
+    config.set_main_option("sqlalchemy.url", os.environ["DATABASE_URL"])
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
@@ -44,6 +50,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        render_as_batch=True,
     )
 
     with context.begin_transaction():
@@ -64,12 +71,19 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
+        if connection.dialect.name == "sqlite":
+            # Every worker upgrades at startup: the first to take the write lock
+            # migrates, the rest wait and then find the database at head. pysqlite
+            # would otherwise run the DDL outside any transaction.
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+        # SQLite can only add columns in place; batch mode rebuilds the table
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata, render_as_batch=True
         )
 
         with context.begin_transaction():
             context.run_migrations()
+        connection.commit()
 
 
 if context.is_offline_mode():
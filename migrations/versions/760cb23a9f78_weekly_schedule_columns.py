@@ -0,0 +1,44 @@
+"""weekly schedule columns
+
+Weekly rules and their compiled intervals (see weekly_schedule.py); the daily
+disable/enable pair becomes nullable. SQLite cannot drop NOT NULL in place, so
+the table is rebuilt in batch mode. Databases the app upgraded itself before
+migrations already have the columns.
+
+Revision ID: 760cb23a9f78
+Revises: 7da387bfd2fe
+Create Date: 2026-10-18 09:51:33.755130
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '760cb23a9f78'
+down_revision: Union[str, None] = '7da387bfd2fe'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    columns = {column["name"] for column in sa.inspect(op.get_bind()).get_columns("schedules")}
+    if "rules" in columns:
+        return
+    with op.batch_alter_table("schedules") as batch:
+        batch.alter_column("disable_time", existing_type=sa.String(), nullable=True)
+        batch.alter_column("enable_time", existing_type=sa.String(), nullable=True)
+        batch.add_column(sa.Column("rules", sa.Text()))
+        batch.add_column(sa.Column("intervals", sa.Text()))
+
+
+def downgrade() -> None:
+    # Weekly schedules have no daily pair to fall back to
+    op.execute("DELETE FROM schedules WHERE disable_time IS NULL")
+    with op.batch_alter_table("schedules") as batch:
+        batch.drop_column("intervals")
+        batch.drop_column("rules")
+        batch.alter_column("disable_time", existing_type=sa.String(), nullable=False)
+        batch.alter_column("enable_time", existing_type=sa.String(), nullable=False)
@@ -0,0 +1,83 @@
+"""baseline schema
+
+The tables as initialize_db.py and Base.metadata.create_all made them before
+migrations. Databases created that way have no alembic_version yet; this
+revision adopts them, creating only what is missing.
+
+Revision ID: 7da387bfd2fe
+Revises: 
+Create Date: 2026-10-18 09:51:32.855843
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7da387bfd2fe'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+    if "clients" not in tables:
+        op.create_table(
+            "clients",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("client_id", sa.String(), nullable=False, unique=True),
+            sa.Column("friendly_name", sa.String()),
+            sa.Column("ip", sa.String(), nullable=False),
+            sa.Column("state", sa.String()),
+            sa.Column("registered_at", sa.DateTime()),
+            sa.Column("last_heartbeat", sa.DateTime()),
+        )
+    elif "friendly_name" not in {column["name"] for column in inspector.get_columns("clients")}:
+        # Only initialize_db.py's DDL had it
+        op.add_column("clients", sa.Column("friendly_name", sa.String()))
+    if "schedules" not in tables:
+        op.create_table(
+            "schedules",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("client_id", sa.Integer(), sa.ForeignKey("clients.id"), nullable=False),
+            sa.Column("disable_time", sa.String(), nullable=False),
+            sa.Column("enable_time", sa.String(), nullable=False),
+        )
+    if "availability_events" not in tables:
+        op.create_table(
+            "availability_events",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("client_id", sa.String(), nullable=False),
+            sa.Column("event", sa.String(), nullable=False),
+            sa.Column("at", sa.DateTime(), nullable=False),
+        )
+        op.create_index("ix_availability_events_client_at", "availability_events", ["client_id", "at"])
+        op.create_index("ix_availability_events_at", "availability_events", ["at"])
+    if "availability_state" not in tables:
+        op.create_table(
+            "availability_state",
+            sa.Column("client_id", sa.String(), primary_key=True),
+            sa.Column("kind", sa.String(), primary_key=True),
+            sa.Column("active", sa.Boolean(), nullable=False),
+            sa.Column("since", sa.DateTime(), nullable=False),
+        )
+    if "availability_rollups" not in tables:
+        op.create_table(
+            "availability_rollups",
+            sa.Column("client_id", sa.String(), primary_key=True),
+            sa.Column("period", sa.String(), primary_key=True),
+            sa.Column("bucket_start", sa.DateTime(), primary_key=True),
+            sa.Column("online_seconds", sa.Float(), nullable=False),
+            sa.Column("paused_seconds", sa.Float(), nullable=False),
+            sa.Column("blocked_seconds", sa.Float(), nullable=False),
+        )
+        op.create_index("ix_availability_rollups_period_bucket", "availability_rollups", ["period", "bucket_start"])
+
+
+def downgrade() -> None:
+    for table in ("availability_rollups", "availability_state", "availability_events", "schedules", "clients"):
+        op.drop_table(table)
@@ -0,0 +1,50 @@
+"""indexes for hot queries
+
+- uq_schedules_client_id: one schedule per client, and the index behind every
+  client/schedule join. Duplicate rows are dropped first, keeping the one the
+  endpoints used (lowest id).
+- ix_clients_state_client_id: selector lookups by state, covering.
+- No last_heartbeat index: heartbeat flushes update it on every row (about
+  1.7 us each, +65% per flush at 10k clients) to speed up one startup load.
+- ix_clients_id / ix_schedules_id (from index=True on the primary keys under
+  create_all) duplicate the rowid and only cost writes; dropped.
+
+Revision ID: c57346efc3fb
+Revises: 760cb23a9f78
+Create Date: 2026-10-18 09:51:34.639378
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c57346efc3fb'
+down_revision: Union[str, None] = '760cb23a9f78'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    indexes = {
+        table: {index["name"] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+        for table in ("clients", "schedules")
+    }
+    op.execute(
+        "DELETE FROM schedules WHERE id NOT IN (SELECT MIN(id) FROM schedules GROUP BY client_id)"
+    )
+    if "uq_schedules_client_id" not in indexes["schedules"]:
+        op.create_index("uq_schedules_client_id", "schedules", ["client_id"], unique=True)
+    if "ix_clients_state_client_id" not in indexes["clients"]:
+        op.create_index("ix_clients_state_client_id", "clients", ["state", "client_id"])
+    if "ix_clients_id" in indexes["clients"]:
+        op.drop_index("ix_clients_id", table_name="clients")
+    if "ix_schedules_id" in indexes["schedules"]:
+        op.drop_index("ix_schedules_id", table_name="schedules")
+
+
+def downgrade() -> None:
+    op.drop_index("ix_clients_state_client_id", table_name="clients")
+    op.drop_index("uq_schedules_client_id", table_name="schedules")
@@ -1,22 +1,68 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Boolean, Column, Integer, Float, String, Text, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from db import Base
 
+# The schema is defined here; migrations/versions brings databases up to it
+# (see db.upgrade_schema) and benchmarks/query_plans.py checks the two agree.
+
 class Client(Base):
     __tablename__ = "clients"
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     client_id = Column(String, unique=True, nullable=False)
+    friendly_name = Column(String)
     ip = Column(String, nullable=False)
     state = Column(String, default="unpaused")
     registered_at = Column(DateTime, default=datetime.utcnow)
     last_heartbeat = Column(DateTime)
     schedules = relationship("Schedule", back_populates="client", cascade="all, delete-orphan")
+    # Selector lookups by state; covers the (id, client_id) they return. Nothing
+    # indexes last_heartbeat: every heartbeat flush would update that index, and
+    # only the liveness load at startup reads by it (the sweeps run in memory).
+    __table_args__ = (Index("ix_clients_state_client_id", "state", "client_id"),)
 
 class Schedule(Base):
     __tablename__ = "schedules"
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     client_id = Column(Integer, ForeignKey("clients.id"), nullable=False)
-    disable_time = Column(String, nullable=False)
-    enable_time = Column(String, nullable=False)
+    # A daily window; both NULL when the schedule is weekly rules
+    disable_time = Column(String)
+    enable_time = Column(String)
+    # Weekly windows and date exceptions as JSON (see weekly_schedule.normalize_rules)
+    rules = Column(Text)
+    # Compiled minute-of-week intervals as JSON, written alongside either form
+    intervals = Column(Text)
     client = relationship("Client", back_populates="schedules")
+    # One schedule per client; also the index every client/schedule join uses
+    __table_args__ = (Index("uq_schedules_client_id", "client_id", unique=True),)
+
+class AvailabilityEvent(Base):
+    """Append-only log of online/offline, paused/unpaused and blocked/unblocked transitions."""
+    __tablename__ = "availability_events"
+    id = Column(Integer, primary_key=True)
+    client_id = Column(String, nullable=False)
+    event = Column(String, nullable=False)
+    at = Column(DateTime, nullable=False)
+    __table_args__ = (
+        Index("ix_availability_events_client_at", "client_id", "at"),
+        Index("ix_availability_events_at", "at"),
+    )
+
+class AvailabilityState(Base):
+    """Current value of each availability kind per client and since when; open periods."""
+    __tablename__ = "availability_state"
+    client_id = Column(String, primary_key=True)
+    kind = Column(String, primary_key=True)  # "online", "paused" or "blocked"
+    active = Column(Boolean, nullable=False)
+    since = Column(DateTime, nullable=False)
+
+class AvailabilityRollup(Base):
+    """Seconds online/paused/blocked per client per hour or day bucket."""
+    __tablename__ = "availability_rollups"
+    client_id = Column(String, primary_key=True)
+    period = Column(String, primary_key=True)  # "hour" or "day"
+    bucket_start = Column(DateTime, primary_key=True)
+    online_seconds = Column(Float, nullable=False, default=0)
+    paused_seconds = Column(Float, nullable=False, default=0)
+    blocked_seconds = Column(Float, nullable=False, default=0)
+    __table_args__ = (Index("ix_availability_rollups_period_bucket", "period", "bucket_start"),)
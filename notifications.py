@@ -0,0 +1,496 @@
+import asyncio
+import json
+import logging
+import os
+import smtplib
+import time
+from collections import deque
+from datetime import datetime
+from email.message import EmailMessage
+from availability import EVENTS
+from ws_hub import hub
+from metrics import notification_latency
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows; a single worker is assumed there
+    fcntl = None
+
+# JSON file listing the sinks and recipients; notifications are off without it
+NOTIFY_CONFIG = os.getenv(
+    "NOTIFY_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "notifications.json")
+)
+# Events waiting for the dispatcher before new ones are dropped
+QUEUE_SIZE = 10000
+# Seconds a recipient's first pending event waits for others to join its message
+BATCH_WINDOW = 60
+# Messages per hour each recipient may receive, and how many may go out back to back
+RATE_PER_HOUR = 12
+BURST = 3
+# Delivery attempts per message, and the first retry delay in seconds (doubles each time)
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 5
+# Events sent to the dispatching worker per datagram
+FORWARD_CHUNK = 200
+# Seconds between attempts by other workers to take over dispatching
+LEADER_RETRY = 5
+# Delivery latencies kept for /stats/notifications
+LATENCY_HISTORY = 200
+
+DEFAULT_EVENTS = ("offline", "online")
+# Only sent after the opposite was: "back online" follows an "offline" message, so
+# clients starting up or recovering from an unreported blip stay quiet
+RECOVERY_EVENTS = {"online": "offline"}
+
+
+class TokenBucket:
+    """Allow `capacity` actions at once, refilled at `rate` per second."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now=None):
+        """Use a token if one is available."""
+        self._refill(now or time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self, now=None):
+        """Seconds until the next token."""
+        self._refill(now or time.monotonic())
+        return max(0.0, (1 - self.tokens) / self.rate) if self.rate else float("inf")
+
+
+class FileSink:
+    """Append each message as a JSON line."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _append(self, line):
+        with open(self.path, "a") as f:
+            f.write(line + "\n")
+
+    async def send(self, recipient, message):
+        await asyncio.to_thread(self._append, json.dumps(message))
+
+
+class SmtpSink:
+    """Send each message as a plain-text email."""
+
+    def __init__(self, host="localhost", port=25, sender="downtime@localhost", username=None, password=None,
+                 starttls=False, timeout=10):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def _send(self, to, subject, body):
+        email = EmailMessage()
+        email["From"] = self.sender
+        email["To"] = to
+        email["Subject"] = subject
+        email.set_content(body)
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(email)
+
+    async def send(self, recipient, message):
+        await asyncio.to_thread(self._send, recipient.to, message["subject"], message["body"])
+
+
+class WebhookSink:
+    """POST each message as JSON."""
+
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+        self._session = None
+
+    async def send(self, recipient, message):
+        import aiohttp
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        async with self._session.post(self.url, json=message) as response:
+            response.raise_for_status()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class Recipient:
+    """One destination with its own event filter, batching window and rate limit."""
+
+    def __init__(self, name, sink, to=None, events=DEFAULT_EVENTS, window=BATCH_WINDOW,
+                 rate=RATE_PER_HOUR, burst=BURST):
+        self.name = name
+        self.sink = sink
+        self.to = to
+        self.events = set(events)
+        self.window = window
+        self.bucket = TokenBucket(rate / 3600, burst)
+        # (client_id, kind) -> (event, at, queued_at) waiting for the next message
+        self.pending = {}
+        # (client_id, kind) -> active, as last sent to this recipient
+        self.announced = {}
+        self.deadline = None
+
+
+def build_message(recipient, batch):
+    """Subject, text body and event list for one batch of (client_id, event, at)."""
+    counts = {}
+    for _, event, _ in batch:
+        counts[event] = counts.get(event, 0) + 1
+    subject = "Downtime: " + ", ".join(f"{count} {event}" for event, count in sorted(counts.items()))
+    lines = []
+    for event in sorted(counts):
+        lines.append(f"{event} ({counts[event]}):")
+        for client_id, other, at in batch:
+            if other == event:
+                lines.append(f"  {client_id} at {datetime.utcfromtimestamp(at).isoformat(timespec='seconds')}Z")
+    return {
+        "recipient": recipient.name,
+        "subject": subject,
+        "body": "\n".join(lines) + "\n",
+        "events": [{"client_id": client_id, "event": event, "at": at} for client_id, event, at in batch],
+    }
+
+
+class Notifier:
+    """
+    Turn client transitions into batched, deduplicated, rate-limited messages.
+
+    notify() may be called from any thread and only queues the event. One
+    dispatcher task per app adds events to each interested recipient's pending
+    batch: repeats of what the recipient already knows are dropped, and an
+    event cancelled by its opposite within the window (a flap) drops both. A
+    batch goes out when its window closes and the recipient's token bucket
+    allows; until then later events join it, so a building-wide outage
+    becomes one message per recipient.
+
+    With several uvicorn workers, the one holding a file lock in the hub
+    directory dispatches and the others forward their events to it.
+    """
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.recipients = []
+        self.leader = False
+        self._queue = None
+        self._loop = None
+        self._task = None
+        self._lock_file = None
+        self._outbox = []
+        self._forward_retry = None
+        self._deliveries = set()
+        self.received = 0
+        self.dropped = 0
+        self.duplicates = 0
+        self.flaps = 0
+        self.quiet = 0
+        self.rate_limited = 0
+        self.forwarded = 0
+        self.sent = 0
+        self.events_sent = 0
+        self.failures = 0
+        self.latencies = deque(maxlen=LATENCY_HISTORY)
+
+    def configure(self, config):
+        """
+        Build recipients from a config dict:
+        {"smtp": {"host", "port", "sender", "username", "password", "starttls"},
+         "recipients": [{"name", "sink": "smtp"|"webhook"|"file", "to" | "url" | "path",
+                         "events", "window", "rate", "burst"}]}
+        """
+        recipients = []
+        smtp = None
+        for entry in config.get("recipients", []):
+            sink = entry["sink"]
+            if sink == "smtp":
+                smtp = smtp or SmtpSink(**config.get("smtp", {}))
+                target = smtp
+            elif sink == "webhook":
+                target = WebhookSink(entry["url"])
+            elif sink == "file":
+                target = FileSink(entry["path"])
+            else:
+                raise ValueError(f"Unknown notification sink: {sink}")
+            unknown = set(entry.get("events", ())) - set(EVENTS)
+            if unknown:
+                raise ValueError(f"Unknown notification events: {sorted(unknown)}")
+            recipients.append(Recipient(
+                entry.get("name", entry.get("to") or entry.get("url") or entry.get("path")),
+                target,
+                to=entry.get("to"),
+                events=entry.get("events", DEFAULT_EVENTS),
+                window=entry.get("window", BATCH_WINDOW),
+                rate=entry.get("rate", RATE_PER_HOUR),
+                burst=entry.get("burst", BURST),
+            ))
+        self.recipients = recipients
+
+    def notify(self, client_id, event, at=None):
+        """Queue a transition from any thread; at is epoch seconds. Never blocks."""
+        if not self.recipients or self._loop is None:
+            return False
+        item = (client_id, event, at or time.time(), time.monotonic())
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._accept(item)
+        else:
+            self._loop.call_soon_threadsafe(self._accept, item)
+        return True
+
+    def _accept(self, item):
+        if self.leader:
+            self._enqueue(item)
+            return
+        if len(self._outbox) >= self.queue_size:
+            self.dropped += 1
+            return
+        self._outbox.append(item[:3])
+        if len(self._outbox) == 1 and self._forward_retry is None:
+            self._loop.call_soon(self._forward)
+
+    def _enqueue(self, item):
+        if self._queue.full():
+            self.dropped += 1
+            return
+        self._queue.put_nowait(item)
+
+    def _forward(self):
+        """
+        Hand the outbox to the dispatching worker. What no other worker could
+        be sent (e.g. while the leader is being replaced) stays here and is
+        retried, unless this worker can take the lead and dispatch it itself.
+        """
+        self._forward_retry = None
+        if self._try_lead():
+            now = time.monotonic()
+            outbox, self._outbox = self._outbox, []
+            for client_id, event, at in outbox:
+                self._enqueue((client_id, event, at, now))
+            return
+        while self._outbox:
+            chunk = self._outbox[:FORWARD_CHUNK]
+            if not hub.publish("notify", events=chunk):
+                self._forward_retry = self._loop.call_later(LEADER_RETRY, self._forward)
+                return
+            del self._outbox[:len(chunk)]
+            self.forwarded += len(chunk)
+
+    def _forwarded(self, message):
+        # Without a leader (it just exited), whoever receives the events takes over
+        if self.leader or self._try_lead():
+            now = time.monotonic()
+            for client_id, event, at in message["events"]:
+                self._enqueue((client_id, event, at, now))
+
+    def _add(self, item):
+        client_id, event, at, queued_at = item
+        self.received += 1
+        kind, active = EVENTS[event]
+        key = (client_id, kind)
+        for recipient in self.recipients:
+            if event not in recipient.events:
+                continue
+            pending = recipient.pending.get(key)
+            if pending is not None:
+                if pending[0] == event:
+                    self.duplicates += 1
+                else:
+                    # Back to where it was before the window opened
+                    del recipient.pending[key]
+                    self.flaps += 1
+                continue
+            announced = recipient.announced.get(key)
+            if announced == active:
+                self.duplicates += 1
+                continue
+            if event in RECOVERY_EVENTS and announced is None:
+                self.quiet += 1
+                continue
+            recipient.pending[key] = (event, at, queued_at)
+            if recipient.deadline is None:
+                recipient.deadline = time.monotonic() + recipient.window
+
+    def _flush(self, now, force=False):
+        """Start delivery of every batch whose window closed; returns seconds until the next is due."""
+        next_due = None
+        for recipient in self.recipients:
+            if not recipient.pending:
+                recipient.deadline = None
+                continue
+            if not force and recipient.deadline > now:
+                wait = recipient.deadline - now
+            elif not force and not recipient.bucket.take(now):
+                self.rate_limited += 1
+                # Keep collecting; the batch goes out with the next token
+                recipient.deadline = now + recipient.bucket.wait_time(now)
+                wait = recipient.deadline - now
+            else:
+                batch, recipient.pending, recipient.deadline = recipient.pending, {}, None
+                for (client_id, kind), (event, _, _) in batch.items():
+                    recipient.announced[(client_id, kind)] = EVENTS[event][1]
+                task = asyncio.create_task(self._deliver(recipient, batch))
+                self._deliveries.add(task)
+                task.add_done_callback(self._deliveries.discard)
+                continue
+            next_due = wait if next_due is None else min(next_due, wait)
+        return next_due
+
+    async def _deliver(self, recipient, batch):
+        events = sorted((at, client_id, event) for (client_id, _), (event, at, _) in batch.items())
+        message = build_message(recipient, [(client_id, event, at) for at, client_id, event in events])
+        oldest = min(queued_at for _, _, queued_at in batch.values())
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                await recipient.sink.send(recipient, message)
+            except Exception as e:
+                logging.warning(f"Notification to {recipient.name} failed (attempt {attempt + 1}): {e!r}")
+                if attempt + 1 < MAX_ATTEMPTS:
+                    await asyncio.sleep(RETRY_DELAY * 2 ** attempt)
+                continue
+            self.sent += 1
+            self.events_sent += len(events)
+            self.latencies.append(time.monotonic() - oldest)
+            notification_latency.observe(time.monotonic() - oldest)
+            return True
+        self.failures += 1
+        logging.error(f"Dropped notification to {recipient.name} with {len(events)} events.")
+        return False
+
+    def _try_lead(self):
+        """Take the dispatcher lock if no other worker holds it."""
+        if self.leader:
+            return True
+        if fcntl is None or hub.path is None:
+            self.leader = True
+            return True
+        if self._lock_file is None:
+            self._lock_file = open(os.path.join(hub.hub_dir, "notifications.lock"), "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        self.leader = True
+        logging.info(f"Worker {os.getpid()} dispatches notifications.")
+        return True
+
+    async def _run(self):
+        next_due = None
+        while True:
+            if not self._try_lead():
+                await asyncio.sleep(LEADER_RETRY)
+                continue
+            try:
+                item = await asyncio.wait_for(self._queue.get(), next_due if next_due is not None else LEADER_RETRY)
+                self._add(item)
+                # Take the rest of a burst before looking at the windows
+                while not self._queue.empty():
+                    self._add(self._queue.get_nowait())
+            except asyncio.TimeoutError:
+                pass
+            try:
+                next_due = self._flush(time.monotonic())
+            except Exception as e:
+                logging.error(f"Notification dispatch failed: {e}")
+                next_due = None
+
+    def start(self, path=NOTIFY_CONFIG):
+        """Load the recipients and start dispatching; call from the event loop after hub.start()."""
+        if not os.path.exists(path):
+            logging.info(f"Notifications off: no {path}.")
+            return
+        with open(path) as f:
+            self.configure(json.load(f))
+        if not self.recipients:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        hub.set_handler("notify", self._forwarded)
+        self._try_lead()
+        self._task = asyncio.create_task(self._run())
+        logging.info(f"Notifications on for {len(self.recipients)} recipients.")
+
+    async def stop(self, timeout=10):
+        """Send what is still pending, ignoring windows and rate limits, then release the lock."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+        if self._forward_retry is not None:
+            self._forward_retry.cancel()
+        # A last attempt for what is still waiting for the leader
+        if self._outbox:
+            self._forward()
+            if self._outbox:
+                logging.warning(f"Dropping {len(self._outbox)} notification events no worker could take.")
+                self.dropped += len(self._outbox)
+                self._outbox = []
+        if self.leader:
+            while not self._queue.empty():
+                self._add(self._queue.get_nowait())
+            self._flush(time.monotonic(), force=True)
+        if self._deliveries:
+            await asyncio.wait(self._deliveries, timeout=timeout)
+        for sink in {recipient.sink for recipient in self.recipients}:
+            if hasattr(sink, "close"):
+                await sink.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self.leader = False
+        self._loop = None
+
+    def stats(self):
+        """Return dispatcher counters."""
+        latencies = sorted(self.latencies)
+        return {
+            "leader": self.leader,
+            "recipients": len(self.recipients),
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "pending": sum(len(recipient.pending) for recipient in self.recipients),
+            "in_flight": len(self._deliveries),
+            "received": self.received,
+            "dropped": self.dropped,
+            "duplicates": self.duplicates,
+            "flaps": self.flaps,
+            "quiet": self.quiet,
+            "rate_limited": self.rate_limited,
+            "forwarded": self.forwarded,
+            "outbox": len(self._outbox),
+            "sent": self.sent,
+            "events_sent": self.events_sent,
+            "failures": self.failures,
+            "latency_ms": {
+                "count": len(latencies),
+                "p50": latencies[len(latencies) // 2] * 1000 if latencies else None,
+                "p95": latencies[int(len(latencies) * 0.95)] * 1000 if latencies else None,
+                "max": latencies[-1] * 1000 if latencies else None,
+            },
+        }
+
+
+# Shared dispatcher, fed by liveness and state changes and started with the app
+notifier = Notifier()
@@ -148,15 +148,14 @@ def write_files():
 # Step 2: Install Dependencies
 def install_dependencies():
     print("Installing dependencies...")
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "fastapi", "uvicorn", "sqlalchemy", "apscheduler"])
+    subprocess.check_call([sys.executable, "-m", "pip", "install", "fastapi", "uvicorn", "sqlalchemy", "apscheduler", "alembic", "numpy", "aiosqlite", "jinja2"])
     print("Dependencies installed.")
 
 # Step 3: Initialize Database
 def initialize_database():
     print("Initializing database...")
-    from db import engine, Base
-    from models import Client, Schedule
-    Base.metadata.create_all(bind=engine)
+    from db import upgrade_schema
+    upgrade_schema()
     print("Database initialized successfully.")
 
 # Step 4: Run Tests
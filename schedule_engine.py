@@ -0,0 +1,154 @@
+import heapq
+import logging
+import threading
+from datetime import datetime
+from db import ReadSessionLocal
+from weekly_schedule import WeeklySchedule
+
+JOB_ID_PREFIX = "schedule-transition-"
+
+
+class ScheduleEngine:
+    """
+    Keep every client's compiled WeeklySchedule and a min-heap holding each
+    client's next block/unblock transition. One APScheduler job is registered
+    per distinct transition instant; each run only pops the transitions that
+    are due and queues the one after, looked up in the client's schedule.
+    """
+
+    def __init__(self):
+        self._schedules = {}
+        self._generations = {}
+        self._heap = []
+        self._job_instants = set()
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._scheduler = None
+        self.fired = 0
+
+    def add_listener(self, callback):
+        """Register callback(client_id, blocked, instant) for every transition."""
+        self._listeners.append(callback)
+
+    def load(self, db_session=None):
+        """Compile every schedule row; called once at startup."""
+        from models import Client, Schedule
+        db = db_session or ReadSessionLocal()
+        try:
+            rows = (
+                db.query(Client.client_id, Schedule.disable_time, Schedule.enable_time, Schedule.intervals)
+                .join(Schedule, Schedule.client_id == Client.id)
+                .all()
+            )
+        finally:
+            if db_session is None:
+                db.close()
+        for client_id, disable_time, enable_time, intervals in rows:
+            try:
+                self.update(client_id, WeeklySchedule.from_row(disable_time, enable_time, intervals))
+            except ValueError as e:
+                logging.error(f"Skipping schedule for {client_id}: {e}")
+        logging.info(f"Schedule engine loaded {len(self._schedules)} schedules.")
+
+    def update(self, client_id, schedule, now=None):
+        """Replace a client's WeeklySchedule (None forgets it) and queue its next transition."""
+        if schedule is None:
+            self.remove(client_id)
+            return
+        now = now or datetime.now()
+        transition = schedule.next_transition(now)
+        with self._lock:
+            generation = self._generations.get(client_id, 0) + 1
+            self._generations[client_id] = generation
+            self._schedules[client_id] = schedule
+            # A schedule that never changes state has no transitions
+            if transition is not None:
+                self._push(transition[0], client_id, transition[1], generation)
+
+    def remove(self, client_id):
+        """Forget a client; its queued transitions are skipped when they come due."""
+        with self._lock:
+            self._generations[client_id] = self._generations.get(client_id, 0) + 1
+            self._schedules.pop(client_id, None)
+
+    def is_blocked(self, client_id, now=None):
+        """Whether the client's schedule blocks it at the given time."""
+        schedule = self._schedules.get(client_id)
+        if schedule is None:
+            return False
+        return schedule.is_blocked(now or datetime.now())
+
+    def next_transition(self, client_id, now=None):
+        """Return (instant, blocked) of the client's next transition, or None."""
+        schedule = self._schedules.get(client_id)
+        if schedule is None:
+            return None
+        return schedule.next_transition(now or datetime.now())
+
+    def _push(self, instant, client_id, blocked, generation):
+        heapq.heappush(self._heap, (instant, client_id, blocked, generation))
+        if instant not in self._job_instants:
+            self._job_instants.add(instant)
+            if self._scheduler is not None:
+                self._add_job(instant)
+
+    def _add_job(self, instant):
+        self._scheduler.add_job(
+            self.fire_due,
+            "date",
+            run_date=instant,
+            args=[instant],
+            id=JOB_ID_PREFIX + instant.strftime("%Y%m%d%H%M"),
+            replace_existing=True,
+            misfire_grace_time=None,
+        )
+
+    def fire_due(self, instant=None, now=None):
+        """Pop and emit every transition due by now, then queue each client's next one."""
+        now = now or datetime.now()
+        due = []
+        with self._lock:
+            if instant is not None:
+                self._job_instants.discard(instant)
+            while self._heap and self._heap[0][0] <= now:
+                entry_instant, client_id, blocked, generation = heapq.heappop(self._heap)
+                if self._generations.get(client_id) != generation:
+                    continue
+                due.append((client_id, blocked, entry_instant))
+                transition = self._schedules[client_id].next_transition(entry_instant)
+                if transition is not None:
+                    self._push(transition[0], client_id, transition[1], generation)
+
+        self.fired += len(due)
+        for client_id, blocked, entry_instant in due:
+            for callback in self._listeners:
+                try:
+                    callback(client_id, blocked, entry_instant)
+                except Exception as e:
+                    logging.error(f"Schedule transition listener failed for {client_id}: {e}")
+        return len(due)
+
+    def start(self, scheduler):
+        """Load schedules and register one job per upcoming transition instant."""
+        self.load()
+        with self._lock:
+            self._scheduler = scheduler
+            for instant in self._job_instants:
+                self._add_job(instant)
+        logging.info(f"Schedule engine tracking {len(self._job_instants)} transition instants.")
+
+    def stats(self):
+        """Return engine counters."""
+        with self._lock:
+            next_instant = self._heap[0][0].isoformat() if self._heap else None
+            return {
+                "schedules": len(self._schedules),
+                "queued_transitions": len(self._heap),
+                "pending_jobs": len(self._job_instants),
+                "next_transition": next_instant,
+                "fired": self.fired,
+            }
+
+
+# Shared engine, started with the app
+schedule_engine = ScheduleEngine()
@@ -0,0 +1,87 @@
+// Keeps a dashboard page current from /dashboard/events and sends its actions to the JSON API.
+(function () {
+    const table = document.querySelector("table[data-events]");
+    if (!table) {
+        return;
+    }
+    const body = table.tBodies[0];
+    const template = document.getElementById("row-template");
+
+    function rowFor(clientId) {
+        return [...body.rows].find((tr) => tr.dataset.clientId === clientId);
+    }
+
+    function fill(tr, row) {
+        tr.dataset.clientId = row.client_id;
+        tr.querySelectorAll("[data-field]").forEach((el) => {
+            const value = row[el.dataset.field] ?? "";
+            el.dataset.value = value;
+            if (el.tagName === "INPUT") {
+                // Leave a field alone while someone is typing in it
+                if (document.activeElement !== el) {
+                    el.value = value;
+                }
+            } else {
+                el.textContent = value;
+            }
+        });
+    }
+
+    function apply(message) {
+        if (message.reload) {
+            window.location.reload();
+            return;
+        }
+        message.removed.forEach((clientId) => {
+            const tr = rowFor(clientId);
+            if (tr) {
+                tr.remove();
+            }
+        });
+        message.rows.forEach((row) => {
+            let tr = rowFor(row.client_id);
+            if (!tr) {
+                tr = template.content.firstElementChild.cloneNode(true);
+                const before = [...body.rows].find((other) => other.dataset.clientId > row.client_id);
+                body.insertBefore(tr, before || null);
+            }
+            fill(tr, row);
+        });
+    }
+
+    new EventSource(table.dataset.events).onmessage = (event) => apply(JSON.parse(event.data));
+
+    async function post(path, payload) {
+        const response = await fetch(path, {
+            method: "POST",
+            headers: {"Content-Type": "application/json"},
+            body: JSON.stringify(payload),
+        });
+        if (!response.ok) {
+            const error = await response.json().catch(() => ({}));
+            window.alert(error.detail || `Request failed (${response.status})`);
+        }
+    }
+
+    // The pushed diff updates the row, so nothing is redrawn here
+    body.addEventListener("click", (event) => {
+        const button = event.target.closest("button[data-state]");
+        if (button) {
+            post("/clients/state", {client_id: button.closest("tr").dataset.clientId, state: button.dataset.state});
+        }
+    });
+    body.addEventListener("submit", (event) => {
+        event.preventDefault();
+        const form = event.target;
+        const clientId = form.closest("tr").dataset.clientId;
+        if (form.elements.disable_time) {
+            post("/schedule", {
+                client_id: clientId,
+                disable_time: form.elements.disable_time.value,
+                enable_time: form.elements.enable_time.value,
+            });
+        } else {
+            post("/clients/state", {client_id: clientId, state: form.elements.state.value});
+        }
+    });
+})();
@@ -0,0 +1,259 @@
+import json
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+# Shorthands accepted in a window's "days"
+DAY_GROUPS = {"daily": DAYS, "weekdays": DAYS[:5], "weekends": DAYS[5:]}
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+def parse_minutes(value, allow_end_of_day=False):
+    """Convert an "HH:MM" string to minutes since midnight ("24:00" only if allowed)."""
+    hours, minutes = value.split(":")
+    hours, minutes = int(hours), int(minutes)
+    if allow_end_of_day and hours == 24 and minutes == 0:
+        return MINUTES_PER_DAY
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"Invalid time: {value}")
+    return hours * 60 + minutes
+
+
+def _days(value):
+    names = [value] if isinstance(value, str) else list(value)
+    days = []
+    for name in names:
+        name = name.lower()
+        if name in DAY_GROUPS:
+            days.extend(DAY_GROUPS[name])
+        elif name in DAYS:
+            days.append(name)
+        else:
+            raise ValueError(f"Invalid day: {name}")
+    return sorted(set(days), key=DAYS.index)
+
+
+def _merge(intervals):
+    """Sort and merge overlapping or touching (start, end) pairs into a flat list."""
+    merged = []
+    for start, end in sorted(intervals):
+        if start >= end:
+            continue
+        if merged and start <= merged[-1]:
+            merged[-1] = max(merged[-1], end)
+        else:
+            merged.extend((start, end))
+    return merged
+
+
+def normalize_rules(windows, exceptions=None):
+    """
+    Validate weekly windows and date exceptions into their stored form.
+
+    windows: [{"days": ["mon", ...] or "weekdays", "start": "HH:MM", "end": "HH:MM"}];
+    a window ending at or before its start runs past midnight into the next day.
+    exceptions: [{"date": "YYYY-MM-DD", "windows": [{"start", "end"}]}] replace the
+    weekly windows for that whole date; no windows means not blocked that day.
+    """
+    rules = {"windows": [], "exceptions": []}
+    for window in windows or []:
+        start, end = window["start"], window["end"]
+        parse_minutes(start)
+        parse_minutes(end, allow_end_of_day=True)
+        rules["windows"].append({"days": _days(window.get("days", "daily")), "start": start, "end": end})
+    seen = set()
+    for exception in exceptions or []:
+        date = datetime.strptime(exception["date"], "%Y-%m-%d").date().isoformat()
+        if date in seen:
+            raise ValueError(f"Duplicate exception for {date}")
+        seen.add(date)
+        day_windows = []
+        for window in exception.get("windows") or []:
+            start = parse_minutes(window["start"])
+            end = parse_minutes(window["end"], allow_end_of_day=True)
+            if end <= start:
+                raise ValueError(f"Exception window on {date} must end after it starts")
+            day_windows.append({"start": window["start"], "end": window["end"]})
+        rules["exceptions"].append({"date": date, "windows": day_windows})
+    rules["exceptions"].sort(key=lambda exception: exception["date"])
+    return rules
+
+
+def compile_rules(rules):
+    """Compile stored rules into the compact {"week": [...], "dates": {...}} form."""
+    intervals = []
+    for window in rules.get("windows", []):
+        start = parse_minutes(window["start"])
+        end = parse_minutes(window["end"], allow_end_of_day=True)
+        if start == end:
+            continue
+        length = end - start if end > start else MINUTES_PER_DAY - start + end
+        for day in window["days"]:
+            begin = DAYS.index(day) * MINUTES_PER_DAY + start
+            finish = begin + length
+            if finish > MINUTES_PER_WEEK:
+                # Sunday night into Monday morning wraps to the start of the week
+                intervals.append((begin, MINUTES_PER_WEEK))
+                intervals.append((0, finish - MINUTES_PER_WEEK))
+            else:
+                intervals.append((begin, finish))
+    dates = {}
+    for exception in rules.get("exceptions", []):
+        dates[exception["date"]] = _merge(
+            (parse_minutes(w["start"]), parse_minutes(w["end"], allow_end_of_day=True)) for w in exception["windows"]
+        )
+    return {"week": _merge(intervals), "dates": dates}
+
+
+@lru_cache(maxsize=1024)
+def compile_daily(disable_time, enable_time):
+    """The compiled form of a single daily disable/enable window, as JSON text."""
+    rules = normalize_rules([{"days": "daily", "start": disable_time, "end": enable_time}])
+    return json.dumps(compile_rules(rules), separators=(",", ":"))
+
+
+def schedule_columns(disable_time=None, enable_time=None, windows=None, exceptions=None):
+    """
+    Column values for a schedules row, compiled on write: a daily disable/enable
+    pair, or weekly windows plus date exceptions (the pair is then NULL).
+    """
+    if windows is None and exceptions is None:
+        if disable_time is None or enable_time is None:
+            raise ValueError("Provide disable_time and enable_time, or windows.")
+        intervals = compile_daily(disable_time, enable_time)
+        return {"disable_time": disable_time, "enable_time": enable_time, "rules": None, "intervals": intervals}
+    if disable_time is not None or enable_time is not None:
+        raise ValueError("Provide either disable_time/enable_time or windows, not both.")
+    rules = normalize_rules(windows, exceptions)
+    return {
+        "disable_time": None,
+        "enable_time": None,
+        "rules": json.dumps(rules, separators=(",", ":")),
+        "intervals": json.dumps(compile_rules(rules), separators=(",", ":")),
+    }
+
+
+class WeeklySchedule:
+    """
+    A client's compiled schedule: sorted, merged (start, end) minute-of-week
+    intervals (Monday 00:00 is 0) plus per-date overrides. Lookups bisect the
+    interval starts; a date exception replaces the week for that whole day.
+    """
+
+    __slots__ = ("starts", "ends", "dates", "_exception_days")
+
+    def __init__(self, week=(), dates=None):
+        if isinstance(week, str) or len(week) % 2:
+            raise ValueError("Compiled intervals must be (start, end) pairs")
+        self.starts = [int(value) for value in week[0::2]]
+        self.ends = [int(value) for value in week[1::2]]
+        self.dates = {}
+        for date, flat in (dates or {}).items():
+            self.dates[date] = ([int(value) for value in flat[0::2]], [int(value) for value in flat[1::2]])
+        self._exception_days = sorted(self.dates)
+
+    @classmethod
+    def from_compiled(cls, compiled):
+        """From the compiled dict, or its JSON text as stored in schedules.intervals."""
+        if isinstance(compiled, str):
+            compiled = json.loads(compiled)
+        return cls(compiled.get("week", ()), compiled.get("dates"))
+
+    @classmethod
+    def from_row(cls, disable_time, enable_time, intervals):
+        """A schedules row: compiled intervals if present, else the daily pair; None without either."""
+        if intervals:
+            return cls.from_compiled(intervals)
+        if disable_time is None:
+            return None
+        return cls.from_compiled(compile_daily(disable_time, enable_time))
+
+    def to_compiled(self):
+        week = [value for pair in zip(self.starts, self.ends) for value in pair]
+        dates = {
+            date: [value for pair in zip(starts, ends) for value in pair]
+            for date, (starts, ends) in self.dates.items()
+        }
+        return {"week": week, "dates": dates}
+
+    def describe(self):
+        """Short summary for log lines."""
+        return f"{len(self.starts)} weekly windows, {len(self.dates)} date exceptions"
+
+    def __bool__(self):
+        return bool(self.starts or self.dates)
+
+    @staticmethod
+    def _contains(starts, ends, minute):
+        i = bisect_right(starts, minute) - 1
+        return i >= 0 and minute < ends[i]
+
+    def is_blocked(self, now):
+        """Whether the schedule blocks at now: one bisect."""
+        day = self.dates.get(now.date().isoformat()) if self.dates else None
+        if day is not None:
+            return self._contains(day[0], day[1], now.hour * 60 + now.minute)
+        minute = now.weekday() * MINUTES_PER_DAY + now.hour * 60 + now.minute
+        return self._contains(self.starts, self.ends, minute)
+
+    def _weekly_transition(self, now):
+        """Next change of the weekly intervals alone, as (instant, blocked), or None."""
+        starts, ends = self.starts, self.ends
+        if not starts or (starts[0] == 0 and ends[-1] == MINUTES_PER_WEEK and len(starts) == 1):
+            return None
+        week_start = (now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+        minute = now.weekday() * MINUTES_PER_DAY + now.hour * 60 + now.minute
+        i = bisect_right(starts, minute) - 1
+        if i >= 0 and minute < ends[i]:
+            end = ends[i]
+            if end == MINUTES_PER_WEEK and starts[0] == 0:
+                # Continues through the week boundary into the first interval
+                end = MINUTES_PER_WEEK + ends[0]
+            return week_start + timedelta(minutes=end), False
+        start = starts[i + 1] if i + 1 < len(starts) else MINUTES_PER_WEEK + starts[0]
+        return week_start + timedelta(minutes=start), True
+
+    def next_transition(self, now):
+        """
+        Return (instant, blocked) of the next change after now, or None if the
+        state never changes. A bisect on the weekly intervals unless a date
+        exception falls before that change; then the days up to it are walked.
+        """
+        weekly = self._weekly_transition(now)
+        if self._exception_days:
+            today = now.date().isoformat()
+            last = self._exception_days[-1]
+            horizon = weekly[0].date().isoformat() if weekly else last
+            first = bisect_right(self._exception_days, today) - 1
+            if first >= 0 and self._exception_days[first] == today:
+                return self._walk(now, last)
+            if first + 1 < len(self._exception_days) and self._exception_days[first + 1] <= horizon:
+                return self._walk(now, last)
+        return weekly
+
+    def _walk(self, now, last_exception):
+        """Check each minute boundary, day by day, for the first change of state after now."""
+        blocked = self.is_blocked(now)
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        # Past the last exception only the week repeats, so one more week settles it
+        days = (datetime.fromisoformat(last_exception) - midnight).days + 8
+        for offset in range(days):
+            day = midnight + timedelta(days=offset)
+            exception = self.dates.get(day.date().isoformat())
+            if exception is not None:
+                points = exception[0] + exception[1]
+            else:
+                base = day.weekday() * MINUTES_PER_DAY
+                lo = bisect_right(self.ends, base)
+                points = []
+                for start, end in zip(self.starts[lo:], self.ends[lo:]):
+                    if start >= base + MINUTES_PER_DAY:
+                        break
+                    points.extend((start - base, end - base))
+            for point in sorted({0, *(p for p in points if 0 <= p < MINUTES_PER_DAY)}):
+                instant = day + timedelta(minutes=point)
+                if instant > now and self.is_blocked(instant) != blocked:
+                    return instant, not blocked
+        return None
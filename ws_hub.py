@@ -0,0 +1,352 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import socket
+import tempfile
+import time
+from collections import deque
+from db import DATABASE_URL
+
+try:
+    import msgpack
+except ImportError:  # Optional; agents then get JSON
+    msgpack = None
+
+# Messages queued per socket before the oldest is dropped
+SEND_QUEUE_SIZE = 16
+# Seconds a single send may take before the agent is considered stuck
+SEND_TIMEOUT = 10
+# Largest datagram sent to a peer worker; longer refresh lists are split
+MAX_DATAGRAM = 60000
+# Wire encodings an agent can ask for with ?encoding=
+ENCODINGS = ("json", "msgpack") if msgpack is not None else ("json",)
+# Fan-out durations kept for /stats/ws-hub
+FANOUT_HISTORY = 100
+
+# Workers serving the same database share a broker directory; each binds a
+# Unix datagram socket named after its pid there
+HUB_DIR = os.getenv(
+    "WS_HUB_DIR",
+    os.path.join(tempfile.gettempdir(), "downtime-hub-" + hashlib.sha1(DATABASE_URL.encode()).hexdigest()[:10]),
+)
+
+
+class Payload:
+    """A message encoded at most once per wire encoding and shared by all its recipients."""
+
+    __slots__ = ("message", "_frames")
+
+    def __init__(self, message):
+        self.message = message
+        self._frames = {}
+
+    def frame(self, encoding):
+        frame = self._frames.get(encoding)
+        if frame is None:
+            if encoding == "msgpack":
+                frame = msgpack.packb(self.message)
+            else:
+                frame = json.dumps(self.message)
+            self._frames[encoding] = frame
+        return frame
+
+
+class FanOut:
+    """Time one message's delivery to many sockets, from queueing to the last completed send."""
+
+    def __init__(self, hub, recipients):
+        self.hub = hub
+        self.recipients = recipients
+        self.pending = recipients
+        self.started = time.perf_counter()
+
+    def done(self):
+        self.pending -= 1
+        if self.pending == 0:
+            self.hub._record_fanout(self.recipients, time.perf_counter() - self.started)
+
+
+class Connection:
+    """One agent socket with a bounded send queue drained by its own writer task."""
+
+    def __init__(self, hub, client_id, websocket, encoding="json", queue_size=SEND_QUEUE_SIZE):
+        self.hub = hub
+        self.client_id = client_id
+        self.websocket = websocket
+        self.encoding = encoding
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.task = asyncio.create_task(self._writer())
+
+    def offer(self, payload, fanout=None):
+        """Queue a payload. Messages carry full state, so on overflow the oldest goes."""
+        if self.queue.full():
+            _, dropped_fanout = self.queue.get_nowait()
+            self.hub.dropped += 1
+            if dropped_fanout is not None:
+                dropped_fanout.done()
+        self.queue.put_nowait((payload, fanout))
+
+    async def _writer(self):
+        while True:
+            payload, fanout = await self.queue.get()
+            frame = payload.frame(self.encoding)
+            try:
+                if isinstance(frame, bytes):
+                    await asyncio.wait_for(self.websocket.send_bytes(frame), SEND_TIMEOUT)
+                else:
+                    await asyncio.wait_for(self.websocket.send_text(frame), SEND_TIMEOUT)
+                self.hub.sent += 1
+            except Exception as e:
+                logging.warning(f"Closing WebSocket for {self.client_id} after failed send: {e!r}")
+                self.hub.send_failures += 1
+                try:
+                    await self.websocket.close(code=1011)
+                except Exception:
+                    pass
+                return
+            finally:
+                if fanout is not None:
+                    fanout.done()
+
+    def close(self):
+        self.task.cancel()
+        # Queued messages will not be sent; release their fan-outs
+        while not self.queue.empty():
+            _, fanout = self.queue.get_nowait()
+            if fanout is not None:
+                fanout.done()
+
+
+class _PeerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, hub):
+        self.hub = hub
+
+    def datagram_received(self, data, addr):
+        self.hub._received(data)
+
+    def error_received(self, exc):
+        logging.warning(f"WebSocket hub broker error: {exc!r}")
+
+
+class WebSocketHub:
+    """
+    Agent sockets held by this worker, plus a broker linking the workers.
+
+    Each uvicorn worker holds only its own sockets. Writes handled by one worker
+    are announced to the others as "refresh" messages naming the changed
+    clients; every worker drops those clients from its caches and pushes fresh
+    state to the ones connected to it. Broadcasts are forwarded as-is and
+    encoded once per worker.
+    Peers talk over Unix datagram sockets in HUB_DIR, so no broker process is needed.
+    """
+
+    def __init__(self, hub_dir=HUB_DIR):
+        self.hub_dir = hub_dir
+        self.path = None
+        self._local = {}
+        self._transport = None
+        self._refresh_handler = None
+        self._handlers = {}
+        self.sent = 0
+        self.dropped = 0
+        self.send_failures = 0
+        self.forwarded = 0
+        self.received = 0
+        self.fanouts = deque(maxlen=FANOUT_HISTORY)
+
+    def set_refresh_handler(self, handler):
+        """Register async handler(client_ids) run when a peer announces changed clients."""
+        self._refresh_handler = handler
+
+    def set_handler(self, kind, handler):
+        """Register handler(message) for peer messages of another kind, e.g. "notify"."""
+        self._handlers[kind] = handler
+
+    async def start(self):
+        """Bind this worker's broker socket."""
+        if not hasattr(socket, "AF_UNIX"):
+            logging.info("WebSocket hub running without a broker (no Unix sockets).")
+            return
+        os.makedirs(self.hub_dir, exist_ok=True)
+        self.path = os.path.join(self.hub_dir, f"worker-{os.getpid()}.sock")
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _PeerProtocol(self), local_addr=self.path, family=socket.AF_UNIX
+        )
+        logging.info(f"WebSocket hub broker bound at {self.path}.")
+
+    def stop(self):
+        for connection in list(self._local.values()):
+            connection.close()
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    # Local sockets
+    def register(self, client_id, websocket, encoding="json"):
+        """Track a new socket for client_id, replacing any older one."""
+        previous = self._local.get(client_id)
+        if previous is not None:
+            previous.close()
+        if encoding not in ENCODINGS:
+            encoding = "json"
+        connection = Connection(self, client_id, websocket, encoding)
+        self._local[client_id] = connection
+        return connection
+
+    def unregister(self, client_id, connection):
+        """Forget a socket, unless a newer one already replaced it."""
+        if self._local.get(client_id) is connection:
+            del self._local[client_id]
+        connection.close()
+
+    def is_local(self, client_id):
+        return client_id in self._local
+
+    def local_ids(self):
+        return list(self._local)
+
+    def send_local(self, client_id, message):
+        """Queue a message for a socket held by this worker; False if it is not here."""
+        connection = self._local.get(client_id)
+        if connection is None:
+            return False
+        connection.offer(Payload(message))
+        return True
+
+    def fan_out(self, targets):
+        """
+        Queue (client_id, Payload) pairs on the sockets held here and time the
+        whole batch as one fan-out. Share a Payload between recipients of the
+        same message so it is encoded once. Returns the client_ids queued.
+        """
+        connections = [(self._local.get(client_id), payload) for client_id, payload in targets]
+        connections = [(connection, payload) for connection, payload in connections if connection is not None]
+        if not connections:
+            return set()
+        fanout = FanOut(self, len(connections))
+        for connection, payload in connections:
+            connection.offer(payload, fanout)
+        return {connection.client_id for connection, _ in connections}
+
+    def broadcast(self, message):
+        """Send one message to every agent on every worker; returns local recipients."""
+        self._publish({"kind": "broadcast", "message": message})
+        return self._broadcast_local(message)
+
+    def _broadcast_local(self, message):
+        payload = Payload(message)
+        return len(self.fan_out((client_id, payload) for client_id in list(self._local)))
+
+    def _record_fanout(self, recipients, duration):
+        self.fanouts.append(duration)
+        if recipients > 1:
+            logging.info(
+                "Fan-out to %d sockets finished in %.1f ms.", recipients, duration * 1000, extra={"event": "fanout"}
+            )
+
+    # Broker
+    def peers(self):
+        """Broker sockets of the other live workers; stale ones are removed."""
+        if self._transport is None:
+            return []
+        peers = []
+        for entry in os.scandir(self.hub_dir):
+            if entry.path == self.path or not entry.name.startswith("worker-"):
+                continue
+            try:
+                os.kill(int(entry.name[len("worker-"):-len(".sock")]), 0)
+            except ProcessLookupError:
+                os.unlink(entry.path)
+                continue
+            except (ValueError, PermissionError):
+                pass
+            peers.append(entry.path)
+        return peers
+
+    def publish_refresh(self, client_ids):
+        """Tell the other workers these clients changed; True if any peer was told."""
+        client_ids = list(client_ids)
+        sent = False
+        start = 0
+        while start < len(client_ids):
+            # Client IDs are short, so size chunks by an upper bound per ID
+            chunk = client_ids[start:start + MAX_DATAGRAM // 64]
+            sent = self._publish({"kind": "refresh", "client_ids": chunk}) or sent
+            start += len(chunk)
+        return sent
+
+    def publish(self, kind, **fields):
+        """Send a message of a kind registered with set_handler to the other workers; True if any got it."""
+        return self._publish({"kind": kind, **fields})
+
+    def _publish(self, message):
+        peers = self.peers()
+        if not peers:
+            return False
+        data = json.dumps(message).encode()
+        sent = False
+        for peer in peers:
+            try:
+                self._transport.sendto(data, peer)
+                self.forwarded += 1
+                sent = True
+            except OSError as e:
+                logging.warning(f"WebSocket hub could not reach {peer}: {e!r}")
+        return sent
+
+    def _received(self, data):
+        self.received += 1
+        try:
+            message = json.loads(data)
+        except ValueError:
+            logging.error("WebSocket hub dropped an undecodable peer message.")
+            return
+        if message.get("kind") == "broadcast":
+            self._broadcast_local(message["message"])
+        elif message.get("kind") == "refresh" and self._refresh_handler is not None:
+            asyncio.ensure_future(self._refresh(message["client_ids"]))
+        elif message.get("kind") in self._handlers:
+            try:
+                self._handlers[message["kind"]](message)
+            except Exception as e:
+                logging.error(f"WebSocket hub {message['kind']} handler failed: {e}")
+
+    async def _refresh(self, client_ids):
+        try:
+            await self._refresh_handler(client_ids)
+        except Exception as e:
+            logging.error(f"WebSocket hub refresh failed: {e}")
+
+    def stats(self):
+        """Return hub counters for this worker."""
+        fanouts = sorted(self.fanouts)
+        return {
+            "worker": os.getpid(),
+            "connections": len(self._local),
+            "queued": sum(connection.queue.qsize() for connection in self._local.values()),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "send_failures": self.send_failures,
+            "peers": len(self.peers()),
+            "forwarded": self.forwarded,
+            "received": self.received,
+            "encodings": {
+                encoding: sum(1 for c in self._local.values() if c.encoding == encoding) for encoding in ENCODINGS
+            },
+            "fanout_ms": {
+                "count": len(fanouts),
+                "p50": fanouts[len(fanouts) // 2] * 1000 if fanouts else None,
+                "max": fanouts[-1] * 1000 if fanouts else None,
+            },
+        }
+
+
+# Shared hub for this worker, started with the app
+hub = WebSocketHub()